@@ -7,6 +7,10 @@ Adafruit_Fingerprint finger = Adafruit_Fingerprint(&mySerial);
 // For storing raw fingerprint data
 #define BUFF_SZ 512
 uint8_t packetBuffer[BUFF_SZ];
+uint16_t templateLength = 0;
+
+// Sensor command not wrapped by the Adafruit library: download a template into a char buffer
+#define SENSOR_DOWNCHAR 0x09
 
 void setup() {
   Serial.begin(9600);
@@ -14,6 +18,8 @@ void setup() {
 
   finger.begin(57600);
   if (finger.verifyPassword()) {
+    // Reads packet_len, needed to split template downloads into packets
+    finger.getParameters();
     Serial.println("{\"status\":\"ready\",\"message\":\"Fingerprint sensor connected\"}");
   } else {
     Serial.println("{\"status\":\"error\",\"message\":\"Sensor not found\"}");
@@ -27,7 +33,12 @@ void loop() {
 
     if (command.startsWith("REGISTER:")) {
       int id = command.substring(9).toInt();
-      registerFinger(id);
+      registerFinger(id, true);
+    } 
+    else if (command.startsWith("ENROLL:")) {
+      // Build the model and send it to the host without using a sensor slot
+      int id = command.substring(7).toInt();
+      registerFinger(id, false);
     } 
     else if (command == "VERIFY") {
       verifyFinger();
@@ -42,11 +53,21 @@ void loop() {
     else if (command == "DELETEALL") {
       deleteAllFingers();
     }
+    else if (command.startsWith("STORE:")) {
+      // Host-to-sensor: the hex template follows on the next line and is stored in the slot
+      int slot = command.substring(6).toInt();
+      storeTemplate(slot);
+    }
+    else if (command.startsWith("UPLOAD:")) {
+      // Sensor-to-host: send the template stored in the slot
+      int slot = command.substring(7).toInt();
+      uploadSlot(slot);
+    }
   }
   delay(100);
 }
 
-void registerFinger(int id) {
+void registerFinger(int id, bool store) {
   Serial.println("{\"status\":\"info\",\"message\":\"Place finger on sensor\"}");
 
   int p = -1;
@@ -112,14 +133,19 @@ if (p == FINGERPRINT_NOFINGER) {
     return;
   }
 
-  p = finger.storeModel(id);
-  if (p != FINGERPRINT_OK) {
-    Serial.print("{\"status\":\"error\",\"message\":\"Failed to store: ");
-    Serial.print(p);
-    Serial.println("\"}");
-    return;
+  if (store) {
+    p = finger.storeModel(id);
+    if (p != FINGERPRINT_OK) {
+      Serial.print("{\"status\":\"error\",\"message\":\"Failed to store: ");
+      Serial.print(p);
+      Serial.println("\"}");
+      return;
+    }
   }
 
+  // The model is still in char buffer 1; fetch it for host-side matching
+  bool haveTemplate = uploadTemplate();
+
   // Perform an identification to capture raw fingerprint data
   finger.fingerID = 0;
   finger.confidence = 0;
@@ -131,7 +157,11 @@ if (p == FINGERPRINT_NOFINGER) {
   Serial.print(id);
   Serial.print(",\"raw_encoding\":\"");
   Serial.print(fingerprintData);
-  Serial.println("\"}");
+  Serial.print("\"");
+  if (haveTemplate) {
+    printTemplateField();
+  }
+  Serial.println("}");
 }
 
 void verifyFinger() {
@@ -170,7 +200,12 @@ void verifyFinger() {
     Serial.print(fingerprintData);
     Serial.println("\"}");
   } else if (p == FINGERPRINT_NOTFOUND) {
-    Serial.println("{\"status\":\"not_found\",\"message\":\"No match found\"}");
+    // Send the probe along so the host can match it against templates not on the sensor
+    Serial.print("{\"status\":\"not_found\",\"message\":\"No match found\"");
+    if (uploadTemplate()) {
+      printTemplateField();
+    }
+    Serial.println("}");
   } else {
     Serial.print("{\"status\":\"error\",\"message\":\"Search error: ");
     Serial.print(p);
@@ -233,11 +268,184 @@ void downloadFingerprint() {
     return;
   }
   
+  bool haveTemplate = uploadTemplate();
   String fingerprintData = getFingerDataCharacteristics();
 
   Serial.print("{\"status\":\"success\",\"message\":\"Template captured\",\"raw_encoding\":\"");
   Serial.print(fingerprintData);
-  Serial.println("\"}");
+  Serial.print("\"");
+  if (haveTemplate) {
+    printTemplateField();
+  }
+  Serial.println("}");
+}
+
+// Read exactly count bytes from the sensor, giving up after timeoutMs
+bool readSensorBytes(uint8_t *buffer, uint16_t count, unsigned long timeoutMs) {
+  unsigned long start = millis();
+  uint16_t received = 0;
+  while (received < count) {
+    if (mySerial.available()) {
+      buffer[received++] = mySerial.read();
+    } else if (millis() - start > timeoutMs) {
+      return false;
+    }
+  }
+  return true;
+}
+
+// Upload char buffer 1 from the sensor into packetBuffer (the template the host matches against)
+bool uploadTemplate() {
+  templateLength = 0;
+  if (finger.getModel() != FINGERPRINT_OK) {
+    return false;
+  }
+
+  // Data packets: EF 01, 4-byte address, packet id, 2-byte length (payload + checksum), payload, checksum
+  uint8_t header[9];
+  uint8_t checksum[2];
+  bool last = false;
+  while (!last) {
+    if (!readSensorBytes(header, 9, 1000)) {
+      return false;
+    }
+    uint16_t payloadLength = (((uint16_t)header[7] << 8) | header[8]) - 2;
+    if (templateLength + payloadLength > BUFF_SZ) {
+      return false;
+    }
+    if (!readSensorBytes(packetBuffer + templateLength, payloadLength, 1000) ||
+        !readSensorBytes(checksum, 2, 1000)) {
+      return false;
+    }
+    templateLength += payloadLength;
+    last = header[6] == FINGERPRINT_ENDDATAPACKET;
+  }
+  return true;
+}
+
+// Write one packet to the sensor: EF 01, address, packet type, length, payload, checksum
+void writeSensorPacket(uint8_t type, const uint8_t *data, uint16_t length) {
+  uint16_t wireLength = length + 2;
+  uint16_t sum = type + (wireLength >> 8) + (wireLength & 0xFF);
+  mySerial.write((uint8_t)0xEF);
+  mySerial.write((uint8_t)0x01);
+  for (int i = 0; i < 4; i++) {
+    mySerial.write((uint8_t)0xFF);  // Default module address
+  }
+  mySerial.write(type);
+  mySerial.write((uint8_t)(wireLength >> 8));
+  mySerial.write((uint8_t)(wireLength & 0xFF));
+  for (uint16_t i = 0; i < length; i++) {
+    mySerial.write(data[i]);
+    sum += data[i];
+  }
+  mySerial.write((uint8_t)(sum >> 8));
+  mySerial.write((uint8_t)(sum & 0xFF));
+}
+
+// Download packetBuffer into char buffer 1 (the reverse of uploadTemplate)
+bool downloadTemplate() {
+  uint8_t command[2] = {SENSOR_DOWNCHAR, 0x01};
+  writeSensorPacket(FINGERPRINT_COMMANDPACKET, command, 2);
+
+  // Acknowledgement: 9-byte header, confirmation code, 2-byte checksum
+  uint8_t ack[12];
+  if (!readSensorBytes(ack, 12, 1000) || ack[6] != FINGERPRINT_ACKPACKET || ack[9] != FINGERPRINT_OK) {
+    return false;
+  }
+
+  uint16_t packetSize = finger.packet_len ? finger.packet_len : 128;
+  for (uint16_t offset = 0; offset < templateLength; offset += packetSize) {
+    uint16_t length = min(packetSize, (uint16_t)(templateLength - offset));
+    bool last = offset + length >= templateLength;
+    writeSensorPacket(last ? FINGERPRINT_ENDDATAPACKET : FINGERPRINT_DATAPACKET, packetBuffer + offset, length);
+  }
+  return true;
+}
+
+int hexValue(char c) {
+  if (c >= '0' && c <= '9') return c - '0';
+  if (c >= 'a' && c <= 'f') return c - 'a' + 10;
+  if (c >= 'A' && c <= 'F') return c - 'A' + 10;
+  return -1;
+}
+
+// Receive a hex template line from the host and store it in a sensor slot
+void storeTemplate(int slot) {
+  // The host waits for this before sending, so the hex line cannot overrun the receive buffer
+  Serial.println("{\"status\":\"info\",\"message\":\"Send template\"}");
+
+  // Decode the digits as they arrive; the line is too long to buffer as a String
+  templateLength = 0;
+  int high = -1;
+  unsigned long start = millis();
+  while (millis() - start < 5000) {
+    if (!Serial.available()) {
+      continue;
+    }
+    char c = Serial.read();
+    if (c == '\n') {
+      break;
+    }
+    int nibble = hexValue(c);
+    if (nibble < 0) {
+      continue;
+    }
+    if (high < 0) {
+      high = nibble;
+    } else {
+      if (templateLength < BUFF_SZ) {
+        packetBuffer[templateLength++] = (high << 4) | nibble;
+      }
+      high = -1;
+    }
+  }
+
+  if (templateLength == 0) {
+    Serial.println("{\"status\":\"error\",\"message\":\"No template received\"}");
+    return;
+  }
+  if (!downloadTemplate()) {
+    Serial.println("{\"status\":\"error\",\"message\":\"Template download to sensor failed\"}");
+    return;
+  }
+
+  int p = finger.storeModel(slot);
+  if (p == FINGERPRINT_OK) {
+    Serial.print("{\"status\":\"success\",\"message\":\"Template stored\",\"slot\":");
+    Serial.print(slot);
+    Serial.println("}");
+  } else {
+    Serial.print("{\"status\":\"error\",\"message\":\"Failed to store: ");
+    Serial.print(p);
+    Serial.println("\"}");
+  }
+}
+
+// Send the template stored in a slot to the host
+void uploadSlot(int slot) {
+  int p = finger.loadModel(slot);
+  if (p != FINGERPRINT_OK || !uploadTemplate()) {
+    Serial.print("{\"status\":\"error\",\"message\":\"Upload error: ");
+    Serial.print(p);
+    Serial.println("\"}");
+    return;
+  }
+
+  Serial.print("{\"status\":\"success\",\"message\":\"Template uploaded\",\"slot\":");
+  Serial.print(slot);
+  printTemplateField();
+  Serial.println("}");
+}
+
+// Print the uploaded template as a JSON field: ,"template":"<hex>"
+void printTemplateField() {
+  Serial.print(",\"template\":\"");
+  for (uint16_t i = 0; i < templateLength; i++) {
+    if (packetBuffer[i] < 16) Serial.print("0");
+    Serial.print(packetBuffer[i], HEX);
+  }
+  Serial.print("\"");
 }
 
 // Function to get fingerprint characteristics data
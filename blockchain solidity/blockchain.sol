@@ -49,6 +49,13 @@ contract BiometricVotingSystem {
     uint256[] private candidateIds;
     uint256[] private voterIds;
 
+    // Why castVotes skipped a vote
+    enum RejectReason { None, NotRegistered, AlreadyVoted, InvalidCandidate }
+
+    // Events
+    event VoteCast(uint256 indexed voterID);
+    event VoteRejected(uint256 indexed voterID, RejectReason reason);
+
     // Constructor
     constructor() {
         electionState = ElectionState.Registration;
@@ -78,6 +85,44 @@ contract BiometricVotingSystem {
 
         voters[voterID].hasVoted = true;
         candidates[candidateID].voteCount++;
+        emit VoteCast(voterID);
+    }
+
+    /**
+     * @dev Cast many votes in one transaction, e.g. from a polling station's vote gateway.
+     * Invalid votes are skipped with a VoteRejected event instead of reverting, so one
+     * bad vote does not undo the rest of the batch.
+     */
+    function castVotes(uint256[] calldata voterIDs, uint256[] calldata candidateIDs)
+        public
+        duringVoting
+        returns (uint256 accepted)
+    {
+        require(voterIDs.length == candidateIDs.length, "Length mismatch");
+
+        for (uint256 i = 0; i < voterIDs.length; i++) {
+            uint256 voterID = voterIDs[i];
+            uint256 candidateID = candidateIDs[i];
+
+            RejectReason reason = RejectReason.None;
+            if (!voters[voterID].exists) {
+                reason = RejectReason.NotRegistered;
+            } else if (voters[voterID].hasVoted) {
+                reason = RejectReason.AlreadyVoted;
+            } else if (!candidates[candidateID].exists) {
+                reason = RejectReason.InvalidCandidate;
+            }
+
+            if (reason != RejectReason.None) {
+                emit VoteRejected(voterID, reason);
+                continue;
+            }
+
+            voters[voterID].hasVoted = true;
+            candidates[candidateID].voteCount++;
+            emit VoteCast(voterID);
+            accepted++;
+        }
     }
 
     function startElection() public {
@@ -103,6 +103,8 @@ export default function VoterRegistration() {
       
       const formData = new FormData();
       formData.append("file", imageFile);
+      // Enrollment capture: the backend adds jitters only for low-quality frames
+      formData.append("enrollment_mode", "adaptive");
       
       const response = await axios.post("http://localhost:5000/api/encode_face", formData, {
         headers: {
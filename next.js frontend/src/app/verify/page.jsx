@@ -200,6 +200,8 @@ export default function VoteCasting() {
   const getFaceEncodingFromImage = async (imageFile) => {
     const formData = new FormData();
     formData.append("file", imageFile);
+    // Poor captures are rejected before encoding, with a reason the voter can act on
+    formData.append("quality_gate", "reject");
     
     const response = await axios.post("http://localhost:5000/api/encode_face", formData, {
       headers: {
@@ -237,7 +239,11 @@ export default function VoteCasting() {
       }
     } catch (error) {
       console.error("Error verifying face:", error);
-      setMessage("Failed to verify face");
+      if (error.response?.data?.quality) {
+        setMessage(`${error.response.data.message}. Please try again.`);
+      } else {
+        setMessage("Failed to verify face");
+      }
     }
   };
 
@@ -1,28 +1,183 @@
-from flask import Flask, request, jsonify
-import face_recognition
+from flask import Flask, request, jsonify, Response, stream_with_context, g
+import json
 import numpy as np
 import cv2
 from flask_cors import CORS
 import logging
+from logsetup import configure_logging
 from finger import FingerprintController
+from face import FaceRecognitionSystem
+from detectors import get_detector, detector_for_endpoint, list_detectors, calibrate_detectors, set_default_detector
+from encoders import get_encoder, list_encoders
+from preprocess import get_preprocessor
+from quality import choose_num_jitters, gate_face_quality, QualityGateError
+import liveness
+from liveness import LivenessError
+from batching import MicroBatcher, BATCHING_ENABLED
+import history
+import stats
+import stream
+import archive
+import vote_gateway
+import rostersync
+import traffic
+from scheduler import scheduled, request_scheduler, SchedulerBusy, SCHEDULER_ENABLED
+import profiler
+from profiler import ProfilerBusy
+import os
+import hmac
+import functools
+import time
+import queue
+from datetime import datetime, date
 from io import BytesIO
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Setup logging (queue-based; face and finger configure it on import, this keeps the levels in effect)
+configure_logging()
 logger = logging.getLogger("FaceEncodingAPI")
 
 app = Flask(__name__)
 
 CORS(app)  # Enable CORS for all routes
 
+# Admin-only endpoints need this token in the X-Admin-Token header; unset, they are disabled
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+@app.before_request
+def _track_request_for_profiler():
+    profiler.request_started(request.method, request.url_rule.rule if request.url_rule else None, request.path)
+
+@app.teardown_request
+def _untrack_request_for_profiler(error=None):
+    profiler.request_finished()
+
+# Opt-in recording of request shapes and timings for replay (see TRAFFIC_RECORD_FILE)
+traffic_recorder = traffic.get_recorder()
+
+if traffic_recorder is not None:
+    @app.before_request
+    def _start_traffic_record():
+        g.traffic_arrived = time.monotonic()
+
+    @app.after_request
+    def _record_traffic(response):
+        if 'traffic_arrived' in g:
+            traffic_recorder.capture(request, response.status_code,
+                                     time.monotonic() - g.traffic_arrived, g.traffic_arrived)
+        return response
+
+def require_admin(func):
+    """Refuse the request unless it carries the configured admin token"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({
+                "success": False,
+                "message": "Admin endpoints are disabled; set ADMIN_TOKEN to enable them"
+            }), 403
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+            return jsonify({
+                "success": False,
+                "message": "Admin token required"
+            }), 401
+        return func(*args, **kwargs)
+    return wrapper
+
+# WebSocket support is optional (pip install flask-sock); without it the
+# stream endpoints fall back to chunked frame uploads plus server-sent events
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    sock = Sock(app)
+except ImportError:
+    sock = None
+
 # Global fingerprint controller instance
 fingerprint_controller = None
 
-def process_image(image_data):
-    """Process image data and extract face encodings"""
+# Face roster (voter_registrations.json), created on first use
+face_system = None
+
+# Verifications logged from here on are counted by following the logs (any process may
+# write them); earlier ones are seeded from the logs
+stats.mark_process_start(history.open_verification_logs())
+
+def get_face_system():
+    """Return the shared FaceRecognitionSystem used for roster lookups"""
+    global face_system
+    if face_system is None:
+        face_system = FaceRecognitionSystem()
+    return face_system
+
+def compare_encoding_batch(items):
+    """Evaluate many (encoding1, encoding2, threshold) comparisons in one vectorized pass"""
+    first = np.array([item[0] for item in items], dtype=np.float64)
+    second = np.array([item[1] for item in items], dtype=np.float64)
+    
+    # Same row-wise norm face_recognition.face_distance computes, for every pair at once
+    distances = np.linalg.norm(first - second, axis=1)
+    
+    results = []
+    for (_, _, threshold), distance in zip(items, distances):
+        similarity_score = 1 - distance
+        results.append({
+            "similarity_score": float(similarity_score),
+            "is_match": bool(similarity_score >= threshold),
+            "threshold": float(threshold),
+            "face_distance": float(distance)
+        })
+    return results
+
+def identify_batch(items):
+    """Match many (encoding, threshold, top_k) probes against the roster with one matrix product"""
+    voter_ids, voter_names, matrix = get_face_system().get_roster_matrix()
+    distances = matrix.distances_many([item[0] for item in items])
+    
+    results = []
+    for (_, threshold, top_k), row in zip(items, distances):
+        similarities = 1 - row
+        hits = np.flatnonzero(similarities >= threshold)
+        hits = hits[np.argsort(-similarities[hits])][:top_k]
+        matches = [{"voter_id": voter_ids[i], "voter_name": voter_names[i],
+                    "similarity_score": float(similarities[i])} for i in hits]
+        results.append({
+            "is_match": bool(matches),
+            "best_match": matches[0] if matches else None,
+            "matches": matches,
+            "threshold": float(threshold),
+            "roster_size": len(voter_ids)
+        })
+    return results
+
+# Optional request coalescing (FACE_BATCHING=1): concurrent compare/identify calls that
+# arrive within FACE_BATCH_MAX_WAIT_MS are evaluated together
+compare_batcher = MicroBatcher(compare_encoding_batch, name="compare") if BATCHING_ENABLED else None
+identify_batcher = MicroBatcher(identify_batch, name="identify") if BATCHING_ENABLED else None
+
+def run_compare(encoding1, encoding2, threshold):
+    """Compare two encodings, through the micro-batcher when it is enabled"""
+    item = (encoding1, encoding2, threshold)
+    return compare_batcher(item) if compare_batcher else compare_encoding_batch([item])[0]
+
+def run_identify(encoding, threshold, top_k):
+    """Identify one encoding, through the micro-batcher when it is enabled"""
+    item = (encoding, threshold, top_k)
+    return identify_batcher(item) if identify_batcher else identify_batch([item])[0]
+
+def analyze_image(image_data, detector=None, enrollment_mode=None, quality_gate=None, liveness_mode=None):
+    """Process image data and return the face encoding with how it was produced
+
+    detector may be a backend name ('hog', 'cnn', 'haar', 'dnn', 'haar+hog'),
+    a FaceDetector instance, or None for the configured default.
+    enrollment_mode ('adaptive', 'fixed', 'throughput') picks num_jitters for
+    enrollment captures; verification captures leave it as None (one jitter).
+    quality_gate ('off', 'flag', 'reject', None for QUALITY_GATE) checks the
+    face before encoding; rejected faces raise QualityGateError.
+    liveness_mode ('off', 'flag', 'enforce', None for LIVENESS_MODE) runs the
+    liveness check alongside the encoding; it can only make LIVENESS_MODE
+    stricter. When enforced, a face not found to be live raises LivenessError.
+    """
     try:
         # Convert bytes to numpy array
         nparr = np.frombuffer(image_data, np.uint8)
@@ -33,11 +188,8 @@ def process_image(image_data):
         if img is None:
             raise ValueError("Could not decode image")
             
-        # Convert BGR to RGB (face_recognition uses RGB)
-        rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Find face locations
-        face_locations = face_recognition.face_locations(rgb_img)
+        # Find face locations on the decoded BGR image (no whole-frame color conversion)
+        face_locations = get_detector(detector).detect_bgr(img)
         
         if not face_locations:
             raise ValueError("No faces found in the image")
@@ -45,20 +197,129 @@ def process_image(image_data):
         if len(face_locations) > 1:
             raise ValueError("Multiple faces found. Please provide an image with only one face")
             
-        # Get face encodings
-        face_encodings = face_recognition.face_encodings(rgb_img, face_locations)
+        # Only the face region (plus margin) is converted to RGB (face_recognition uses RGB),
+        # into a per-thread buffer reused across requests
+        rgb_face, face_location = get_preprocessor().face_crop(img, face_locations[0])
+            
+        # Cheap quality checks before paying for the encoding
+        quality = gate_face_quality(rgb_face, face_location, quality_gate)
+            
+        # Liveness runs in the background while the face is encoded
+        liveness_mode = liveness.resolve_mode(liveness_mode)
+        liveness_future = liveness.check_async(rgb_face, face_location) if liveness_mode != "off" else None
+            
+        # Enrollment captures get mode-dependent jitters, verification captures a single pass
+        if enrollment_mode:
+            num_jitters, encoding_settings = choose_num_jitters(rgb_face, face_location, enrollment_mode, quality)
+        else:
+            num_jitters, encoding_settings = 1, {"mode": "verification", "num_jitters": 1}
+            
+        # Get face encodings with the deployment's encoder backend (FACE_ENCODER)
+        encoder = get_encoder()
+        face_encodings = encoder.encode(rgb_face, [face_location], num_jitters=num_jitters)
+        encoding_settings["encoder"] = encoder.name
         
         if not face_encodings:
             raise ValueError("Could not extract face encodings")
             
-        # Return the first face encoding (128-dimensional array)
-        return face_encodings[0]
+        # Only the final result waits for liveness
+        liveness_result = liveness.await_liveness(liveness_future, liveness_mode)
+            
+        # The first face encoding (128-dimensional array)
+        return {
+            "encoding": face_encodings[0],
+            "location": face_locations[0],
+            "encoding_settings": encoding_settings,
+            "quality": quality,
+            "liveness": liveness_result
+        }
+        
+    except (QualityGateError, LivenessError):
+        raise
         
     except Exception as e:
         logger.error(f"Error processing image: {str(e)}")
         raise
 
+def process_image(image_data, detector=None, enrollment_mode=None, quality_gate=None, liveness_mode=None):
+    """Process image data and extract face encodings"""
+    return analyze_image(image_data, detector, enrollment_mode, quality_gate, liveness_mode)["encoding"]
+
+def _encode_face_class():
+    """Encoding at the booth is interactive; registration captures send enrollment_mode"""
+    return "enrollment" if request.form.get('enrollment_mode') else "interactive"
+
+
+@app.errorhandler(SchedulerBusy)
+def scheduler_busy(error):
+    """Shed load instead of queueing past the class deadline; the client should retry"""
+    response = jsonify({
+        "success": False,
+        "message": str(error)
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def get_scheduler_stats():
+    """Running and waiting requests, rejections and latency percentiles per priority class"""
+    return jsonify({
+        "success": True,
+        "data": request_scheduler.stats()
+    })
+
+
+@app.route('/api/admin/profile', methods=['POST'])
+@require_admin
+def profile_backend():
+    """
+    Sample the running process's Python stacks and return them as collapsed stacks
+    JSON body: seconds (default 10), interval_ms, threads ('requests' or 'all'), or route
+    plus requests to profile the next K requests to one URL rule or path (seconds is then
+    the time limit). Returns text for flamegraph.pl/speedscope, or JSON with ?format=json.
+    Runs outside the request scheduler so it never holds a slot other requests need.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        route = data.get('route')
+        max_requests = data.get('requests')
+        seconds = data.get('seconds', 60 if route else 10)
+
+        session = profiler.profile(seconds=seconds, interval_ms=data.get('interval_ms'),
+                                   threads=data.get('threads', 'requests'), route=route,
+                                   max_requests=max_requests)
+        summary = session.summary()
+
+        if request.args.get('format') == 'json':
+            return jsonify({
+                "success": True,
+                "message": f"{summary['samples']} samples over {summary['duration_s']:.1f}s",
+                "data": dict(summary, collapsed=session.collapsed())
+            })
+
+        response = Response(session.collapsed(), mimetype='text/plain')
+        response.headers['X-Profile-Samples'] = str(summary['samples'])
+        response.headers['X-Profile-Duration'] = f"{summary['duration_s']:.3f}"
+        response.headers['X-Profile-Overhead'] = f"{summary['overhead'] or 0:.4f}"
+        return response
+
+    except ProfilerBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 409
+
+    except (TypeError, ValueError) as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error profiling: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
 @app.route('/api/encode_face', methods=['POST'])
+@scheduled(_encode_face_class)
 def encode_face():
     """Endpoint to receive an image and return face encodings"""
     try:
@@ -83,11 +344,23 @@ def encode_face():
         # Read the image file
         image_data = file.read()
         
+        # Detector can be chosen per request, otherwise the endpoint/global default is used
+        detector = detector_for_endpoint("encode_face", request.form.get('detector') or request.args.get('detector'))
+        
+        # Registration pages pass enrollment_mode so the encoding gets enrollment-grade jitters
+        enrollment_mode = request.form.get('enrollment_mode') or request.args.get('enrollment_mode')
+        
+        # Kiosks can ask for rejection of poor captures (quality_gate=reject) to retake at once
+        quality_gate = request.form.get('quality_gate') or request.args.get('quality_gate')
+        
+        # Liveness mode can be chosen per request as well (off, flag, enforce)
+        liveness_mode = request.form.get('liveness') or request.args.get('liveness')
+        
         # Process the image and get face encodings
-        face_encoding = process_image(image_data)
+        result = analyze_image(image_data, detector, enrollment_mode, quality_gate, liveness_mode)
         
         # Convert numpy array to list for JSON serialization
-        encoding_list = face_encoding.tolist()
+        encoding_list = result["encoding"].tolist()
         
         return jsonify({
             "success": True,
@@ -95,10 +368,32 @@ def encode_face():
             "data": {
                 "encoding": encoding_list,
                 "dimensions": len(encoding_list),
-                "face_detected": True
+                "face_detected": True,
+                "detector": detector.name,
+                "encoding_settings": result["encoding_settings"],
+                "quality": result["quality"],
+                "liveness": result["liveness"]
             }
         })
         
+    except LivenessError as le:
+        return jsonify({
+            "success": False,
+            "message": str(le),
+            "error": "Liveness check failed",
+            "face_detected": True,
+            "liveness": le.liveness
+        }), 400
+        
+    except QualityGateError as qe:
+        return jsonify({
+            "success": False,
+            "message": str(qe),
+            "error": "Face quality check failed",
+            "face_detected": True,
+            "quality": qe.quality
+        }), 400
+        
     except ValueError as ve:
         return jsonify({
             "success": False,
@@ -117,6 +412,7 @@ def encode_face():
         
         
 @app.route('/api/face/compare', methods=['POST'])
+@scheduled("interactive")
 def compare_faces():
     """
     Compare two face encodings and return similarity score
@@ -140,9 +436,9 @@ def compare_faces():
         # Get threshold (default 0.6 if not provided)
         threshold = float(data.get('threshold', 0.6))
 
-        # Convert lists to numpy arrays
-        enc1 = np.array(encoding1)
-        enc2 = np.array(encoding2)
+        # Convert lists to numpy arrays (numeric up front, so a bad request cannot fail a shared batch)
+        enc1 = np.array(encoding1, dtype=np.float64)
+        enc2 = np.array(encoding2, dtype=np.float64)
 
         # Verify encoding dimensions
         if len(enc1) != 128 or len(enc2) != 128:
@@ -151,37 +447,695 @@ def compare_faces():
                 "message": "Invalid encoding dimensions (expected 128)"
             }), 400
 
-        # Calculate face distance (lower is better match)
-        face_distance = face_recognition.face_distance([enc2], enc1)[0]
-        
-        # Convert distance to similarity score (higher is better match)
-        similarity_score = 1 - face_distance
-
-        # Determine if match based on threshold
-        is_match = similarity_score >= threshold
+        # Face distance, similarity (1 - distance) and match decision, batched with
+        # other in-flight comparisons when micro-batching is enabled
+        result = run_compare(enc1, enc2, threshold)
 
         return jsonify({
             "success": True,
             "message": "Face comparison completed",
+            "data": result
+        })
+
+    except Exception as e:
+        logger.error(f"Error in face comparison: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/face/identify', methods=['POST'])
+@scheduled("interactive")
+def identify_face():
+    """
+    Find the registered voters matching an encoding (1:N against the whole roster)
+    Expects JSON with 'encoding', optional 'threshold' and 'top_k'
+    """
+    try:
+        data = request.json
+        if not data or not data.get('encoding'):
+            return jsonify({"success": False, "message": "Encoding is required"}), 400
+
+        encoding = np.array(data['encoding'], dtype=np.float64)
+        if encoding.shape != (128,):
+            return jsonify({
+                "success": False,
+                "message": "Invalid encoding dimensions (expected 128)"
+            }), 400
+
+        threshold = float(data.get('threshold', 0.6))
+        top_k = max(1, int(data.get('top_k', 5)))
+
+        result = run_identify(encoding, threshold, top_k)
+
+        return jsonify({
+            "success": True,
+            "message": "Voter identified" if result["is_match"] else "No matching voter found",
+            "data": result
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error identifying face: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+@app.route('/api/face/batching', methods=['GET'])
+def get_batching_stats():
+    """Report whether micro-batching is on and how large the coalesced batches are"""
+    return jsonify({
+        "success": True,
+        "data": {
+            "enabled": BATCHING_ENABLED,
+            "compare": compare_batcher.stats() if compare_batcher else None,
+            "identify": identify_batcher.stats() if identify_batcher else None
+        }
+    })
+
+@app.route('/api/face/duplicates', methods=['POST'])
+@scheduled("bulk")
+def find_face_duplicates():
+    """
+    Scan an encoding against the whole registered roster for near-duplicates
+    Expects JSON with 'encoding', optional 'threshold' and 'exclude_voter_id'
+    """
+    try:
+        data = request.json
+        if not data or not data.get('encoding'):
+            return jsonify({"success": False, "message": "Encoding is required"}), 400
+
+        encoding = np.array(data['encoding'])
+        if len(encoding) != 128:
+            return jsonify({
+                "success": False,
+                "message": "Invalid encoding dimensions (expected 128)"
+            }), 400
+
+        threshold = data.get('threshold')
+        threshold = float(threshold) if threshold is not None else None
+
+        duplicates = get_face_system().find_duplicate_registrations(
+            encoding, threshold, exclude_id=data.get('exclude_voter_id')
+        )
+
+        return jsonify({
+            "success": True,
+            "message": f"{len(duplicates)} possible duplicate(s) found",
             "data": {
-                "similarity_score": float(similarity_score),
-                "is_match": bool(is_match),
-                "threshold": float(threshold),
-                "face_distance": float(face_distance)
+                "is_duplicate": bool(duplicates),
+                "duplicates": [{"voter_id": voter_id, "similarity_score": similarity}
+                               for voter_id, similarity in duplicates]
             }
         })
 
     except Exception as e:
-        logger.error(f"Error in face comparison: {str(e)}")
+        logger.error(f"Error scanning for duplicate faces: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/face/detectors', methods=['GET'])
+def get_face_detectors():
+    """List the face detector backends and whether they can run on this server"""
+    return jsonify({
+        "success": True,
+        "data": {"detectors": list_detectors()}
+    })
+
+
+@app.route('/api/face/encoders', methods=['GET'])
+def get_face_encoders():
+    """List the face encoder backends and whether they can run on this server"""
+    return jsonify({
+        "success": True,
+        "data": {"encoders": list_encoders()}
+    })
+
+
+@app.route('/api/face/detectors/calibrate', methods=['POST'])
+@require_admin
+@scheduled("bulk")
+def calibrate_face_detectors():
+    """
+    Pick the fastest detector meeting a recall threshold on uploaded sample images (requires the X-Admin-Token header)
+    Expects one or more 'files', optional 'recall_threshold', 'reference' and 'apply'
+    """
+    try:
+        files = request.files.getlist('files')
+        if not files:
+            return jsonify({
+                "success": False,
+                "message": "Please provide sample images with the 'files' key"
+            }), 400
+
+        samples = []
+        for file in files:
+            img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                samples.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+        if not samples:
+            return jsonify({"success": False, "message": "None of the uploaded images could be decoded"}), 400
+
+        recall_threshold = float(request.form.get('recall_threshold', 0.95))
+        reference = request.form.get('reference', 'hog')
+
+        report = calibrate_detectors(samples, recall_threshold=recall_threshold, reference=reference)
+
+        # Optionally make the selected backend the new process-wide default
+        if request.form.get('apply', '').lower() in ('1', 'true', 'yes'):
+            set_default_detector(report['selected'])
+            report['applied'] = True
+
+        return jsonify({
+            "success": True,
+            "message": f"Selected detector: {report['selected']}",
+            "data": report
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error calibrating face detectors: {str(e)}")
         return jsonify({
             "success": False,
             "message": f"Server error: {str(e)}"
         }), 500
         
         
-        
-        
+@app.route('/api/verifications', methods=['GET'])
+@require_admin
+@scheduled("bulk")
+def get_verifications():
+    """
+    Page through face and fingerprint verification history, oldest first (requires the X-Admin-Token header)
+    Query parameters: cursor, limit, start, end (epoch or ISO 8601), voter_id,
+    source (face, fingerprint or all) and format (json or ndjson)
+    """
+    try:
+        logs = history.open_verification_logs()
+
+        source = request.args.get('source', 'all')
+        if source != 'all':
+            if source not in logs:
+                return jsonify({"success": False, "message": f"Unknown source '{source}'"}), 400
+            logs = {source: logs[source]}
+
+        cursor = request.args.get('cursor')
+        start = history.parse_time(request.args.get('start'))
+        end = history.parse_time(request.args.get('end'))
+        voter_id = request.args.get('voter_id')
+
+        # Validate the cursor before a streaming response has started
+        positions = history.decode_cursor(cursor)
+
+        if request.args.get('format') == 'ndjson':
+            # Stream every matching record; the last line carries the cursor to resume from
+            limit = request.args.get('limit', type=int)
+
+            def generate():
+                last_positions = positions
+                sent = 0
+                for last_positions, record in history.iter_verifications(logs, positions, start, end, voter_id):
+                    yield json.dumps(record) + "\n"
+                    sent += 1
+                    if limit and sent >= limit:
+                        break
+                yield json.dumps({"next_cursor": history.encode_cursor(last_positions) if last_positions else cursor}) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        limit = request.args.get('limit', history.DEFAULT_PAGE_SIZE, type=int)
+        records, next_cursor = history.get_page(logs, cursor, limit, start, end, voter_id)
+
+        return jsonify({
+            "success": True,
+            "message": f"{len(records)} verification record(s)",
+            "data": {
+                "records": records,
+                "next_cursor": next_cursor,
+                "has_more": len(records) >= min(max(1, limit), history.MAX_PAGE_SIZE)
+            }
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error reading verification history: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+def _seed_verification_stats():
+    """Count today's verifications logged before this process started (once)"""
+    start_of_day = datetime.combine(date.today(), datetime.min.time()).timestamp()
+    stats.bootstrap_from_logs(history.open_verification_logs(), since=start_of_day)
+
+
+@app.route('/api/stats/verifications', methods=['GET'])
+def get_verification_stats():
+    """Return the incrementally maintained turnout and verification aggregates"""
+    try:
+        _seed_verification_stats()
+        stats.tail_logs()
+        return jsonify({
+            "success": True,
+            "data": stats.verification_stats.snapshot()
+        })
+
+    except Exception as e:
+        logger.error(f"Error reading verification stats: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/stats/stream', methods=['GET'])
+def stream_verification_stats():
+    """Server-sent events: a snapshot, then every verification event and periodic snapshots"""
+    _seed_verification_stats()
+    subscriber = stats.verification_stats.subscribe()
+    stats.tail_logs()
+
+    def generate():
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(stats.verification_stats.snapshot())}\n\n"
+            last_snapshot = last_sent = time.time()
+            while True:
+                # Pick up verifications logged by other processes (e.g. the face.py check-in loop)
+                stats.tail_logs()
+                try:
+                    event = subscriber.get(timeout=stats.LOG_TAIL_INTERVAL)
+                    yield f"event: verification\ndata: {json.dumps(event)}\n\n"
+                    last_sent = time.time()
+                except queue.Empty:
+                    # Keep proxies from closing an idle connection
+                    if time.time() - last_sent >= 15:
+                        yield ": keepalive\n\n"
+                        last_sent = time.time()
+
+                # Refresh the rates at most every 5 seconds, however busy the stream is
+                if time.time() - last_snapshot >= 5:
+                    yield f"event: snapshot\ndata: {json.dumps(stats.verification_stats.snapshot())}\n\n"
+                    last_snapshot = time.time()
+        finally:
+            stats.verification_stats.unsubscribe(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _open_stream_session(args):
+    """Create a stream session from 'detector', 'threshold', 'quality_gate' and 'liveness' request parameters"""
+    detector = detector_for_endpoint('stream', args.get('detector'))
+    threshold = float(args.get('threshold', 0.6))
+    return stream.create_session(get_face_system(), detector=detector, threshold=threshold,
+                                 quality_gate=args.get('quality_gate'), liveness_mode=args.get('liveness'))
+
+
+def _run_stream_socket(ws):
+    """Serve one WebSocket stream session until the client closes it"""
+    try:
+        session = _open_stream_session(request.args)
+    except (ValueError, stream.SessionLimitReached) as e:
+        ws.send(json.dumps({"type": "error", "message": str(e)}))
+        return
+
+    try:
+        ws.send(json.dumps({"type": "ready", "session_id": session.session_id}))
+        while True:
+            # Short receive timeout so events go out while the client is between frames
+            message = ws.receive(timeout=0.02)
+            if message is not None:
+                # Any message keeps the session from being reaped as idle
+                session.last_activity = time.time()
+            if isinstance(message, (bytes, bytearray)):
+                try:
+                    session.submit_frame(bytes(message))
+                except ValueError as ve:
+                    # The session was closed under the socket (idle reaper or close_session)
+                    ws.send(json.dumps({"type": "error", "message": str(ve)}))
+                    ws.close(reason=1001, message="Stream session closed")
+                    break
+            elif message is not None and message.strip().lower() == 'close':
+                break
+
+            for event in session.drain_events():
+                ws.send(json.dumps(event))
+    except ConnectionClosed:
+        pass
+    finally:
+        stats_report = session.stats()
+        stream.close_session(session.session_id)
+        logger.info(f"Stream session {session.session_id} ended: {stats_report}")
+
+
+if sock is not None:
+    @sock.route('/api/face/stream/ws')
+    def face_stream_socket(ws):
+        """
+        Live verification over a WebSocket
+        The client sends JPEG frames as binary messages and receives JSON events
+        ('faces', 'match', 'verified', 'no_match', 'quality', 'face_lost', 'error');
+        a text message 'close' ends the session
+        """
+        if not SCHEDULER_ENABLED:
+            return _run_stream_socket(ws)
+
+        # The socket holds a stream slot for its whole life, like a chunked frame upload
+        try:
+            with request_scheduler.slot("stream"):
+                return _run_stream_socket(ws)
+        except SchedulerBusy as busy:
+            ws.send(json.dumps({"type": "error", "message": str(busy)}))
+
+
+@app.route('/api/face/stream/sessions', methods=['POST'])
+def open_face_stream():
+    """
+    Open a live verification session for clients without WebSocket support
+    Accepts optional 'detector', 'threshold', 'quality_gate' and 'liveness';
+    frames go to .../frames, events come from .../events. Returns 503 once
+    STREAM_MAX_SESSIONS sessions are open
+    """
+    try:
+        params = request.get_json(silent=True) or request.args
+        session = _open_stream_session(params)
+        return jsonify({
+            "success": True,
+            "message": "Stream session opened",
+            "data": {
+                "session_id": session.session_id,
+                "frames_url": f"/api/face/stream/{session.session_id}/frames",
+                "events_url": f"/api/face/stream/{session.session_id}/events",
+                "websocket_available": sock is not None
+            }
+        })
+
+    except stream.SessionLimitReached as full:
+        response = jsonify({"success": False, "message": str(full)})
+        response.headers['Retry-After'] = str(stream.SESSION_IDLE_SECONDS)
+        return response, 503
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error opening stream session: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/face/stream/<session_id>/frames', methods=['POST'])
+@scheduled("stream")
+def upload_face_stream_frames(session_id):
+    """
+    Feed frames to a stream session
+    The body is either one JPEG (image/jpeg) or, for a long-lived chunked upload,
+    a sequence of 4-byte big-endian lengths each followed by a JPEG (application/octet-stream)
+    """
+    try:
+        session = stream.get_session(session_id)
+    except KeyError:
+        return jsonify({"success": False, "message": "Unknown or expired stream session"}), 404
+
+    try:
+        if request.mimetype == 'image/jpeg':
+            frames = [request.get_data()]
+        else:
+            frames = stream.read_frames(request.stream)
+
+        accepted = 0
+        for frame in frames:
+            session.submit_frame(frame)
+            accepted += 1
+
+        return jsonify({
+            "success": True,
+            "message": f"{accepted} frame(s) received",
+            "data": session.stats()
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error receiving stream frames: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/face/stream/<session_id>/events', methods=['GET'])
+def face_stream_events(session_id):
+    """Server-sent events for a stream session: match results as frames are processed"""
+    try:
+        session = stream.get_session(session_id)
+    except KeyError:
+        return jsonify({"success": False, "message": "Unknown or expired stream session"}), 404
+
+    def generate():
+        while not session.closed:
+            event = session.next_event(timeout=15)
+            if event is None:
+                # Keep proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        yield f"event: closed\ndata: {json.dumps(session.stats())}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/face/stream/<session_id>', methods=['DELETE'])
+def close_face_stream(session_id):
+    """Close a stream session and return its frame statistics"""
+    session = stream.close_session(session_id)
+    if session is None:
+        return jsonify({"success": False, "message": "Unknown or expired stream session"}), 404
+
+    return jsonify({
+        "success": True,
+        "message": "Stream session closed",
+        "data": session.stats()
+    })
+
+
+@app.route('/api/roster/export', methods=['GET'])
+@require_admin
+@scheduled("bulk")
+def export_roster_archive():
+    """
+    Stream the face and fingerprint rosters as a compact archive (requires the X-Admin-Token header)
+    Optional query parameters faces and fingerprints (default true) select the parts;
+    the archive header records which parts it holds
+    """
+    try:
+        include_faces = request.args.get('faces', 'true').lower() != 'false'
+        include_fingerprints = request.args.get('fingerprints', 'true').lower() != 'false'
+        chunks = archive.export_stores(include_faces, include_fingerprints)
+
+        filename = f"roster-{stats.STATION_ID}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.vrst"
+        return Response(stream_with_context(chunks), mimetype='application/octet-stream',
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    except Exception as e:
+        logger.error(f"Error exporting roster archive: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/roster/import', methods=['POST'])
+@require_admin
+@scheduled("bulk")
+def import_roster_archive():
+    """
+    Load a roster archive into the local face and fingerprint rosters (requires the X-Admin-Token header)
+    The archive is the request body (application/octet-stream) or an 'archive' file upload;
+    optional 'mode' is replace (default) or merge. Parts the archive does not hold are left
+    untouched in either mode and listed in data.untouched
+    """
+    try:
+        mode = request.args.get('mode') or request.form.get('mode') or 'replace'
+        source = request.files['archive'].stream if 'archive' in request.files else request.stream
+
+        # Records are staged as they arrive; nothing is written until the whole archive verifies
+        result = archive.import_roster(source, mode, get_face_system())
+
+        message = f"Imported {result['faces']} face and {result['fingerprints']} fingerprint registration(s)"
+        if result["untouched"]:
+            message += f"; left {' and '.join(result['untouched'])} untouched"
+        return jsonify({
+            "success": True,
+            "message": message,
+            "data": result
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error importing roster archive: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+def _roster_class():
+    """Kiosk delta polls (mostly 304s) are cheap and run with the booth; first full copies are bulk"""
+    return "interactive" if request.args.get('since') else "bulk"
+
+
+@app.route('/api/roster', methods=['GET'])
+@scheduled(_roster_class)
+def get_roster():
+    """
+    Registered voters for kiosks keeping a local copy in sync
+    Query parameters: since (roster version the client holds) and epoch (from its last response).
+    Returns only records changed since that version plus the IDs of deleted voters; 'full' marks
+    a complete copy that replaces the client's. Send the last ETag as If-None-Match to get a 304
+    when nothing changed. Responses are gzip-compressed when the client accepts it.
+    """
+    try:
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                raise ValueError(f"Invalid roster version '{since}'")
+
+        versions = rostersync.get_roster_versions()
+        versions.refresh()
+        if request.if_none_match.contains(versions.etag()):
+            response = Response(status=304)
+            response.set_etag(versions.etag())
+            return response
+
+        changes = versions.changes_since(since, request.args.get('epoch'))
+        body, encoding = rostersync.encode_body({
+            "success": True,
+            "message": f"{len(changes['records'])} record(s), {len(changes['deleted'])} deletion(s)",
+            "data": changes
+        }, 'gzip' in request.accept_encodings)
+
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        response.set_etag(f"{changes['epoch']}-{changes['version']}")
+        return response
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error reading roster changes: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/votes', methods=['POST'])
+@scheduled("interactive")
+def submit_vote():
+    """
+    Queue a vote for the station's batched castVotes transactions
+    Expects JSON {"voter_id": ..., "candidate_id": ...}; the voter must have passed face or
+    fingerprint verification within VOTE_VERIFICATION_WINDOW seconds. Returns 202 with the
+    vote's state; poll /api/votes/<voter_id> for confirmation.
+    """
+    try:
+        data = request.json or {}
+        voter_id = data.get('voter_id')
+        candidate_id = data.get('candidate_id')
+        if voter_id is None or candidate_id is None:
+            return jsonify({
+                "success": False,
+                "message": "voter_id and candidate_id are required"
+            }), 400
+
+        since = time.time() - vote_gateway.VOTE_VERIFICATION_WINDOW
+        if history.last_successful_verification(voter_id, since) is None:
+            return jsonify({
+                "success": False,
+                "message": f"Voter {voter_id} has no successful verification in the last "
+                           f"{vote_gateway.VOTE_VERIFICATION_WINDOW:.0f} seconds"
+            }), 403
+
+        vote = vote_gateway.get_vote_gateway().submit(voter_id, candidate_id)
+        return jsonify({
+            "success": True,
+            "message": "Vote queued for submission",
+            "data": vote
+        }), 202
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+    except Exception as e:
+        logger.error(f"Error queueing vote: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/votes/<int:voter_id>', methods=['GET'])
+@scheduled("interactive")
+def get_vote_status(voter_id):
+    """State of a voter's vote: queued, sending, submitted, confirmed, rejected or failed"""
+    try:
+        vote = vote_gateway.get_vote_gateway().status(voter_id)
+        if vote is None:
+            return jsonify({
+                "success": False,
+                "message": f"No vote from voter {voter_id} through this station"
+            }), 404
+
+        return jsonify({
+            "success": True,
+            "data": vote
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+
+@app.route('/api/votes/stats', methods=['GET'])
+def get_vote_gateway_stats():
+    """Queue depth, in-flight transactions, batch sizes and confirmation latency of the vote gateway"""
+    try:
+        return jsonify({
+            "success": True,
+            "data": vote_gateway.get_vote_gateway().stats()
+        })
+
+    except ValueError as ve:
+        return jsonify({"success": False, "message": str(ve)}), 400
+
+
 @app.route('/api/fingerprint/init', methods=['POST'])
+@scheduled("interactive")
 def init_fingerprint():
     """Initialize the fingerprint sensor with the provided port"""
     global fingerprint_controller
@@ -212,6 +1166,7 @@ def init_fingerprint():
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
 
 @app.route('/api/fingerprint/register', methods=['POST'])
+@scheduled("enrollment")
 def register_fingerprint():
     """Register a new fingerprint"""
     global fingerprint_controller
@@ -268,6 +1223,7 @@ def register_fingerprint():
 
 
 @app.route('/api/fingerprint/delete_all', methods=['POST'])
+@scheduled("admin")
 def delete_all_fingerprint_data():
     """Delete all fingerprint data from the sensor and local files"""
     global fingerprint_controller
@@ -299,6 +1255,7 @@ def delete_all_fingerprint_data():
         }), 500
         
 @app.route('/api/fingerprint/verify', methods=['POST'])
+@scheduled("interactive")
 def verify_fingerprint():
     """Verify a fingerprint and return the matched ID or default (1000)"""
     global fingerprint_controller
@@ -345,6 +1302,7 @@ def verify_fingerprint():
             "message": f"Server error: {str(e)}"
         }), 500
 @app.route('/api/fingerprint/delete/<int:voter_id>', methods=['DELETE'])
+@scheduled("admin")
 def delete_voter_fingerprint(voter_id):
     """Delete a specific voter's fingerprint by ID"""
     global fingerprint_controller
@@ -378,6 +1336,7 @@ def delete_voter_fingerprint(voter_id):
         }), 500
         
 @app.route('/api/fingerprint/restart', methods=['POST'])
+@scheduled("admin")
 def restart_fingerprint_system():
     """Erase all fingerprint data and restart the system"""
     global fingerprint_controller
@@ -407,6 +1366,71 @@ def restart_fingerprint_system():
             "message": f"Server error: {str(e)}"
         }), 500        
         
+
+@app.route('/api/fingerprint/preload', methods=['POST'])
+@scheduled("admin")
+def preload_fingerprints():
+    """Load the templates of the voters expected next into the sensor's slots (cache mode)"""
+    global fingerprint_controller
+    
+    try:
+        if not fingerprint_controller:
+            return jsonify({
+                "success": False,
+                "message": "Fingerprint sensor not initialized"
+            }), 400
+        
+        data = request.json or {}
+        voter_ids = data.get('voter_ids')
+        if not isinstance(voter_ids, list):
+            return jsonify({
+                "success": False,
+                "message": "voter_ids must be a list, in expected check-in order"
+            }), 400
+        
+        plan = fingerprint_controller.preload_templates(voter_ids)
+        return jsonify({
+            "success": True,
+            "message": f"Queued {plan['queued']} template(s) for the sensor",
+            "data": plan
+        })
+    
+    except ValueError as e:
+        return jsonify({
+            "success": False,
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error preloading fingerprint templates: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": f"Server error: {str(e)}"
+        }), 500
+
+
+@app.route('/api/fingerprint/cache', methods=['GET'])
+def fingerprint_cache_stats():
+    """Sensor slot cache occupancy and hit rate"""
+    global fingerprint_controller
+    
+    if not fingerprint_controller:
+        return jsonify({
+            "success": False,
+            "message": "Fingerprint sensor not initialized"
+        }), 400
+    
+    cache_stats = fingerprint_controller.slot_cache_stats()
+    if cache_stats is None:
+        return jsonify({
+            "success": False,
+            "message": "Sensor slot caching is off; set FINGERPRINT_MATCHER=cache"
+        }), 400
+    
+    return jsonify({
+        "success": True,
+        "data": cache_stats
+    })
+        
         
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
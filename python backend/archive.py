@@ -0,0 +1,458 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from storage import open_store
+from roster import CompactRoster
+from stats import STATION_ID
+
+logger = logging.getLogger("RosterArchive")
+
+# Archive layout (all integers little-endian):
+#   magic "VRST" + uint16 format version
+#   chunks: 4-byte tag, uint32 payload length, payload, uint32 CRC32 of the payload
+#   HEAD  JSON header (station, creation time, encoding dtype and width)
+#   FMET  zlib JSON list of face registrations without their encodings
+#   FENC  float32 centroid rows for those registrations
+#   FTMP  uint32 count, int32 owner row per template, float32 template rows
+#   PMET  zlib JSON list of fingerprint registrations without their templates
+#   PTMP  zlib of uint32-length-prefixed fingerprint templates, in PMET order
+#   END   JSON counts plus the SHA-256 of every byte before this chunk
+#   HEAD "contents" says which parts were exported; an absent part is not an empty one
+# Face and fingerprint chunks repeat every ARCHIVE_CHUNK_ROWS records, so neither
+# side ever holds more than one chunk of encoded output in memory.
+ARCHIVE_MAGIC = b"VRST"
+ARCHIVE_VERSION = 1
+ARCHIVE_CHUNK_ROWS = int(os.environ.get("ROSTER_ARCHIVE_CHUNK_ROWS", 4096))
+ENCODING_DIMENSIONS = 128
+
+IMPORT_MODES = ("replace", "merge")
+
+_CHUNK_HEADER = struct.Struct("<4sI")
+_UINT32 = struct.Struct("<I")
+_UINT16 = struct.Struct("<H")
+
+
+class ArchiveError(ValueError):
+    """The archive is truncated, corrupt or from an unsupported format version"""
+
+
+def _chunk(tag, payload):
+    return _CHUNK_HEADER.pack(tag, len(payload)) + payload + _UINT32.pack(zlib.crc32(payload))
+
+
+def _pack_json(data):
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack_json(payload):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def _decode_encoding(value):
+    """Stored face features (JSON string or list) as a float32 row, or None if unusable"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    if value is None:
+        return None
+    row = np.asarray(value, dtype=np.float32)
+    return row if row.shape == (ENCODING_DIMENSIONS,) else None
+
+
+def _face_chunks(registrations, first_row):
+    """FMET/FENC/FTMP payloads for one slice of face registrations; returns (chunks, rows, templates, skipped)"""
+    metadata = []
+    centroids = []
+    owners = []
+    template_rows = []
+    skipped = 0
+
+    for reg in registrations:
+        centroid = _decode_encoding(reg.get("face_features"))
+        if centroid is None:
+            logger.warning(f"Not exporting voter {reg.get('voter_id')}: no usable face encoding")
+            skipped += 1
+            continue
+
+        record = {key: value for key, value in reg.items() if key not in ("face_features", "face_templates")}
+        if "face_templates" in reg:
+            # Template settings stay in the metadata; the template vectors go to FTMP in the same order
+            record["face_templates"] = []
+            for template in reg["face_templates"]:
+                row = _decode_encoding(template.get("features"))
+                if row is None:
+                    continue
+                record["face_templates"].append({k: v for k, v in template.items() if k != "features"})
+                owners.append(first_row + len(centroids))
+                template_rows.append(row)
+
+        metadata.append(record)
+        centroids.append(centroid)
+
+    centroid_matrix = np.array(centroids, dtype="<f4").reshape(-1, ENCODING_DIMENSIONS)
+    template_matrix = np.array(template_rows, dtype="<f4").reshape(-1, ENCODING_DIMENSIONS)
+    chunks = [
+        _chunk(b"FMET", _pack_json(metadata)),
+        _chunk(b"FENC", centroid_matrix.tobytes()),
+        _chunk(b"FTMP", _UINT32.pack(len(owners)) + np.array(owners, dtype="<i4").tobytes()
+               + template_matrix.tobytes())
+    ]
+    return chunks, len(centroids), len(owners), skipped
+
+
+def _fingerprint_chunks(registrations):
+    metadata = []
+    templates = []
+    for reg in registrations:
+        metadata.append({key: value for key, value in reg.items() if key != "fingerprintEncoding"})
+        template = (reg.get("fingerprintEncoding") or "").encode("utf-8")
+        templates.append(_UINT32.pack(len(template)) + template)
+    return [_chunk(b"PMET", _pack_json(metadata)), _chunk(b"PTMP", zlib.compress(b"".join(templates)))]
+
+
+def export_roster(face_registrations=None, fingerprint_registrations=None, chunk_rows=None):
+    """Yield the archive as byte strings, one chunk group at a time
+
+    Works from lists or any iterable of records (such as a store's
+    iter_records()); callers stream the pieces to a file or an HTTP response as
+    they are produced. A part passed as None is left out and the header says
+    so, which keeps an import from taking it for an empty roster.
+    """
+    chunk_rows = max(1, chunk_rows or ARCHIVE_CHUNK_ROWS)
+    digest = hashlib.sha256()
+
+    def emit(data):
+        digest.update(data)
+        return data
+
+    header = {
+        "format": "voter-roster",
+        "version": ARCHIVE_VERSION,
+        "created": datetime.now().isoformat(),
+        "station_id": STATION_ID,
+        "dtype": "float32",
+        "dimensions": ENCODING_DIMENSIONS,
+        "chunk_rows": chunk_rows,
+        "contents": {
+            "faces": face_registrations is not None,
+            "fingerprints": fingerprint_registrations is not None
+        }
+    }
+    yield emit(ARCHIVE_MAGIC + _UINT16.pack(ARCHIVE_VERSION))
+    yield emit(_chunk(b"HEAD", json.dumps(header).encode("utf-8")))
+
+    counts = {"faces": 0, "face_templates": 0, "fingerprints": 0, "skipped": 0}
+
+    batch = []
+    for reg in face_registrations or ():
+        batch.append(reg)
+        if len(batch) == chunk_rows:
+            chunks, rows, templates, skipped = _face_chunks(batch, counts["faces"])
+            counts["faces"] += rows
+            counts["face_templates"] += templates
+            counts["skipped"] += skipped
+            yield emit(b"".join(chunks))
+            batch = []
+    if batch:
+        chunks, rows, templates, skipped = _face_chunks(batch, counts["faces"])
+        counts["faces"] += rows
+        counts["face_templates"] += templates
+        counts["skipped"] += skipped
+        yield emit(b"".join(chunks))
+
+    batch = []
+    for reg in fingerprint_registrations or ():
+        batch.append(reg)
+        if len(batch) == chunk_rows:
+            counts["fingerprints"] += len(batch)
+            yield emit(b"".join(_fingerprint_chunks(batch)))
+            batch = []
+    if batch:
+        counts["fingerprints"] += len(batch)
+        yield emit(b"".join(_fingerprint_chunks(batch)))
+
+    counts["sha256"] = digest.hexdigest()
+    yield _chunk(b"END ", json.dumps(counts).encode("utf-8"))
+
+
+def _face_records(metadata, centroids, templates):
+    """Face records in the registrations-file format (encodings as JSON strings)
+
+    templates holds the template rows of each record, in metadata order.
+    """
+    records = []
+    for record, centroid, rows in zip(metadata, centroids, templates):
+        record = dict(record)
+        record["face_features"] = json.dumps(centroid.tolist())
+        if "face_templates" in record:
+            record["face_templates"] = [dict(settings, features=json.dumps(row.tolist()))
+                                        for settings, row in zip(record["face_templates"], rows)]
+        records.append(record)
+    return records
+
+
+def _read_exact(stream, size):
+    """Read exactly size bytes; file objects and WSGI input may return short reads"""
+    parts = []
+    remaining = size
+    while remaining:
+        part = stream.read(remaining)
+        if not part:
+            raise ArchiveError("Archive is truncated")
+        parts.append(part)
+        remaining -= len(part)
+    return b"".join(parts)
+
+
+def iter_archive(stream):
+    """Read an archive from a binary stream, yielding its parts as the chunks arrive
+
+    Yields ("header", header) first, then one ("faces", (metadata, centroids,
+    templates)) per face chunk group - float32 centroid rows and, per record,
+    its template rows - and one ("fingerprints", records) per fingerprint chunk
+    group, and finally ("end", summary). Every chunk is CRC-checked as it
+    arrives, but the SHA-256 over the whole archive and the record counts can
+    only be checked at the end: callers stage what they are given and drop it
+    unless the "end" item arrives. Unknown chunk tags are skipped, leaving room
+    for later additions.
+    """
+    digest = hashlib.sha256()
+
+    def read(size):
+        data = _read_exact(stream, size)
+        digest.update(data)
+        return data
+
+    preamble = read(len(ARCHIVE_MAGIC) + _UINT16.size)
+    if preamble[:len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+        raise ArchiveError("Not a roster archive")
+    version = _UINT16.unpack(preamble[len(ARCHIVE_MAGIC):])[0]
+    if version > ARCHIVE_VERSION:
+        raise ArchiveError(f"Archive format version {version} is newer than supported ({ARCHIVE_VERSION})")
+
+    header = None
+    face_metadata = None
+    face_encodings = None
+    fingerprint_metadata = None
+    counts = {"faces": 0, "fingerprints": 0}
+
+    while True:
+        checksum_so_far = digest.hexdigest()
+        tag, length = _CHUNK_HEADER.unpack(read(_CHUNK_HEADER.size))
+        payload = read(length)
+        crc = _UINT32.unpack(read(_UINT32.size))[0]
+        if zlib.crc32(payload) != crc:
+            raise ArchiveError(f"Checksum mismatch in {tag.decode('ascii', 'replace').strip()} chunk")
+        if header is None and tag in (b"FMET", b"FENC", b"FTMP", b"PMET", b"PTMP"):
+            raise ArchiveError("Archive has no header")
+
+        try:
+            if tag == b"HEAD":
+                header = json.loads(payload.decode("utf-8"))
+                if header.get("dimensions") != ENCODING_DIMENSIONS:
+                    raise ArchiveError(f"Unsupported encoding width {header.get('dimensions')}")
+                yield "header", header
+            elif tag == b"FMET":
+                face_metadata = _unpack_json(payload)
+            elif tag == b"FENC":
+                face_encodings = np.frombuffer(payload, dtype="<f4").reshape(-1, ENCODING_DIMENSIONS)
+            elif tag == b"FTMP":
+                if face_metadata is None or face_encodings is None or len(face_encodings) != len(face_metadata):
+                    raise ArchiveError("Archive metadata and data chunks do not line up")
+                count = _UINT32.unpack_from(payload)[0]
+                owners_end = _UINT32.size + 4 * count
+                # Owners are archive-wide face rows; make them relative to this group
+                owners = np.frombuffer(payload[_UINT32.size:owners_end], dtype="<i4").astype(np.int64) - counts["faces"]
+                rows = np.frombuffer(payload[owners_end:], dtype="<f4").reshape(-1, ENCODING_DIMENSIONS)
+                if len(owners) != count or len(rows) != count or (count and (owners.min() < 0 or owners.max() >= len(face_metadata))):
+                    raise ArchiveError("Archive metadata and data chunks do not line up")
+
+                templates = [[] for _ in face_metadata]
+                for owner, row in zip(owners, rows.astype(np.float32)):
+                    templates[owner].append(row)
+                counts["faces"] += len(face_metadata)
+                yield "faces", (face_metadata, face_encodings.astype(np.float32), templates)
+                face_metadata = face_encodings = None
+            elif tag == b"PMET":
+                fingerprint_metadata = _unpack_json(payload)
+            elif tag == b"PTMP":
+                blob = zlib.decompress(payload)
+                templates = []
+                offset = 0
+                while offset < len(blob):
+                    size = _UINT32.unpack_from(blob, offset)[0]
+                    offset += _UINT32.size
+                    templates.append(blob[offset:offset + size].decode("utf-8"))
+                    offset += size
+                if fingerprint_metadata is None or len(templates) != len(fingerprint_metadata):
+                    raise ArchiveError("Archive metadata and data chunks do not line up")
+
+                counts["fingerprints"] += len(templates)
+                yield "fingerprints", [dict(record, fingerprintEncoding=template)
+                                       for record, template in zip(fingerprint_metadata, templates)]
+                fingerprint_metadata = None
+            elif tag == b"END ":
+                summary = json.loads(payload.decode("utf-8"))
+                break
+            else:
+                logger.warning(f"Skipping unknown archive chunk {tag!r}")
+        except (ValueError, zlib.error, struct.error) as e:
+            if isinstance(e, ArchiveError):
+                raise
+            raise ArchiveError(f"Malformed {tag.decode('ascii', 'replace').strip()} chunk: {e}")
+
+    if summary.get("sha256") != checksum_so_far:
+        raise ArchiveError("Archive checksum mismatch")
+    if header is None:
+        raise ArchiveError("Archive has no header")
+    if face_metadata is not None or face_encodings is not None or fingerprint_metadata is not None:
+        raise ArchiveError("Archive metadata and data chunks do not line up")
+    if counts["faces"] != summary.get("faces") or counts["fingerprints"] != summary.get("fingerprints"):
+        raise ArchiveError("Archive record counts do not match its trailer")
+    yield "end", summary
+
+
+def inspect_roster(stream):
+    """Verify an archive end to end and summarise it, one chunk group at a time"""
+    info = {"header": None, "faces": 0, "face_templates": 0, "fingerprints": 0}
+    for kind, data in iter_archive(stream):
+        if kind == "header":
+            info["header"] = data
+        elif kind == "faces":
+            info["faces"] += len(data[0])
+            info["face_templates"] += sum(len(rows) for rows in data[2])
+        elif kind == "fingerprints":
+            info["fingerprints"] += len(data)
+        elif kind == "end":
+            info["skipped_on_export"] = data.get("skipped", 0)
+    return info
+
+
+def import_roster(stream, mode="replace", face_system=None):
+    """Stream an archive into the local face and fingerprint registration stores
+
+    Records are staged per store as their chunks arrive and only committed once
+    the whole archive has checked out, so a damaged or truncated archive
+    changes nothing. A part the archive does not contain - per its header, or
+    for older archives by which chunks appear - leaves its store as it is in
+    either mode. With a face_system, a replace import also hands it the match
+    roster built from the archive's float32 arrays, so the new roster is usable
+    without decoding the JSON encodings that were just written.
+    """
+    from face import REGISTRATIONS_FILE
+    from finger import REGISTRATION_FILE
+
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Unknown import mode '{mode}'. Available: {', '.join(IMPORT_MODES)}")
+
+    targets = {"faces": (REGISTRATIONS_FILE, "voter_id"), "fingerprints": (REGISTRATION_FILE, "voterID")}
+    stages = {}
+    roster = CompactRoster() if mode == "replace" and face_system is not None else None
+    result = {"mode": mode, "faces": 0, "face_templates": 0, "fingerprints": 0}
+
+    def stage(part):
+        if part not in stages:
+            path, key = targets[part]
+            stages[part] = open_store(path).begin_import(mode, key)
+        return stages[part]
+
+    try:
+        for kind, data in iter_archive(stream):
+            if kind == "header":
+                header = data
+                for part, included in (header.get("contents") or {}).items():
+                    if included and part in targets:
+                        stage(part)
+            elif kind == "faces":
+                metadata, centroids, templates = data
+                records = _face_records(metadata, centroids, templates)
+                stage("faces").write(records)
+                result["faces"] += len(records)
+                result["face_templates"] += sum(len(rows) for rows in templates)
+                if roster is not None:
+                    for record, centroid, rows in zip(records, centroids, templates):
+                        roster.add(record.get("voter_id"), record.get("voter_name"), centroid, rows,
+                                   record.get("template_radius"), record.get("registration_time"))
+            elif kind == "fingerprints":
+                stage("fingerprints").write(data)
+                result["fingerprints"] += len(data)
+            elif kind == "end":
+                summary = data
+
+        for part in stages:
+            stages[part].commit()
+    except Exception:
+        for part in stages:
+            stages[part].abort()
+        raise
+
+    if roster is not None and "faces" in stages:
+        roster.shrink()
+        face_system.use_imported_roster(roster)
+
+    result["untouched"] = [part for part in targets if part not in stages]
+    result["archive"] = {"header": header, "skipped_on_export": summary.get("skipped", 0)}
+    logger.info(f"Imported {result['faces']} face and {result['fingerprints']} fingerprint registrations ({mode}); "
+                f"untouched: {', '.join(result['untouched']) or 'none'}")
+    return result
+
+
+def export_stores(include_faces=True, include_fingerprints=True, chunk_rows=None):
+    """Archive the local face and fingerprint registration stores, reading them as the archive is written"""
+    from face import REGISTRATIONS_FILE
+    from finger import REGISTRATION_FILE
+
+    faces = open_store(REGISTRATIONS_FILE).iter_records() if include_faces else None
+    fingerprints = open_store(REGISTRATION_FILE).iter_records() if include_fingerprints else None
+    return export_roster(faces, fingerprints, chunk_rows)
+
+
+def main():
+    """Export, import or inspect roster archives from the command line"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move face and fingerprint rosters between stations")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write the local rosters to an archive")
+    export_parser.add_argument("archive")
+    export_parser.add_argument("--no-faces", action="store_true")
+    export_parser.add_argument("--no-fingerprints", action="store_true")
+
+    import_parser = commands.add_parser("import", help="Load an archive into the local rosters")
+    import_parser.add_argument("archive")
+    import_parser.add_argument("--mode", choices=IMPORT_MODES, default="replace")
+
+    inspect_parser = commands.add_parser("inspect", help="Verify an archive and print its summary")
+    inspect_parser.add_argument("archive")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        with open(args.archive, "wb") as f:
+            for data in export_stores(not args.no_faces, not args.no_fingerprints):
+                f.write(data)
+        with open(args.archive, "rb") as f:
+            print(json.dumps(inspect_roster(f), indent=2))
+        return
+
+    with open(args.archive, "rb") as f:
+        if args.command == "inspect":
+            print(json.dumps(inspect_roster(f), indent=2))
+            return
+
+        from face import FaceRecognitionSystem
+        result = import_roster(f, args.mode, FaceRecognitionSystem())
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
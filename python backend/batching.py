@@ -0,0 +1,110 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger("MicroBatching")
+
+# Off by default: coalescing only pays off when many small requests arrive together
+BATCHING_ENABLED = os.environ.get("FACE_BATCHING", "0").lower() in ("1", "true", "yes")
+MAX_BATCH_SIZE = int(os.environ.get("FACE_BATCH_MAX_SIZE", 64))
+MAX_WAIT_MS = float(os.environ.get("FACE_BATCH_MAX_WAIT_MS", 2.0))
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-item calls into one batched call
+
+    submit() hands an item to a worker thread and returns a Future. The worker
+    takes the first waiting item, keeps collecting until max_batch_size items
+    are queued or max_wait_ms has passed since that first item, then calls
+    process_batch(items) once and resolves every caller's future with its
+    entry of the returned list.
+    """
+
+    def __init__(self, process_batch, max_batch_size=None, max_wait_ms=None, name="batch"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size or MAX_BATCH_SIZE)
+        self.max_wait = (MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        # Batch-size histogram for /api/face/batching
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-batcher", daemon=True)
+                self._worker.start()
+
+    def submit(self, item):
+        """Queue one item; the returned Future resolves to its result"""
+        future = Future()
+        self._queue.put((item, future))
+        self._ensure_worker()
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submit and wait for the result"""
+        return self.submit(item).result(timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Still take whatever is already waiting; that costs no extra latency
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name} batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logger.error(f"Error processing {self.name} batch of {len(items)}: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                # Per-item failures come back as exception instances
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+            self.batches += 1
+            self.items += len(items)
+            self.largest_batch = max(self.largest_batch, len(items))
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": self.items / self.batches if self.batches else None,
+            "largest_batch": self.largest_batch
+        }
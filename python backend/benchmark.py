@@ -0,0 +1,549 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import face_recognition
+
+# Importing the system under test runs its logging setup, so do it before our own log level is applied
+from app import app, process_image
+from face import FaceRecognitionSystem
+from detectors import get_detector
+from matching import EncodingMatrix, verify_against_reference
+from roster import CompactRoster
+from storage import open_store, open_log, SQLITE_PATH
+
+logger = logging.getLogger("Benchmark")
+
+BENCHMARK_VERSION = 1
+
+DEFAULT_IMAGE_SIZES = [(320, 240), (640, 480), (1280, 720), (1920, 1080)]
+DEFAULT_ROSTER_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def _summarize(samples, ops_per_sample=1):
+    """Summarize a list of timings (seconds) into latency and throughput figures"""
+    if not samples:
+        return {"count": 0}
+
+    ordered = sorted(samples)
+    total = sum(samples)
+
+    def percentile(p):
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": percentile(50) * 1000,
+        "p95_ms": percentile(95) * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_sec": (len(samples) * ops_per_sample / total) if total > 0 else None
+    }
+
+
+def _time_call(func, repeat, warmup=1):
+    """Run func repeatedly and return the per-call timings in seconds"""
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _peak_allocation(func):
+    """Peak bytes allocated during one (warm) call, as seen by tracemalloc (numpy/OpenCV arrays included)"""
+    tracemalloc.start()
+    try:
+        func()
+    except ValueError:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def synthetic_encodings(count, seed=0):
+    """Generate face-like 128-D encodings (dlib encodings sit around |x| ~ 0.1)"""
+    rng = np.random.default_rng(seed)
+    return rng.normal(0.0, 0.09, size=(count, 128))
+
+
+def synthetic_image(width, height, seed=0):
+    """Generate a JPEG-encoded test image of the given size"""
+    rng = np.random.default_rng(seed)
+    # Smooth gradient plus noise compresses like a photo rather than pure noise
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    img = np.broadcast_to(gradient, (height, width, 3)).astype(np.float32)
+    img = img + rng.normal(0, 12, size=(height, width, 3))
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    ok, buffer = cv2.imencode(".jpg", img)
+    if not ok:
+        raise RuntimeError("Could not encode synthetic image")
+    return buffer.tobytes()
+
+
+def load_fixture_images(paths, sizes):
+    """Resize fixture photos to each benchmark size and JPEG-encode them"""
+    images = {}
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            logger.warning(f"Skipping unreadable fixture image: {path}")
+            continue
+        for (width, height) in sizes:
+            resized = cv2.resize(img, (width, height))
+            ok, buffer = cv2.imencode(".jpg", resized)
+            if ok:
+                images.setdefault((width, height), []).append(buffer.tobytes())
+    return images
+
+
+def bench_process_image(sizes, repeat, fixtures=None, seed=0, detectors=("hog",)):
+    """Measure app.process_image latency for each image size and detector backend"""
+    results = []
+    available = []
+    for detector in detectors:
+        try:
+            get_detector(detector)
+            available.append(detector)
+        except ValueError as e:
+            logger.warning(f"Skipping detector {detector}: {e}")
+            results.append({"detector": detector, "available": False, "reason": str(e)})
+
+    for detector, (width, height) in [(d, size) for d in available for size in sizes]:
+        if fixtures and (width, height) in fixtures:
+            payloads = fixtures[(width, height)]
+            source = "fixture"
+        else:
+            payloads = [synthetic_image(width, height, seed)]
+            source = "synthetic"
+
+        faces_found = True
+        samples = []
+        for i in range(repeat + 1):
+            image_data = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            try:
+                process_image(image_data, detector)
+            except ValueError:
+                # Synthetic images contain no face; the decode/convert/detect cost is still measured
+                faces_found = False
+            elapsed = time.perf_counter() - start
+            if i > 0:
+                samples.append(elapsed)
+
+        entry = {"detector": detector, "width": width, "height": height, "source": source,
+                 "faces_found": faces_found}
+        entry.update(_summarize(samples))
+        entry["peak_alloc_bytes"] = _peak_allocation(lambda: process_image(payloads[0], detector))
+        results.append(entry)
+        logger.info(f"process_image {detector} {width}x{height}: p50 {entry['p50_ms']:.1f} ms, "
+                    f"peak allocation {entry['peak_alloc_bytes'] / 1024:.0f} KiB")
+    return results
+
+
+def bench_compare(roster_sizes, repeat, seed=0):
+    """Measure one probe against rosters of increasing size"""
+    system = FaceRecognitionSystem.__new__(FaceRecognitionSystem)
+    probe = synthetic_encodings(1, seed + 1)[0]
+
+    results = []
+    for size in roster_sizes:
+        roster = synthetic_encodings(size, seed)
+        # Registrations keep encodings as JSON strings, so include the decode cost like voting_process does
+        stored = [json.dumps(row.tolist()) for row in roster]
+
+        def per_pair_loop():
+            for features in stored:
+                system.compare_features(probe, features)
+
+        def vectorized():
+            face_recognition.face_distance(roster, probe)
+
+        kernels = {dtype: EncodingMatrix(roster, dtype) for dtype in ("float32", "float16")}
+        probes = synthetic_encodings(16, seed + 2)
+
+        # Scale repeats down for big rosters so a run stays in the tens of seconds
+        loop_repeat = max(1, min(repeat, 100000 // size))
+
+        entry = {"roster_size": size}
+        loop_stats = _summarize(_time_call(per_pair_loop, loop_repeat, warmup=0), ops_per_sample=size)
+        vector_stats = _summarize(_time_call(vectorized, repeat), ops_per_sample=size)
+        entry["compare_features_loop"] = loop_stats
+        entry["face_distance_vectorized"] = vector_stats
+
+        # Precomputed-norm kernel: one probe (matrix-vector) and a batch of 16 probes (matrix-matrix)
+        for dtype, kernel in kernels.items():
+            entry[f"kernel_{dtype}"] = _summarize(_time_call(lambda: kernel.distances(probe), repeat),
+                                                  ops_per_sample=size)
+            entry[f"kernel_{dtype}_batch16"] = _summarize(_time_call(lambda: kernel.distances_many(probes), repeat),
+                                                          ops_per_sample=size * len(probes))
+            entry[f"kernel_{dtype}_accuracy"] = verify_against_reference(size, dtype=dtype, seed=seed)
+            entry[f"kernel_{dtype}_bytes"] = kernel.nbytes
+
+        results.append(entry)
+        logger.info(f"compare roster={size}: loop p50 {loop_stats['p50_ms']:.2f} ms, "
+                    f"vectorized p50 {vector_stats['p50_ms']:.2f} ms, "
+                    f"float32 kernel p50 {entry['kernel_float32']['p50_ms']:.2f} ms")
+    return results
+
+
+def bench_store(roster_sizes, repeat, seed=0, backends=("json",)):
+    """Measure FaceRecognitionSystem store load/save times at several roster sizes"""
+    results = []
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            for backend, size in [(b, size) for b in backends for size in roster_sizes]:
+                system = FaceRecognitionSystem()
+                system.registrations_store = open_store(system.registrations_file, backend)
+                system.verification_store = open_log(system.verification_log_file, backend)
+                roster = synthetic_encodings(size, seed)
+                registrations = [{
+                    "voter_name": f"Voter {i}",
+                    "voter_id": str(i),
+                    "face_features": system._encode_face_features(roster[i]),
+                    "registration_time": "2024-01-01 00:00:00"
+                } for i in range(size)]
+                system.registrations_store.save(registrations)
+
+                file_bytes = os.path.getsize(system.registrations_file if backend == "json" else SQLITE_PATH)
+                store_repeat = max(1, min(repeat, 100000 // size))
+
+                load_samples = _time_call(system.load_registrations, store_repeat)
+
+                counter = [size]
+
+                def save_one():
+                    counter[0] += 1
+                    system.save_registration({
+                        "voter_name": f"Voter {counter[0]}",
+                        "voter_id": str(counter[0]),
+                        "face_features": roster[counter[0] % size],
+                        "registration_time": "2024-01-01 00:00:00"
+                    })
+
+                save_samples = _time_call(save_one, store_repeat, warmup=0)
+
+                def log_one():
+                    system.log_verification({"voter_name": "Voter 0", "voter_id": "0",
+                                             "similarity_score": 0.9, "verified": True})
+
+                log_samples = _time_call(log_one, store_repeat, warmup=0)
+
+                entry = {
+                    "backend": backend,
+                    "roster_size": size,
+                    "file_bytes": file_bytes,
+                    "load_registrations": _summarize(load_samples),
+                    "save_registration": _summarize(save_samples),
+                    "log_verification": _summarize(log_samples)
+                }
+                results.append(entry)
+                logger.info(f"store {backend} roster={size}: load p50 {entry['load_registrations']['p50_ms']:.1f} ms")
+
+                system.registrations_store.clear()
+                system.verification_store.clear()
+        finally:
+            os.chdir(original_cwd)
+    return results
+
+
+def synthetic_registrations(size, templates_per_voter=3, seed=0):
+    """Face registration records as the store holds them (encodings as JSON strings)"""
+    centroids = synthetic_encodings(size, seed)
+    rng = np.random.default_rng(seed + 1)
+    return [{
+        "voter_name": f"Voter {i}",
+        "voter_id": str(i),
+        "face_features": json.dumps(centroids[i].tolist()),
+        "face_templates": [{"features": json.dumps((centroids[i] + rng.normal(0, 0.02, 128)).tolist()),
+                            "num_jitters": 1, "model": "small"} for _ in range(templates_per_voter)],
+        "template_radius": 0.3,
+        "registration_time": "2024-01-01 00:00:00"
+    } for i in range(size)]
+
+
+def _legacy_match_roster(registrations):
+    """The match roster as it was cached before CompactRoster: each record dict plus its decoded arrays"""
+    prepared = []
+    for reg in registrations:
+        prepared.append({
+            "registration": reg,
+            "centroid": np.array(json.loads(reg["face_features"])),
+            "templates": np.array([json.loads(t["features"]) for t in reg["face_templates"]]),
+            "radius": reg["template_radius"]
+        })
+    return {
+        "prepared": prepared,
+        "centroids": EncodingMatrix([p["centroid"] for p in prepared]),
+        "templates": EncodingMatrix([row for p in prepared for row in p["templates"]])
+    }
+
+
+def bench_roster_memory(roster_sizes, seed=0):
+    """Memory the face match roster keeps per voter: registration dicts against CompactRoster"""
+    import gc
+
+    builders = {
+        "dicts": _legacy_match_roster,
+        "compact": CompactRoster.from_registrations
+    }
+    results = []
+    for size in roster_sizes:
+        entry = {"roster_size": size}
+        for name, build in builders.items():
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                registrations = synthetic_registrations(size, seed=seed)
+                started = time.perf_counter()
+                roster = build(registrations)
+                build_seconds = time.perf_counter() - started
+                # Whatever the roster does not reference is freed with the loaded records
+                del registrations
+                gc.collect()
+                retained = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+            del roster
+            entry[name] = {"bytes": retained, "bytes_per_voter": retained / size, "build_ms": build_seconds * 1000}
+        entry["reduction"] = entry["dicts"]["bytes"] / entry["compact"]["bytes"] if entry["compact"]["bytes"] else None
+        results.append(entry)
+        logger.info(f"roster memory roster={size}: {entry['dicts']['bytes_per_voter']:.0f} -> "
+                    f"{entry['compact']['bytes_per_voter']:.0f} bytes/voter")
+    return results
+
+
+class _LocalServer:
+    """Run the Flask app on an ephemeral port in a background thread"""
+
+    def __init__(self):
+        from werkzeug.serving import make_server
+
+        # Per-request access logs would dominate the timings
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.thread.join()
+
+
+def bench_endpoints(base_url, client_counts, requests_per_client, seed=0):
+    """Measure end-to-end endpoint throughput under concurrent clients"""
+    import requests
+
+    encodings = synthetic_encodings(2, seed).tolist()
+    compare_payload = {"encoding1": encodings[0], "encoding2": encodings[1], "threshold": 0.6}
+    image_payload = synthetic_image(640, 480, seed)
+
+    def call_compare(session):
+        return session.post(f"{base_url}/api/face/compare", json=compare_payload)
+
+    def call_identify(session):
+        return session.post(f"{base_url}/api/face/identify", json={"encoding": encodings[0], "top_k": 1})
+
+    def call_encode(session):
+        return session.post(f"{base_url}/api/encode_face",
+                            files={"file": ("frame.jpg", image_payload, "image/jpeg")})
+
+    endpoints = {
+        "/api/face/compare": call_compare,
+        "/api/face/identify": call_identify,
+        "/api/encode_face": call_encode
+    }
+
+    results = []
+    for route, call in endpoints.items():
+        for clients in client_counts:
+            latencies = []
+            status_counts = {}
+            lock = threading.Lock()
+
+            def client_worker():
+                with requests.Session() as session:
+                    for _ in range(requests_per_client):
+                        start = time.perf_counter()
+                        response = call(session)
+                        elapsed = time.perf_counter() - start
+                        with lock:
+                            latencies.append(elapsed)
+                            status_counts[response.status_code] = status_counts.get(response.status_code, 0) + 1
+
+            wall_start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                for future in [pool.submit(client_worker) for _ in range(clients)]:
+                    future.result()
+            wall = time.perf_counter() - wall_start
+
+            entry = {"route": route, "clients": clients, "wall_seconds": wall,
+                     "requests_per_sec": len(latencies) / wall if wall > 0 else None,
+                     "status_counts": {str(k): v for k, v in status_counts.items()}}
+            entry["latency"] = _summarize(latencies)
+            results.append(entry)
+            logger.info(f"{route} clients={clients}: {entry['requests_per_sec']:.1f} req/s")
+    return results
+
+
+def _environment():
+    """Describe the machine and library versions so results can be compared across runs"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "face_recognition": getattr(face_recognition, "__version__", "unknown"),
+        "face_batching": os.environ.get("FACE_BATCHING", "0")
+    }
+
+
+def _parse_sizes(value):
+    """Parse '640x480,1280x720' into [(640, 480), (1280, 720)]"""
+    sizes = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def _parse_ints(value):
+    return [int(item) for item in value.split(",")]
+
+
+def run_benchmarks(args):
+    """Run the selected suites and return the JSON report"""
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    report = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "environment": _environment(),
+        "parameters": {
+            "suites": args.suites,
+            "image_sizes": [f"{w}x{h}" for (w, h) in args.image_sizes],
+            "detectors": args.detectors,
+            "store_backends": args.store_backends,
+            "roster_sizes": args.roster_sizes,
+            "repeat": args.repeat,
+            "clients": args.clients,
+            "requests_per_client": args.requests_per_client,
+            "seed": args.seed
+        },
+        "results": {}
+    }
+
+    if "process_image" in args.suites:
+        fixtures = load_fixture_images(args.images, args.image_sizes) if args.images else None
+        report["results"]["process_image"] = bench_process_image(args.image_sizes, args.repeat, fixtures,
+                                                                args.seed, args.detectors)
+
+    if "compare" in args.suites:
+        report["results"]["compare"] = bench_compare(args.roster_sizes, args.repeat, args.seed)
+
+    if "store" in args.suites:
+        store_sizes = [size for size in args.roster_sizes if size <= args.max_store_size]
+        report["results"]["store"] = bench_store(store_sizes, args.repeat, args.seed, args.store_backends)
+
+    if "roster_memory" in args.suites:
+        memory_sizes = [size for size in args.roster_sizes if size <= args.max_memory_size]
+        report["results"]["roster_memory"] = bench_roster_memory(memory_sizes, args.seed)
+
+    if "endpoints" in args.suites:
+        if args.url:
+            report["results"]["endpoints"] = bench_endpoints(args.url.rstrip("/"), args.clients,
+                                                             args.requests_per_client, args.seed)
+        else:
+            with _LocalServer() as server:
+                report["results"]["endpoints"] = bench_endpoints(server.url, args.clients,
+                                                                 args.requests_per_client, args.seed)
+
+    return report
+
+
+SUITES = ["process_image", "compare", "store", "roster_memory", "endpoints"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face encoding, matching and storage paths")
+    parser.add_argument("--suites", default=",".join(SUITES),
+                        help=f"Comma-separated suites to run ({', '.join(SUITES)})")
+    parser.add_argument("--image-sizes", type=_parse_sizes, default=DEFAULT_IMAGE_SIZES,
+                        help="Comma-separated WIDTHxHEIGHT list for process_image")
+    parser.add_argument("--detectors", type=lambda v: v.split(","), default=["hog"],
+                        help="Comma-separated face detector backends for process_image")
+    parser.add_argument("--images", nargs="*", default=[],
+                        help="Fixture face photos to use instead of synthetic images")
+    parser.add_argument("--roster-sizes", type=_parse_ints, default=DEFAULT_ROSTER_SIZES,
+                        help="Comma-separated roster sizes for compare/store suites")
+    parser.add_argument("--max-store-size", type=int, default=10000,
+                        help="Largest roster size used by the JSON store suite")
+    parser.add_argument("--max-memory-size", type=int, default=10000,
+                        help="Largest roster size used by the roster_memory suite (registration dicts take ~19 KB a voter)")
+    parser.add_argument("--store-backends", type=lambda v: v.split(","), default=["json"],
+                        help="Comma-separated storage backends for the store suite (json, sqlite)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions per measurement")
+    parser.add_argument("--clients", type=_parse_ints, default=[1, 4, 16],
+                        help="Comma-separated concurrent client counts for the endpoint suite")
+    parser.add_argument("--requests-per-client", type=int, default=50)
+    parser.add_argument("--url", help="Benchmark a running backend instead of starting a local one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="Free-form label stored in the report (e.g. git revision)")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--log-level", default="WARNING",
+                        help="Log level for the system under test (its INFO logging skews timings)")
+    args = parser.parse_args()
+
+    args.suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = [suite for suite in args.suites if suite not in SUITES]
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(unknown)}")
+
+    logging.getLogger().setLevel(args.log_level.upper())
+    logger.setLevel(logging.INFO)
+
+    report = run_benchmarks(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"Benchmark report written to {args.output}")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
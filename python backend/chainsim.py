@@ -0,0 +1,266 @@
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from evm import (function_selector, event_topic, decode_uint256_args, to_quantity, from_quantity,
+                 ChainError)
+
+logger = logging.getLogger("StandInChain")
+
+CAST_VOTE_SELECTOR = function_selector("castVote(uint256,uint256)")
+CAST_VOTES_SELECTOR = function_selector("castVotes(uint256[],uint256[])")
+VOTE_CAST_TOPIC = event_topic("VoteCast(uint256)")
+VOTE_REJECTED_TOPIC = event_topic("VoteRejected(uint256,uint8)")
+
+# BiometricVotingSystem.RejectReason
+NOT_REGISTERED, ALREADY_VOTED, INVALID_CANDIDATE = 1, 2, 3
+
+# Rough gas costs of the contract paths, enough to exercise batch gas limits
+BASE_GAS = 21000
+GAS_PER_VOTE = 30000
+GAS_PER_REJECTION = 3000
+
+
+class StandInChain:
+    """In-memory stand-in for a chain node running BiometricVotingSystem in its voting phase
+
+    Implements the JSON-RPC calls the vote gateway uses, with node-like nonce rules:
+    a nonce below the account's next one is refused, a nonce already pending is
+    refused, and transactions past a nonce gap wait in the pool. A miner thread
+    seals a block every block_time seconds from the executable transactions, up
+    to block_gas_limit. drop_rate discards that share of accepted transactions
+    to exercise the gateway's recovery.
+    """
+
+    def __init__(self, contract_address, voter_ids=range(1, 10001), candidate_ids=(1, 2, 3),
+                 block_time=1.0, block_gas_limit=30000000, drop_rate=0.0, seed=0):
+        self.contract_address = contract_address.lower()
+        self.registered = set(voter_ids)
+        self.candidates = set(candidate_ids)
+        self.has_voted = set()
+        self.vote_counts = {candidate: 0 for candidate in self.candidates}
+        self.block_time = block_time
+        self.block_gas_limit = block_gas_limit
+        self.drop_rate = drop_rate
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._nonces = {}          # account -> next nonce to be mined
+        self._pool = {}            # (account, nonce) -> transaction
+        self._transactions = {}    # hash -> transaction (pending or mined)
+        self._receipts = {}        # hash -> receipt
+        self._pending_candidates = {}  # votes of the transaction being executed
+        self.block_number = 0
+
+        self._handlers = {
+            "eth_chainId": lambda params: to_quantity(31337),
+            "eth_blockNumber": lambda params: to_quantity(self.block_number),
+            "eth_getTransactionCount": self._get_transaction_count,
+            "eth_sendTransaction": self._send_transaction,
+            "eth_getTransactionReceipt": lambda params: self._receipts.get(params[0]),
+            "eth_getTransactionByHash": lambda params: self._transactions.get(params[0])
+        }
+
+        self._stop = threading.Event()
+        self._miner = threading.Thread(target=self._mine_loop, name="stand-in-miner", daemon=True)
+        self._miner.start()
+
+    def handle(self, method, params):
+        handler = self._handlers.get(method)
+        if handler is None:
+            raise ChainError(f"Method {method} not supported", -32601)
+        with self._lock:
+            return handler(params)
+
+    def _get_transaction_count(self, params):
+        account = params[0].lower()
+        nonce = self._nonces.get(account, 0)
+        if len(params) > 1 and params[1] == "pending":
+            # Like geth: the next nonce after the run of pending transactions without a gap
+            while (account, nonce) in self._pool:
+                nonce += 1
+        return to_quantity(nonce)
+
+    def _send_transaction(self, params):
+        tx = dict(params[0])
+        account = tx["from"].lower()
+        next_nonce = self._nonces.get(account, 0)
+        nonce = from_quantity(tx["nonce"]) if "nonce" in tx else None
+        if nonce is None:
+            nonce = from_quantity(self._get_transaction_count([account, "pending"]))
+        if nonce < next_nonce:
+            raise ChainError(f"nonce too low: next nonce {next_nonce}, tx nonce {nonce}", -32000)
+        if (account, nonce) in self._pool:
+            raise ChainError("replacement transaction underpriced", -32000)
+
+        tx_hash = "0x" + hashlib.sha256(json.dumps([account, nonce, tx.get("data"), time.time()]).encode()).hexdigest()
+        tx.update({"hash": tx_hash, "from": account, "nonce": to_quantity(nonce), "blockNumber": None})
+        if self._random.random() < self.drop_rate:
+            # Accepted, then lost from the pool (evicted, node restart, ...)
+            logger.info(f"Dropping transaction {tx_hash[:10]} (nonce {nonce})")
+            return tx_hash
+
+        self._pool[(account, nonce)] = tx
+        self._transactions[tx_hash] = tx
+        return tx_hash
+
+    def _mine_loop(self):
+        while not self._stop.wait(self.block_time):
+            with self._lock:
+                self._seal_block()
+
+    def _seal_block(self):
+        self.block_number += 1
+        gas_left = self.block_gas_limit
+        for account in {account for (account, _) in self._pool}:
+            while True:
+                tx = self._pool.get((account, self._nonces.get(account, 0)))
+                if tx is None or from_quantity(tx.get("gas", "0x1c9c380")) > gas_left:
+                    break
+                del self._pool[(account, self._nonces.get(account, 0))]
+                self._nonces[account] = self._nonces.get(account, 0) + 1
+                receipt = self._execute(tx)
+                gas_left -= from_quantity(receipt["gasUsed"])
+                tx["blockNumber"] = receipt["blockNumber"]
+                self._receipts[tx["hash"]] = receipt
+
+    def _execute(self, tx):
+        """Apply castVote / castVotes with the contract's rules; returns the receipt"""
+        data = bytes.fromhex(tx.get("data", "0x")[2:])
+        gas_limit = from_quantity(tx.get("gas", "0x1c9c380"))
+        logs, gas_used, success = [], BASE_GAS, True
+
+        selector, arguments = data[:4], data[4:]
+        if tx.get("to", "").lower() != self.contract_address:
+            success = False
+        elif selector == CAST_VOTES_SELECTOR:
+            voter_ids, candidate_ids = decode_uint256_args(arguments, ["uint256[]", "uint256[]"])
+            if len(voter_ids) != len(candidate_ids):
+                success = False
+            else:
+                for voter_id, candidate_id in zip(voter_ids, candidate_ids):
+                    reason = self._rejection(voter_id, candidate_id)
+                    if reason:
+                        gas_used += GAS_PER_REJECTION
+                        logs.append(self._log(VOTE_REJECTED_TOPIC, voter_id, reason))
+                    else:
+                        gas_used += GAS_PER_VOTE
+                        logs.append(self._log(VOTE_CAST_TOPIC, voter_id))
+        elif selector == CAST_VOTE_SELECTOR:
+            voter_id, candidate_id = decode_uint256_args(arguments, ["uint256", "uint256"])
+            gas_used += GAS_PER_VOTE
+            if self._rejection(voter_id, candidate_id):
+                success = False
+            else:
+                logs.append(self._log(VOTE_CAST_TOPIC, voter_id))
+        else:
+            success = False
+
+        if gas_used > gas_limit:
+            success, gas_used = False, gas_limit
+
+        if success:
+            # Apply the state changes only for a successful transaction, as a revert would
+            for log in logs:
+                if log["topics"][0] == VOTE_CAST_TOPIC:
+                    voter_id = int(log["topics"][1], 16)
+                    self.has_voted.add(voter_id)
+                    self.vote_counts[self._pending_candidates.pop(voter_id)] += 1
+        self._pending_candidates.clear()
+
+        return {
+            "transactionHash": tx["hash"],
+            "blockNumber": to_quantity(self.block_number),
+            "status": "0x1" if success else "0x0",
+            "gasUsed": to_quantity(gas_used),
+            "logs": logs if success else []
+        }
+
+    def _rejection(self, voter_id, candidate_id):
+        if voter_id not in self.registered:
+            return NOT_REGISTERED
+        if voter_id in self.has_voted or voter_id in self._pending_candidates:
+            return ALREADY_VOTED
+        if candidate_id not in self.candidates:
+            return INVALID_CANDIDATE
+        self._pending_candidates[voter_id] = candidate_id
+        return 0
+
+    def _log(self, topic, voter_id, reason=None):
+        return {
+            "address": self.contract_address,
+            "topics": [topic, "0x" + voter_id.to_bytes(32, "big").hex()],
+            "data": "0x" + (reason.to_bytes(32, "big").hex() if reason is not None else "")
+        }
+
+    def close(self):
+        self._stop.set()
+
+
+class _RpcHandler(BaseHTTPRequestHandler):
+    chain = None
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self.chain.handle(request.get("method"), request.get("params", []))
+        except ChainError as e:
+            response["error"] = {"code": e.code, "message": str(e)}
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            response["error"] = {"code": -32602, "message": f"Invalid params: {e}"}
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(chain, host="127.0.0.1", port=8545):
+    """Serve the chain over JSON-RPC on a background thread; returns the server (port 0 picks a free one)"""
+    handler = type("StandInRpcHandler", (_RpcHandler,), {"chain": chain})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="stand-in-rpc", daemon=True).start()
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stand-in chain node for exercising the vote gateway")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument("--contract", default="0x" + "5" * 40, help="Address the voting contract lives at")
+    parser.add_argument("--voters", type=int, default=10000, help="Registered voter IDs are 1..N")
+    parser.add_argument("--candidates", type=int, default=3, help="Candidate IDs are 1..N")
+    parser.add_argument("--block-time", type=float, default=1.0, help="Seconds between blocks")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of transactions silently dropped")
+    args = parser.parse_args()
+
+    chain = StandInChain(args.contract, range(1, args.voters + 1), range(1, args.candidates + 1),
+                         block_time=args.block_time, drop_rate=args.drop_rate)
+    server = serve(chain, args.host, args.port)
+    logger.info(f"Stand-in chain on http://{args.host}:{server.server_address[1]} (contract {args.contract})")
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Block {chain.block_number}, {len(chain.has_voted)} vote(s) cast: {chain.vote_counts}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        chain.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
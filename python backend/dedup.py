@@ -0,0 +1,175 @@
+import os
+import json
+import logging
+
+import numpy as np
+
+from matching import EncodingMatrix, pairwise_distances
+from storage import open_store
+
+logger = logging.getLogger("FaceDeduplication")
+
+# Similarity (1 - face distance) at or above which two enrollments are flagged as the same face
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.6))
+
+# Rosters up to this size are scanned directly; larger ones are partitioned first
+DIRECT_SCAN_LIMIT = 4096
+BLOCK_SIZE = 2048
+
+
+def find_near_duplicates(encoding, ids, matrix, threshold=None, exclude_id=None):
+    """Scan one encoding against a whole roster matrix in a single vectorized pass
+
+    matrix is an EncodingMatrix or a plain (N, 128) array.
+    Returns [(voter_id, similarity), ...] with similarity >= threshold, best first.
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    if matrix is None or len(matrix) == 0:
+        return []
+
+    if not isinstance(matrix, EncodingMatrix):
+        matrix = EncodingMatrix(matrix)
+    distances = matrix.distances(encoding)
+    similarities = 1.0 - distances
+
+    hits = np.flatnonzero(similarities >= threshold)
+    hits = hits[np.argsort(-similarities[hits])]
+    return [(ids[i], float(similarities[i])) for i in hits if ids[i] != exclude_id]
+
+
+def _kmeans(matrix, clusters, iterations=15, sample_size=20000, seed=0):
+    """Plain Lloyd k-means on a sample; only used to partition the roster"""
+    rng = np.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), size=min(sample_size, len(matrix)), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmin(pairwise_distances(sample, centroids), axis=1)
+        for c in range(clusters):
+            members = sample[labels == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+def _assign(matrix, centroids):
+    """Nearest centroid for each row, in blocks to bound memory"""
+    labels = np.empty(len(matrix), dtype=np.int64)
+    distances = np.empty(len(matrix), dtype=matrix.dtype)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        block = pairwise_distances(matrix[start:start + BLOCK_SIZE], centroids)
+        labels[start:start + BLOCK_SIZE] = np.argmin(block, axis=1)
+        distances[start:start + BLOCK_SIZE] = block[np.arange(len(block)), labels[start:start + BLOCK_SIZE]]
+    return labels, distances
+
+
+def _pairs_between(ids, matrix, rows_a, rows_b, max_distance, same_group):
+    """All pairs closer than max_distance between two groups of rows"""
+    pairs = []
+    for start in range(0, len(rows_a), BLOCK_SIZE):
+        block_rows = rows_a[start:start + BLOCK_SIZE]
+        distances = pairwise_distances(matrix[block_rows], matrix[rows_b])
+        close_a, close_b = np.nonzero(distances < max_distance)
+        for i, j in zip(close_a, close_b):
+            a, b = block_rows[i], rows_b[j]
+            # Within one group each pair shows up twice (and every row matches itself)
+            if same_group and a >= b:
+                continue
+            pairs.append((ids[a], ids[b], float(1.0 - distances[i, j])))
+    return pairs
+
+
+def find_duplicate_pairs(ids, matrix, threshold=None, nprobe=None, seed=0):
+    """Find every pair of roster entries that look like the same face
+
+    Large rosters are split into ~sqrt(N) k-means cells. Two cells are only
+    compared when their bounding balls come within the match distance of each
+    other, which is exact (no pair is missed) and skips most cell pairs on real
+    rosters. Passing nprobe additionally limits each cell to its nprobe nearest
+    neighbouring cells - approximate, but with a hard sub-quadratic bound.
+
+    Returns [(id_a, id_b, similarity), ...], most similar first.
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+    max_distance = 1.0 - threshold
+    matrix = np.asarray(matrix, dtype=np.float32)
+    count = len(matrix)
+
+    if count < 2:
+        return []
+
+    if count <= DIRECT_SCAN_LIMIT:
+        rows = np.arange(count)
+        pairs = _pairs_between(ids, matrix, rows, rows, max_distance, same_group=True)
+        return sorted(pairs, key=lambda pair: -pair[2])
+
+    clusters = int(np.sqrt(count))
+    centroids = _kmeans(matrix, clusters, seed=seed)
+    labels, centroid_distances = _assign(matrix, centroids)
+
+    members = [np.flatnonzero(labels == c) for c in range(clusters)]
+    radii = np.array([centroid_distances[rows].max() if len(rows) else 0.0 for rows in members])
+    between = pairwise_distances(centroids, centroids)
+
+    if nprobe:
+        nearest = np.argsort(between, axis=1)[:, :nprobe]
+        allowed = np.zeros((clusters, clusters), dtype=bool)
+        allowed[np.arange(clusters)[:, None], nearest] = True
+        allowed |= allowed.T
+    else:
+        allowed = np.ones((clusters, clusters), dtype=bool)
+
+    # Cells whose balls are further apart than the match distance cannot hold a pair
+    reachable = (between - radii[:, None] - radii[None, :] < max_distance) & allowed
+
+    pairs = []
+    compared = 0
+    for a in range(clusters):
+        if not len(members[a]):
+            continue
+        for b in range(a, clusters):
+            if not reachable[a, b] or not len(members[b]):
+                continue
+            compared += len(members[a]) * len(members[b])
+            pairs.extend(_pairs_between(ids, matrix, members[a], members[b], max_distance, same_group=(a == b)))
+
+    logger.info(f"Duplicate scan over {count} encodings: {compared / float(count * count) * 100:.1f}% "
+                f"of the full comparison matrix evaluated, {len(pairs)} pair(s) found")
+    return sorted(pairs, key=lambda pair: -pair[2])
+
+
+def main():
+    """Offline duplicate report for a registrations store (BIOMETRIC_STORE selects JSON or SQLite)"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Find voters enrolled more than once under different IDs")
+    parser.add_argument("registrations", nargs="?", default="voter_registrations.json")
+    parser.add_argument("--threshold", type=float, default=DEDUP_THRESHOLD, help="Similarity threshold")
+    parser.add_argument("--nprobe", type=int, default=None,
+                        help="Compare each cell with only its N nearest cells (faster, approximate)")
+    args = parser.parse_args()
+
+    ids = []
+    rows = []
+    for reg in open_store(args.registrations).iter_records():
+        features = reg.get("face_features")
+        if isinstance(features, str):
+            features = json.loads(features)
+        if features is None or len(features) != 128:
+            logger.warning(f"Skipping voter {reg.get('voter_id')}: no usable face encoding")
+            continue
+        ids.append(reg["voter_id"])
+        rows.append(features)
+
+    pairs = find_duplicate_pairs(ids, np.array(rows, dtype=np.float32), args.threshold, args.nprobe)
+
+    print(json.dumps({
+        "registrations": len(ids),
+        "threshold": args.threshold,
+        "duplicate_pairs": [{"voter_id_a": a, "voter_id_b": b, "similarity": sim} for a, b, sim in pairs]
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,375 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+import cv2
+import numpy as np
+import face_recognition
+
+from preprocess import get_preprocessor
+
+logger = logging.getLogger("FaceDetectors")
+
+# Default backend when neither the request nor the endpoint picks one
+DEFAULT_DETECTOR = os.environ.get("FACE_DETECTOR", "hog")
+
+
+class FaceDetector:
+    """Base class for face detectors.
+
+    Detectors take an RGB image (or a BGR frame via detect_bgr) and return
+    face boxes in face_recognition's (top, right, bottom, left) order so the
+    boxes can be passed straight to face_recognition.face_encodings.
+    """
+
+    name = None
+
+    def is_available(self):
+        """Return (available, reason) for this backend on the current machine"""
+        return True, None
+
+    def detect(self, rgb_image):
+        raise NotImplementedError
+
+    def detect_bgr(self, bgr_image):
+        """Detect on a BGR frame as decoded by OpenCV
+
+        Backends that do not care about channel order override this to skip
+        the whole-frame color conversion; the rest convert and call detect().
+        """
+        return self.detect(get_preprocessor().to_rgb(bgr_image))
+
+
+class HogDetector(FaceDetector):
+    """dlib HOG detector (face_recognition's default)"""
+
+    name = "hog"
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, rgb_image):
+        return face_recognition.face_locations(rgb_image, number_of_times_to_upsample=self.upsample, model="hog")
+
+    def detect_bgr(self, bgr_image):
+        # dlib's HOG features take the strongest gradient over the color channels,
+        # so channel order does not change the result
+        return self.detect(bgr_image)
+
+
+class CnnDetector(FaceDetector):
+    """dlib CNN detector - most accurate, very slow without a GPU"""
+
+    name = "cnn"
+
+    def __init__(self, upsample=1):
+        self.upsample = upsample
+
+    def detect(self, rgb_image):
+        return face_recognition.face_locations(rgb_image, number_of_times_to_upsample=self.upsample, model="cnn")
+
+
+class HaarCascadeDetector(FaceDetector):
+    """OpenCV Haar cascade - fastest on CPU, lower recall on rotated or dim faces"""
+
+    name = "haar"
+
+    def __init__(self, cascade_path=None, scale_factor=1.1, min_neighbors=5, min_size=(40, 40)):
+        self.cascade_path = cascade_path or os.environ.get(
+            "FACE_HAAR_CASCADE",
+            os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        )
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        # CascadeClassifier.detectMultiScale is not safe to share between threads
+        self._local = threading.local()
+
+    def is_available(self):
+        if not os.path.exists(self.cascade_path):
+            return False, f"Cascade file not found: {self.cascade_path}"
+        return True, None
+
+    def _get_cascade(self):
+        cascade = getattr(self._local, "cascade", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_path)
+            if cascade.empty():
+                raise ValueError(f"Could not load Haar cascade from {self.cascade_path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def detect(self, rgb_image):
+        gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY) if rgb_image.ndim == 3 else rgb_image
+        boxes = self._get_cascade().detectMultiScale(
+            gray, scaleFactor=self.scale_factor, minNeighbors=self.min_neighbors, minSize=self.min_size
+        )
+        return [(int(y), int(x + w), int(y + h), int(x)) for (x, y, w, h) in boxes]
+
+    def detect_bgr(self, bgr_image):
+        gray = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2GRAY) if bgr_image.ndim == 3 else bgr_image
+        return self.detect(gray)
+
+
+class OpenCVDnnDetector(FaceDetector):
+    """OpenCV DNN (ResNet-10 SSD) detector.
+
+    Needs the Caffe model files, configured with FACE_DNN_PROTOTXT and
+    FACE_DNN_MODEL (deploy.prototxt / res10_300x300_ssd_iter_140000.caffemodel).
+    """
+
+    name = "dnn"
+
+    def __init__(self, prototxt=None, model=None, confidence=0.6, input_size=(300, 300)):
+        self.prototxt = prototxt or os.environ.get("FACE_DNN_PROTOTXT", "models/deploy.prototxt")
+        self.model = model or os.environ.get("FACE_DNN_MODEL", "models/res10_300x300_ssd_iter_140000.caffemodel")
+        self.confidence = confidence
+        self.input_size = input_size
+        self._local = threading.local()
+
+    def is_available(self):
+        for path in (self.prototxt, self.model):
+            if not os.path.exists(path):
+                return False, f"Model file not found: {path}"
+        return True, None
+
+    def _get_net(self):
+        net = getattr(self._local, "net", None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(self.prototxt, self.model)
+            self._local.net = net
+        return net
+
+    def detect(self, rgb_image):
+        return self._detect(rgb_image, swap_rb=True)
+
+    def detect_bgr(self, bgr_image):
+        return self._detect(bgr_image, swap_rb=False)
+
+    def _detect(self, image, swap_rb):
+        height, width = image.shape[:2]
+        # The model was trained on BGR input with these mean values
+        blob = cv2.dnn.blobFromImage(image, 1.0, self.input_size, (104.0, 177.0, 123.0), swapRB=swap_rb)
+        net = self._get_net()
+        net.setInput(blob)
+        detections = net.forward()
+
+        boxes = []
+        for i in range(detections.shape[2]):
+            if detections[0, 0, i, 2] < self.confidence:
+                continue
+            left, top, right, bottom = (detections[0, 0, i, 3:7] * np.array([width, height, width, height])).astype(int)
+            left, top = max(0, left), max(0, top)
+            right, bottom = min(width - 1, right), min(height - 1, bottom)
+            if right > left and bottom > top:
+                boxes.append((int(top), int(right), int(bottom), int(left)))
+        return boxes
+
+
+class HaarPrefilterDetector(FaceDetector):
+    """Haar cascade pre-filter in front of HOG.
+
+    Frames without a Haar candidate are rejected cheaply; otherwise HOG only
+    runs on the candidate regions, so the returned boxes keep HOG's geometry.
+    """
+
+    name = "haar+hog"
+
+    def __init__(self, margin=0.3, upsample=1):
+        self.prefilter = HaarCascadeDetector(min_neighbors=3)
+        self.hog = HogDetector(upsample=upsample)
+        self.margin = margin
+
+    def is_available(self):
+        return self.prefilter.is_available()
+
+    def detect(self, rgb_image):
+        return self._detect(rgb_image, self.prefilter.detect(rgb_image))
+
+    def detect_bgr(self, bgr_image):
+        # Both stages are channel-order independent
+        return self._detect(bgr_image, self.prefilter.detect_bgr(bgr_image))
+
+    def _detect(self, image, candidates):
+        height, width = image.shape[:2]
+        boxes = []
+        for (top, right, bottom, left) in candidates:
+            pad_y = int((bottom - top) * self.margin)
+            pad_x = int((right - left) * self.margin)
+            y0, y1 = max(0, top - pad_y), min(height, bottom + pad_y)
+            x0, x1 = max(0, left - pad_x), min(width, right + pad_x)
+
+            region = np.ascontiguousarray(image[y0:y1, x0:x1])
+            for (t, r, b, l) in self.hog.detect(region):
+                box = (t + y0, r + x0, b + y0, l + x0)
+                # Overlapping candidate regions can find the same face twice
+                if all(_iou(box, existing) < 0.5 for existing in boxes):
+                    boxes.append(box)
+        return boxes
+
+
+DETECTORS = {
+    detector_class.name: detector_class
+    for detector_class in (HogDetector, CnnDetector, HaarCascadeDetector, OpenCVDnnDetector, HaarPrefilterDetector)
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_detector(detector=None):
+    """Return a detector instance from a name, an instance or the configured default"""
+    if isinstance(detector, FaceDetector):
+        return detector
+
+    name = (detector or DEFAULT_DETECTOR).strip().lower()
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown face detector '{name}'. Available: {', '.join(DETECTORS)}")
+
+    with _instances_lock:
+        instance = _instances.get(name)
+        if instance is None:
+            instance = DETECTORS[name]()
+            available, reason = instance.is_available()
+            if not available:
+                raise ValueError(f"Face detector '{name}' is not available: {reason}")
+            _instances[name] = instance
+    return instance
+
+
+def set_default_detector(name):
+    """Change the process-wide default detector (e.g. after calibration)"""
+    global DEFAULT_DETECTOR
+    get_detector(name)
+    DEFAULT_DETECTOR = name
+    logger.info(f"Default face detector set to '{name}'")
+
+
+def detector_for_endpoint(endpoint, requested=None):
+    """Resolve the detector for a request: request value, then FACE_DETECTOR_<ENDPOINT>, then the default"""
+    if requested:
+        return get_detector(requested)
+    return get_detector(os.environ.get(f"FACE_DETECTOR_{endpoint.upper()}") or None)
+
+
+def list_detectors():
+    """Describe every backend and whether it can run here"""
+    detectors = []
+    for name, detector_class in DETECTORS.items():
+        available, reason = detector_class().is_available()
+        detectors.append({
+            "name": name,
+            "available": available,
+            "reason": reason,
+            "default": name == DEFAULT_DETECTOR
+        })
+    return detectors
+
+
+def _iou(box_a, box_b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(box_a[0], box_b[0]), min(box_a[2], box_b[2])
+    left, right = max(box_a[3], box_b[3]), min(box_a[1], box_b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+
+    intersection = (bottom - top) * (right - left)
+    area_a = (box_a[2] - box_a[0]) * (box_a[1] - box_a[3])
+    area_b = (box_b[2] - box_b[0]) * (box_b[1] - box_b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def calibrate_detectors(samples, recall_threshold=0.95, candidates=None, reference="hog", iou_threshold=0.3):
+    """Pick the fastest detector that meets a recall threshold on a sample set.
+
+    samples is a list of RGB images. Ground truth comes from the reference
+    detector (HOG by default, or CNN for a stricter baseline). The IoU
+    threshold is loose because detectors disagree on box margins.
+    """
+    reference_detector = get_detector(reference)
+    ground_truth = [reference_detector.detect(image) for image in samples]
+    total_faces = sum(len(boxes) for boxes in ground_truth)
+
+    if total_faces == 0:
+        raise ValueError("Calibration samples contain no faces according to the reference detector")
+
+    results = []
+    for name in (candidates or list(DETECTORS)):
+        try:
+            detector = get_detector(name)
+        except ValueError as e:
+            results.append({"name": name, "available": False, "reason": str(e)})
+            continue
+
+        # Untimed warm-up: cascades and networks load lazily on the first detect()
+        detector.detect(samples[0])
+
+        found = 0
+        timings = []
+        for image, expected in zip(samples, ground_truth):
+            start = time.perf_counter()
+            boxes = detector.detect(image)
+            timings.append(time.perf_counter() - start)
+            found += sum(1 for truth in expected if any(_iou(truth, box) >= iou_threshold for box in boxes))
+
+        recall = found / float(total_faces)
+        results.append({
+            "name": name,
+            "available": True,
+            "recall": recall,
+            "mean_ms": sum(timings) / len(timings) * 1000,
+            "meets_threshold": recall >= recall_threshold
+        })
+        logger.info(f"Calibration {name}: recall {recall:.3f}, {results[-1]['mean_ms']:.1f} ms/image")
+
+    qualifying = [r for r in results if r.get("meets_threshold")]
+    selected = min(qualifying, key=lambda r: r["mean_ms"])["name"] if qualifying else reference
+
+    return {
+        "selected": selected,
+        "reference": reference,
+        "recall_threshold": recall_threshold,
+        "sample_count": len(samples),
+        "face_count": total_faces,
+        "results": results
+    }
+
+
+def main():
+    """Calibrate detectors on a folder or list of sample images"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pick the fastest face detector meeting a recall threshold")
+    parser.add_argument("images", nargs="+", help="Sample images or directories of images")
+    parser.add_argument("--recall", type=float, default=0.95, help="Minimum recall against the reference detector")
+    parser.add_argument("--reference", default="hog", help="Detector used as ground truth (hog or cnn)")
+    args = parser.parse_args()
+
+    paths = []
+    for item in args.images:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item)))
+        else:
+            paths.append(item)
+
+    samples = []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            samples.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+    if not samples:
+        print("No readable images found")
+        sys.exit(1)
+
+    report = calibrate_detectors(samples, recall_threshold=args.recall, reference=args.reference)
+    print(json.dumps(report, indent=2))
+    print(f"\nSet FACE_DETECTOR={report['selected']} to use the selected backend")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+import cv2
+import numpy as np
+import face_recognition
+
+logger = logging.getLogger("FaceEncoders")
+
+# Encoder backend for every face encoding this deployment makes (enrollment, verification, streams).
+# Registrations are only comparable with probes from the same embedding, so validate a backend
+# against dlib (python encoders.py validate) before switching an enrolled deployment to it.
+DEFAULT_ENCODER = os.environ.get("FACE_ENCODER", "dlib")
+
+# ONNX exports of dlib's face recognition ResNet (dlib_face_recognition_resnet_model_v1),
+# float32 and int8-quantized (python encoders.py quantize)
+ONNX_MODEL = os.environ.get("FACE_ONNX_MODEL", "models/dlib_face_recognition_resnet.onnx")
+ONNX_INT8_MODEL = os.environ.get("FACE_ONNX_INT8_MODEL", "models/dlib_face_recognition_resnet_int8.onnx")
+
+# Threads one ONNX inference may use (0 lets onnxruntime pick one per physical core)
+ONNX_THREADS = int(os.environ.get("FACE_ONNX_THREADS", 0))
+
+# Input scaling the ONNX model expects:
+#   dlib - the exported graph starts after dlib's input layer, so chips are mean-subtracted and divided by 256 here
+#   none - the graph includes the input layer and takes 0-255 RGB pixels
+ONNX_INPUT_SCALING = os.environ.get("FACE_ONNX_INPUT", "dlib").lower()
+
+# dlib's input_rgb_image_sized<150> layer: per-channel RGB means, then / 256
+DLIB_CHIP_SIZE = 150
+DLIB_CHIP_PADDING = 0.25
+DLIB_PIXEL_MEANS = np.array([122.782, 117.001, 104.298], dtype=np.float32)
+
+# Validation limits: worst distance from dlib's embedding of the same face, and the share
+# of same/different-person decisions (distance < 0.4, i.e. similarity > 0.6) that must agree
+MAX_EMBEDDING_DRIFT = float(os.environ.get("FACE_ENCODER_MAX_DRIFT", 0.05))
+MIN_DECISION_AGREEMENT = float(os.environ.get("FACE_ENCODER_MIN_AGREEMENT", 0.99))
+MATCH_DISTANCE = 0.4
+
+
+class FaceEncoder:
+    """Base class for face encoders.
+
+    Encoders take an RGB image and face boxes in (top, right, bottom, left)
+    order and return one 128-D float64 embedding per box, like
+    face_recognition.face_encodings, so registrations and probes can be
+    compared with the same distance and thresholds.
+    """
+
+    name = None
+
+    def is_available(self):
+        """Return (available, reason) for this backend on the current machine"""
+        return True, None
+
+    def encode(self, rgb_image, face_locations, num_jitters=1):
+        raise NotImplementedError
+
+
+class DlibEncoder(FaceEncoder):
+    """dlib's ResNet via face_recognition (the reference embedding)"""
+
+    name = "dlib"
+
+    def encode(self, rgb_image, face_locations, num_jitters=1):
+        return face_recognition.face_encodings(rgb_image, face_locations, num_jitters=num_jitters)
+
+
+def face_chips(rgb_image, face_locations, num_jitters=1):
+    """The aligned 150x150 chips dlib's ResNet sees for each face, as one list per face
+
+    Alignment uses the same 5-point landmarks and get_face_chip call as
+    face_recognition, and jittered chips come from dlib.jitter_image, so an
+    exported network is fed exactly what dlib feeds its own.
+    """
+    import dlib
+
+    # Same landmark model face_recognition.face_encodings uses
+    landmarks = face_recognition.api._raw_face_landmarks(rgb_image, face_locations, model="small")
+    chips = []
+    for shape in landmarks:
+        chip = dlib.get_face_chip(rgb_image, shape, size=DLIB_CHIP_SIZE, padding=DLIB_CHIP_PADDING)
+        chips.append(dlib.jitter_image(chip, num_jitters=num_jitters) if num_jitters > 1 else [chip])
+    return chips
+
+
+class OnnxEncoder(FaceEncoder):
+    """dlib's ResNet exported to ONNX, run by onnxruntime on CPU with intra-op threading
+
+    Faces are aligned by dlib as for the dlib backend; only the network runs
+    in onnxruntime. All chips of a call (faces times jitters) go through the
+    network as one batch when the model has a dynamic batch dimension. One
+    session is shared by all request threads (InferenceSession.run is thread-safe).
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path=None, threads=None):
+        self.model_path = model_path or ONNX_MODEL
+        self.threads = ONNX_THREADS if threads is None else threads
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def is_available(self):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            return False, "onnxruntime is not installed"
+        if not os.path.exists(self.model_path):
+            return False, f"Model file not found: {self.model_path}"
+        return True, None
+
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                import onnxruntime
+
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                # Request threads already run encodings side by side; one graph runs its ops in order
+                options.inter_op_num_threads = 1
+                options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+                options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                session = onnxruntime.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+                model_input = session.get_inputs()[0]
+                self._input_name = model_input.name
+                self._channels_first = len(model_input.shape) == 4 and model_input.shape[1] == 3
+                self._batched = not isinstance(model_input.shape[0], int) or model_input.shape[0] != 1
+                self._session = session
+                logger.info(f"Loaded ONNX face encoder {self.model_path} "
+                            f"({self.threads or 'auto'} intra-op thread(s), input {model_input.shape})")
+            return self._session
+
+    def _input(self, chips):
+        batch = np.stack(chips).astype(np.float32)
+        if ONNX_INPUT_SCALING == "dlib":
+            batch = (batch - DLIB_PIXEL_MEANS) / 256.0
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2)) if self._channels_first else batch
+
+    def embed(self, chips):
+        """Network outputs (n, 128) for a list of aligned RGB chips"""
+        session = self._get_session()
+        if self._batched:
+            return session.run(None, {self._input_name: self._input(chips)})[0].reshape(len(chips), -1)
+        return np.concatenate([session.run(None, {self._input_name: self._input([chip])})[0].reshape(1, -1)
+                               for chip in chips])
+
+    def encode(self, rgb_image, face_locations, num_jitters=1):
+        if not face_locations:
+            return []
+        per_face = face_chips(rgb_image, face_locations, num_jitters)
+        outputs = self.embed([chip for chips in per_face for chip in chips])
+
+        # As dlib does with jitters: the embedding is the mean over the face's chips
+        encodings, start = [], 0
+        for chips in per_face:
+            encodings.append(outputs[start:start + len(chips)].astype(np.float64).mean(axis=0))
+            start += len(chips)
+        return encodings
+
+
+class OnnxInt8Encoder(OnnxEncoder):
+    """The ONNX encoder on an int8-quantized model: smaller and faster on CPU, validate its drift first"""
+
+    name = "onnx-int8"
+
+    def __init__(self, model_path=None, threads=None):
+        super().__init__(model_path or ONNX_INT8_MODEL, threads)
+
+
+ENCODERS = {
+    encoder_class.name: encoder_class
+    for encoder_class in (DlibEncoder, OnnxEncoder, OnnxInt8Encoder)
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_encoder(encoder=None):
+    """Return an encoder instance from a name, an instance or the configured default"""
+    if isinstance(encoder, FaceEncoder):
+        return encoder
+
+    name = (encoder or DEFAULT_ENCODER).strip().lower()
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown face encoder '{name}'. Available: {', '.join(ENCODERS)}")
+
+    with _instances_lock:
+        instance = _instances.get(name)
+        if instance is None:
+            instance = ENCODERS[name]()
+            available, reason = instance.is_available()
+            if not available:
+                raise ValueError(f"Face encoder '{name}' is not available: {reason}")
+            _instances[name] = instance
+    return instance
+
+
+def list_encoders():
+    """Describe every backend and whether it can run here"""
+    encoders = []
+    for name, encoder_class in ENCODERS.items():
+        available, reason = encoder_class().is_available()
+        encoders.append({
+            "name": name,
+            "available": available,
+            "reason": reason,
+            "default": name == DEFAULT_ENCODER
+        })
+    return encoders
+
+
+def validate_encoders(samples, candidates=None, reference="dlib", max_drift=None, min_agreement=None):
+    """Compare encoders with the reference embedding on a fixture set of face images.
+
+    samples is a list of RGB images; faces are found with the default
+    detector. For each candidate this reports the distance between its
+    embedding and the reference's for the same face, and how many of the
+    pairwise same/different-person decisions between fixture faces it makes
+    as the reference does. The fastest candidate within both limits is selected.
+    """
+    from detectors import get_detector
+
+    max_drift = MAX_EMBEDDING_DRIFT if max_drift is None else max_drift
+    min_agreement = MIN_DECISION_AGREEMENT if min_agreement is None else min_agreement
+
+    detector = get_detector()
+    faces = [(image, location) for image in samples for location in detector.detect(image)]
+    if not faces:
+        raise ValueError("Validation samples contain no faces according to the default detector")
+
+    reference_encoder = get_encoder(reference)
+    expected = np.array([reference_encoder.encode(image, [location])[0] for image, location in faces])
+    pairs = np.triu_indices(len(faces), k=1)
+    expected_decisions = (np.linalg.norm(expected[pairs[0]] - expected[pairs[1]], axis=1) < MATCH_DISTANCE)
+
+    results = []
+    for name in (candidates or list(ENCODERS)):
+        try:
+            encoder = get_encoder(name)
+        except ValueError as e:
+            results.append({"name": name, "available": False, "reason": str(e)})
+            continue
+
+        encodings, timings = [], []
+        for image, location in faces:
+            start = time.perf_counter()
+            encodings.append(encoder.encode(image, [location])[0])
+            timings.append(time.perf_counter() - start)
+        encodings = np.array(encodings)
+
+        drift = np.linalg.norm(encodings - expected, axis=1)
+        decisions = np.linalg.norm(encodings[pairs[0]] - encodings[pairs[1]], axis=1) < MATCH_DISTANCE
+        # A single face gives no pairs to decide on
+        agreement = float(np.mean(decisions == expected_decisions)) if len(decisions) else None
+
+        results.append({
+            "name": name,
+            "available": True,
+            "max_drift": float(drift.max()),
+            "mean_drift": float(drift.mean()),
+            "decision_agreement": agreement,
+            "decisions_differ": int(np.count_nonzero(decisions != expected_decisions)),
+            "mean_ms": sum(timings) / len(timings) * 1000,
+            "meets_threshold": bool(drift.max() <= max_drift and (agreement is None or agreement >= min_agreement))
+        })
+        logger.info(f"Validation {name}: max drift {drift.max():.4f}, "
+                    f"agreement {agreement if agreement is not None else 'n/a'}, {results[-1]['mean_ms']:.1f} ms/face")
+
+    qualifying = [r for r in results if r.get("meets_threshold")]
+    selected = min(qualifying, key=lambda r: r["mean_ms"])["name"] if qualifying else reference
+
+    return {
+        "selected": selected,
+        "reference": reference,
+        "max_drift": max_drift,
+        "min_agreement": min_agreement,
+        "sample_count": len(samples),
+        "face_count": len(faces),
+        "pair_count": len(expected_decisions),
+        "results": results
+    }
+
+
+def quantize_model(model_path, output_path, calibration_images=()):
+    """Write an int8 version of an ONNX encoder model
+
+    With calibration images (RGB), activations are quantized statically from the
+    ranges the aligned chips of their faces produce (QDQ format, per-channel
+    weights), which suits a convolutional network best. Without them only the
+    weights are quantized (dynamic quantization).
+    """
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+    from detectors import get_detector
+
+    if not calibration_images:
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8)
+        logger.info(f"Wrote dynamically quantized model to {output_path}")
+        return output_path
+
+    encoder = OnnxEncoder(model_path)
+    encoder._get_session()
+    detector = get_detector()
+    chips = [chip for image in calibration_images
+             for face in face_chips(image, detector.detect(image)) for chip in face]
+    if not chips:
+        raise ValueError("Calibration images contain no faces according to the default detector")
+
+    class ChipReader(CalibrationDataReader):
+        def __init__(self):
+            self._chips = iter(chips)
+
+        def get_next(self):
+            chip = next(self._chips, None)
+            return None if chip is None else {encoder._input_name: encoder._input([chip])}
+
+    quantize_static(model_path, output_path, ChipReader(), quant_format=QuantFormat.QDQ,
+                    weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8, per_channel=True)
+    logger.info(f"Wrote int8 model to {output_path}, calibrated on {len(chips)} face chip(s)")
+    return output_path
+
+
+def _read_images(items):
+    paths = []
+    for item in items:
+        if os.path.isdir(item):
+            paths.extend(os.path.join(item, name) for name in sorted(os.listdir(item)))
+        else:
+            paths.append(item)
+
+    samples = []
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            samples.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return samples
+
+
+def main():
+    """Validate encoders against dlib on fixture images, or quantize an ONNX model"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate face encoder backends or build an int8 ONNX model")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    validate = commands.add_parser("validate", help="Compare encoders with dlib's embeddings on fixture images")
+    validate.add_argument("images", nargs="+", help="Fixture images or directories of images")
+    validate.add_argument("--encoder", action="append", help="Encoder to validate (default: all)")
+    validate.add_argument("--reference", default="dlib", help="Encoder used as the reference embedding")
+    validate.add_argument("--max-drift", type=float, default=MAX_EMBEDDING_DRIFT,
+                          help="Largest allowed distance from the reference embedding of a face")
+    validate.add_argument("--min-agreement", type=float, default=MIN_DECISION_AGREEMENT,
+                          help="Smallest share of match decisions that must agree with the reference")
+
+    quantize = commands.add_parser("quantize", help="Write an int8-quantized copy of an ONNX encoder model")
+    quantize.add_argument("--model", default=ONNX_MODEL, help="Float ONNX model")
+    quantize.add_argument("--output", default=ONNX_INT8_MODEL, help="Where to write the int8 model")
+    quantize.add_argument("images", nargs="*", help="Calibration images (weights-only quantization without)")
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        quantize_model(args.model, args.output, _read_images(args.images))
+        print(f"\nValidate it with: python encoders.py validate --encoder onnx-int8 <fixture images>")
+        return
+
+    samples = _read_images(args.images)
+    if not samples:
+        print("No readable images found")
+        sys.exit(1)
+
+    report = validate_encoders(samples, args.encoder, args.reference, args.max_drift, args.min_agreement)
+    print(json.dumps(report, indent=2))
+    print(f"\nSet FACE_ENCODER={report['selected']} to use the selected backend")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
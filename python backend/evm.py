@@ -0,0 +1,170 @@
+import logging
+import itertools
+
+import requests
+
+logger = logging.getLogger("ChainClient")
+
+# Keccak-f[1600] round constants and rotation offsets (rotation by lane x + 5y)
+_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008
+]
+_ROTATIONS = [
+    0, 1, 62, 28, 27,
+    36, 44, 6, 55, 20,
+    3, 10, 43, 25, 39,
+    41, 45, 15, 21, 8,
+    18, 2, 61, 56, 14
+]
+_MASK = (1 << 64) - 1
+_RATE = 136
+
+
+def _rotate(value, shift):
+    return ((value << shift) | (value >> (64 - shift))) & _MASK if shift else value
+
+
+def _keccak_f(lanes):
+    for round_constant in _ROUND_CONSTANTS:
+        # Theta
+        columns = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+        for x in range(5):
+            mix = columns[(x - 1) % 5] ^ _rotate(columns[(x + 1) % 5], 1)
+            for y in range(0, 25, 5):
+                lanes[x + y] ^= mix
+
+        # Rho and pi
+        moved = [0] * 25
+        for x in range(5):
+            for y in range(5):
+                moved[y + 5 * ((2 * x + 3 * y) % 5)] = _rotate(lanes[x + 5 * y], _ROTATIONS[x + 5 * y])
+
+        # Chi and iota
+        for y in range(0, 25, 5):
+            for x in range(5):
+                lanes[x + y] = moved[x + y] ^ (~moved[(x + 1) % 5 + y] & moved[(x + 2) % 5 + y])
+        lanes[0] ^= round_constant
+
+
+def keccak256(data):
+    """Ethereum's Keccak-256 (the original padding, not NIST SHA3-256)
+
+    Pure Python and only used for selectors, topics and short messages, so there is
+    no dependency on web3 or a crypto package.
+    """
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % _RATE))
+    padded[-1] |= 0x80
+
+    lanes = [0] * 25
+    for offset in range(0, len(padded), _RATE):
+        block = padded[offset:offset + _RATE]
+        for i in range(_RATE // 8):
+            lanes[i] ^= int.from_bytes(block[8 * i:8 * i + 8], "little")
+        _keccak_f(lanes)
+    return b"".join(lane.to_bytes(8, "little") for lane in lanes[:4])
+
+
+def function_selector(signature):
+    """'castVotes(uint256[],uint256[])' -> 4-byte selector"""
+    return keccak256(signature.encode("ascii"))[:4]
+
+
+def event_topic(signature):
+    """'VoteCast(uint256)' -> 0x-prefixed topic hash"""
+    return "0x" + keccak256(signature.encode("ascii")).hex()
+
+
+def _word(value):
+    if not 0 <= value < 2 ** 256:
+        raise ValueError(f"{value} does not fit in uint256")
+    return value.to_bytes(32, "big")
+
+
+def encode_uint256_args(*args):
+    """ABI-encode uint256 and uint256[] arguments (ints and lists of ints) in call order"""
+    head, tail = [], []
+    offset = 32 * len(args)
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            head.append(_word(offset))
+            encoded = _word(len(arg)) + b"".join(_word(int(item)) for item in arg)
+            tail.append(encoded)
+            offset += len(encoded)
+        else:
+            head.append(_word(int(arg)))
+    return b"".join(head) + b"".join(tail)
+
+
+def decode_uint256_args(data, kinds):
+    """Inverse of encode_uint256_args; kinds lists 'uint256' or 'uint256[]' per argument"""
+    def word_at(position):
+        if position + 32 > len(data):
+            raise ValueError("Call data is truncated")
+        return int.from_bytes(data[position:position + 32], "big")
+
+    values = []
+    for index, kind in enumerate(kinds):
+        if kind == "uint256[]":
+            offset = word_at(32 * index)
+            length = word_at(offset)
+            values.append([word_at(offset + 32 * (i + 1)) for i in range(length)])
+        else:
+            values.append(word_at(32 * index))
+    return values
+
+
+def encode_call(signature, *args):
+    """0x-prefixed call data for a function taking uint256 / uint256[] arguments"""
+    return "0x" + (function_selector(signature) + encode_uint256_args(*args)).hex()
+
+
+def to_quantity(value):
+    """JSON-RPC quantity encoding (hex, no leading zeros)"""
+    return hex(int(value))
+
+
+def from_quantity(value):
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+class ChainError(Exception):
+    """The node answered a JSON-RPC call with an error"""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class JsonRpcClient:
+    """Minimal Ethereum JSON-RPC client over HTTP"""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._ids = itertools.count(1)
+
+    def call(self, method, params=None):
+        """Result of one call; ChainError for node errors, requests exceptions for transport failures"""
+        payload = {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params or []}
+        response = self._session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        body = response.json()
+        if body.get("error"):
+            error = body["error"]
+            raise ChainError(error.get("message", "Unknown error"), error.get("code"))
+        return body.get("result")
+
+
+if __name__ == "__main__":
+    # Known vectors: the empty string and the ERC-20 transfer selector
+    assert keccak256(b"").hex() == "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+    assert function_selector("transfer(address,uint256)").hex() == "a9059cbb"
+    print("keccak256 ok")
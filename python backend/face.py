@@ -1,29 +1,62 @@
 import cv2
 import numpy as np
+import csv
 import json
 import os
 import time
 from datetime import datetime
 import logging
+from logsetup import configure_logging
 import face_recognition
+from detectors import get_detector
+from encoders import get_encoder
+from quality import choose_num_jitters
+from dedup import find_near_duplicates
+from matching import EncodingMatrix
+from roster import CompactRoster
+from preprocess import get_preprocessor
+import liveness
+from storage import open_store, open_log
+from stats import record_face_verification, STATION_ID
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("face_recognition.log"),
-        logging.StreamHandler()
-    ]
-)
+# Queue-based logging: records are written by a background thread (JSON lines in the file)
+configure_logging("face_recognition.log")
 
 logger = logging.getLogger("FaceRecognitionSystem")
 
+# Local storage files
+REGISTRATIONS_FILE = "voter_registrations.json"
+VERIFICATION_LOG_FILE = "verification_log.json"
+
+# Multi-template enrollment: frames captured per voter, spacing between them,
+# and how far a template may sit from the others before it is dropped as a bad capture
+TEMPLATES_PER_VOTER = int(os.environ.get("ENROLLMENT_TEMPLATES", 3))
+TEMPLATE_CAPTURE_INTERVAL = 0.4
+TEMPLATE_OUTLIER_DISTANCE = 0.4
+
 class FaceRecognitionSystem:
-    def __init__(self):
+    def __init__(self, detector=None, enrollment_mode=None, encoder=None):
         """Initialize the face recognition system with local storage"""
-        self.registrations_file = "voter_registrations.json"
-        self.verification_log_file = "verification_log.json"
+        self.registrations_file = REGISTRATIONS_FILE
+        self.verification_log_file = VERIFICATION_LOG_FILE
+        
+        # Locked, atomically written stores (JSON files or SQLite, see BIOMETRIC_STORE);
+        # the verification log is append-only so logging does not rewrite the history
+        self.registrations_store = open_store(self.registrations_file)
+        self.verification_store = open_log(self.verification_log_file)
+        
+        # Face detector backend (None uses FACE_DETECTOR or HOG)
+        self.detector = get_detector(detector)
+        
+        # Face encoder backend (None uses FACE_ENCODER or dlib)
+        self.encoder = get_encoder(encoder)
+        
+        # Enrollment encoding mode: adaptive, fixed or throughput (None uses ENROLLMENT_MODE)
+        self.enrollment_mode = enrollment_mode
+        
+        # Decoded match roster (a CompactRoster and its kernel inputs), rebuilt when the registrations store changes
+        self._match_roster_cache = None
+        self._match_roster_cache_key = None
         
         # Ensure storage files exist
         self._initialize_storage()
@@ -32,15 +65,11 @@ class FaceRecognitionSystem:
         """Initialize local storage files if they don't exist"""
         try:
             # Create registrations file if it doesn't exist
-            if not os.path.exists(self.registrations_file):
-                with open(self.registrations_file, 'w') as f:
-                    json.dump([], f)
+            if self.registrations_store.initialize():
                 logger.info(f"Created new registrations file: {self.registrations_file}")
             
             # Create verification log file if it doesn't exist
-            if not os.path.exists(self.verification_log_file):
-                with open(self.verification_log_file, 'w') as f:
-                    json.dump([], f)
+            if self.verification_store.initialize():
                 logger.info(f"Created new verification log file: {self.verification_log_file}")
                 
         except Exception as e:
@@ -66,10 +95,9 @@ class FaceRecognitionSystem:
         return face_features_str  # Return as is if already a numpy array
     
     def load_registrations(self):
-        """Load registrations from local JSON file"""
+        """Load registrations from local storage"""
         try:
-            with open(self.registrations_file, 'r') as f:
-                registrations = json.load(f)
+            registrations = self.registrations_store.load()
             
             logger.info(f"Loaded {len(registrations)} face registrations from file")
             return registrations
@@ -78,21 +106,14 @@ class FaceRecognitionSystem:
             return []
     
     def save_registration(self, registration_data):
-        """Save registration to local JSON file"""
+        """Save registration to local storage"""
         try:
-            # Load existing registrations
-            registrations = self.load_registrations()
-            
             # Convert numpy array to string for JSON serialization
             if "face_features" in registration_data and isinstance(registration_data["face_features"], np.ndarray):
                 registration_data["face_features"] = self._encode_face_features(registration_data["face_features"])
             
-            # Add new registration
-            registrations.append(registration_data)
-            
-            # Save back to file
-            with open(self.registrations_file, 'w') as f:
-                json.dump(registrations, f, indent=2)
+            # Append under the store lock so concurrent writers cannot drop each other's records
+            self.registrations_store.append(registration_data)
             
             logger.info(f"Successfully registered voter: {registration_data['voter_name']} (ID: {registration_data['voter_id']})")
             return True
@@ -100,26 +121,48 @@ class FaceRecognitionSystem:
             logger.error(f"Error saving registration: {e}")
             return False
     
-    def log_verification(self, verification_data):
-        """Log verification attempt to local JSON file"""
+    def save_registrations(self, registration_list):
+        """Save several registrations with a single write to local storage"""
         try:
-            # Load existing verification logs
-            try:
-                with open(self.verification_log_file, 'r') as f:
-                    verification_logs = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                verification_logs = []
+            for registration_data in registration_list:
+                if "face_features" in registration_data and isinstance(registration_data["face_features"], np.ndarray):
+                    registration_data["face_features"] = self._encode_face_features(registration_data["face_features"])
             
-            # Add timestamp if not provided
+            self.registrations_store.extend(registration_list)
+            
+            logger.info(f"Successfully registered {len(registration_list)} voters")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving registrations: {e}")
+            return False
+    
+    def get_roster_matrix(self):
+        """Return (voter_ids, voter_names, EncodingMatrix) for the stored roster
+        
+        These are the columns of the cached match roster: the ID and name columns
+        index like lists, and the centroid matrix is the one the matcher uses.
+        """
+        roster = self.get_match_roster()["prepared"]
+        return roster.voter_ids, roster.voter_names, roster.centroids
+    
+    def find_duplicate_registrations(self, face_encoding, threshold=None, exclude_id=None):
+        """Return [(voter_id, similarity), ...] for stored voters that look like this face"""
+        voter_ids, _, matrix = self.get_roster_matrix()
+        return find_near_duplicates(face_encoding, voter_ids, matrix, threshold, exclude_id)
+    
+    def log_verification(self, verification_data):
+        """Log verification attempt to local storage"""
+        try:
+            # Add timestamp and station if not provided
             if 'verification_time' not in verification_data:
                 verification_data['verification_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            verification_data.setdefault('station_id', STATION_ID)
             
             # Add new verification log
-            verification_logs.append(verification_data)
+            self.verification_store.append(verification_data)
             
-            # Save back to file
-            with open(self.verification_log_file, 'w') as f:
-                json.dump(verification_logs, f, indent=2)
+            # Update the live turnout aggregates
+            record_face_verification(verification_data)
             
             logger.info(f"Verification logged for voter: {verification_data.get('voter_name', 'unknown')}")
             return True
@@ -127,27 +170,28 @@ class FaceRecognitionSystem:
             logger.error(f"Error logging verification: {e}")
             return False
     
-    def _prepare_image_for_face_recognition(self, image):
-        """Prepare the image for face_recognition processing"""
-        if image is None:
-            return None
-            
-        # Convert BGR to RGB (face_recognition requires RGB)
-        if len(image.shape) == 3 and image.shape[2] == 3:
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            return rgb_image
-        return image
+    def encode_for_enrollment(self, rgb_frame, face_location, enrollment_mode=None):
+        """Encode a detected face for enrollment, choosing num_jitters from the enrollment mode
+        
+        Returns (encoding, encoding_settings); the settings are stored with the template.
+        """
+        num_jitters, settings = choose_num_jitters(rgb_frame, face_location, enrollment_mode or self.enrollment_mode)
+        
+        face_encodings = self.encoder.encode(rgb_frame, [face_location], num_jitters=num_jitters)
+        if not face_encodings:
+            raise ValueError("Failed to extract face encodings")
+        
+        settings["encoder"] = self.encoder.name
+        return face_encodings[0], settings
     
-    def extract_face_features(self, frame):
+    def extract_face_features(self, frame, enrollment_mode=None, return_settings=False):
         """Extract 128-dimensional face encoding features using face_recognition library"""
         try:
-            # Prepare the frame for face_recognition
-            rgb_frame = self._prepare_image_for_face_recognition(frame)
-            if rgb_frame is None:
+            if frame is None:
                 raise ValueError("Invalid input image")
             
-            # Detect face locations using face_recognition
-            face_locations = face_recognition.face_locations(rgb_frame)
+            # Detect face locations with the configured detector, on the BGR frame as captured
+            face_locations = self.detector.detect_bgr(frame)
             
             # Check if a face is detected
             if len(face_locations) == 0:
@@ -156,25 +200,135 @@ class FaceRecognitionSystem:
             if len(face_locations) > 1:
                 raise ValueError("Multiple faces detected. Please ensure only one person is in the frame")
             
-            # Get face encodings (128-dimensional feature vector)
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations, num_jitters=3)
-            
-            if not face_encodings:
-                raise ValueError("Failed to extract face encodings")
-                
-            # Get the first face encoding as numpy array
-            encoding = face_encodings[0]  # This is a numpy array of 128 dimensions
+            # Get the face encoding (128-dimensional feature vector) with mode-dependent jitters,
+            # converting only the face region for face_recognition
+            rgb_face, face_location = get_preprocessor().face_crop(frame, face_locations[0])
+            encoding, settings = self.encode_for_enrollment(rgb_face, face_location, enrollment_mode)
             
             # Verify we have exactly 128 dimensions
             if len(encoding) != 128:
                 raise ValueError(f"Unexpected encoding length: {len(encoding)}, expected 128")
-                
+            
+            if return_settings:
+                return encoding, settings
             return encoding
             
         except Exception as e:
             logger.error(f"Error in extract_face_features: {str(e)}")
             raise
     
+    def build_template_registration(self, voter_name, voter_id, encodings, encoding_settings):
+        """Build a registration holding a small template set and its centroid
+        
+        Templates far from the others (a blink or motion blur during capture) are dropped,
+        as long as at least one template remains. face_features holds the centroid so
+        single-encoding readers keep working.
+        """
+        encodings = np.array(encodings)
+        
+        # Measure against the medoid (the capture closest to all others); a mean would be dragged by the outlier
+        pairwise = np.linalg.norm(encodings[:, None, :] - encodings[None, :, :], axis=2)
+        medoid = int(np.argmin(pairwise.sum(axis=1)))
+        keep = pairwise[medoid] <= TEMPLATE_OUTLIER_DISTANCE
+        if not keep.all():
+            logger.warning(f"Dropped {int((~keep).sum())} outlier template(s) for voter ID {voter_id}")
+        
+        kept = encodings[keep]
+        centroid = kept.mean(axis=0)
+        radius = float(np.linalg.norm(kept - centroid, axis=1).max())
+        
+        templates = [{
+            "features": self._encode_face_features(encoding),
+            "encoding_settings": settings
+        } for encoding, settings, kept_flag in zip(encodings, encoding_settings, keep) if kept_flag]
+        
+        return {
+            "voter_name": voter_name,
+            "voter_id": voter_id,
+            "face_features": centroid,  # Will be converted to string in save_registration
+            "face_templates": templates,
+            "template_radius": radius,
+            "registration_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    def match_registration(self, face_encoding, record, threshold=0.6):
+        """Match an encoding against one voter of the match roster (a VoterRecord), centroid first
+        
+        A centroid hit is accepted straight away. Otherwise the triangle inequality
+        (every template lies within template_radius of the centroid) rules out voters
+        that no template could match, and only the rest pay for per-template distances.
+        """
+        max_distance = 1 - threshold
+        centroid_distance = float(np.linalg.norm(record.centroid - face_encoding))
+        
+        if centroid_distance < max_distance:
+            return True, 1 - centroid_distance
+        
+        templates = record.templates
+        if len(templates) == 0 or centroid_distance - record.radius >= max_distance:
+            return False, 1 - centroid_distance
+        
+        best_distance = min(centroid_distance, float(face_recognition.face_distance(templates, face_encoding).min()))
+        similarity = 1 - best_distance
+        return similarity > threshold, similarity
+    
+    def _prepare_roster(self, roster):
+        """Kernel inputs for one-pass matching over a CompactRoster"""
+        return {
+            "prepared": roster,
+            "centroids": roster.centroids,
+            "radii": roster.radii,
+            "templates": roster.templates,
+            "owners": roster.owners
+        }
+    
+    def get_match_roster(self):
+        """Prepared roster for match_roster, cached until the registrations store changes
+        
+        Decoding every JSON-string encoding is the expensive part. The registration
+        dicts are only walked once: the roster keeps columns and shared arrays.
+        """
+        cache_key = self.registrations_store.version()
+        
+        if self._match_roster_cache is not None and cache_key == self._match_roster_cache_key:
+            return self._match_roster_cache
+        
+        roster = CompactRoster.from_registrations(self.load_registrations())
+        self._match_roster_cache = self._prepare_roster(roster)
+        self._match_roster_cache_key = cache_key
+        return self._match_roster_cache
+    
+    def use_imported_roster(self, roster):
+        """Install a CompactRoster built from an imported archive as the match roster, skipping the JSON decode"""
+        self._match_roster_cache = self._prepare_roster(roster)
+        self._match_roster_cache_key = self.registrations_store.version()
+
+    def match_roster(self, face_encoding, roster, threshold=0.6):
+        """match_registration against every voter at once
+        
+        One matrix-vector product covers all centroids; the template matrix is only
+        scanned when some voter is left inconclusive by the centroid check.
+        Returns [(VoterRecord, similarity), ...] for the matching voters.
+        """
+        max_distance = 1 - threshold
+        if not len(roster["centroids"]):
+            return []
+        
+        centroid_distances = roster["centroids"].distances(face_encoding)
+        best_distances = centroid_distances.copy()
+        
+        # Voters that missed on the centroid but whose template ball is still in reach
+        inconclusive = (centroid_distances >= max_distance) & (centroid_distances - roster["radii"] < max_distance)
+        if len(roster["templates"]) and inconclusive.any():
+            template_distances = roster["templates"].distances(face_encoding)
+            template_best = np.full(len(best_distances), np.inf, dtype=np.float32)
+            np.minimum.at(template_best, roster["owners"], template_distances)
+            best_distances[inconclusive] = np.minimum(best_distances, template_best)[inconclusive]
+        
+        similarities = 1 - best_distances
+        hits = np.flatnonzero(best_distances < max_distance)
+        return [(roster["prepared"][i], float(similarities[i])) for i in hits]
+    
     def compare_features(self, features1, features2, threshold=0.6):
         """Compare two face encodings using face_recognition's face_distance"""
         try:
@@ -235,82 +389,117 @@ class FaceRecognitionSystem:
             cap.read()
             time.sleep(0.1)
         
+        captured_encodings = []
+        captured_settings = []
+        capturing = False
+        last_capture_time = 0
+        
+        # Frames are read into the same buffer every time, and face crops go to the preprocessor's buffer
+        preprocessor = get_preprocessor()
+        frame = None
+        
         while True:
-            ret, frame = cap.read()
+            ret, frame = cap.read(frame)
             
             if not ret or frame is None:
                 logger.error("Failed to grab valid frame")
+                frame = None
                 time.sleep(0.5)
                 continue
             
-            # Make a copy of the frame for display
-            display_frame = frame.copy()
+            # Find faces in the frame with the configured detector
+            face_locations = self.detector.detect_bgr(frame)
             
-            # Use face_recognition to find faces in the frame
-            rgb_frame = self._prepare_image_for_face_recognition(frame)
-            face_locations = face_recognition.face_locations(rgb_frame)
+            # Collect spaced-out frames so the templates cover small pose and lighting changes;
+            # frames without exactly one face are skipped until the voter is back in view
+            capture_due = (capturing and time.time() - last_capture_time >= TEMPLATE_CAPTURE_INTERVAL
+                           and len(face_locations) == 1)
             
-            # Draw rectangle around detected faces
+            # Take the RGB face crop before the overlay is drawn onto the frame
+            if capture_due:
+                rgb_face, face_location = preprocessor.face_crop(frame, face_locations[0])
+            
+            # Draw rectangle around detected faces, straight onto the captured frame
             for (top, right, bottom, left) in face_locations:
-                cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 255, 0), 2)
+                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            
+            if capturing:
+                cv2.putText(frame, f"Capturing {len(captured_encodings)}/{TEMPLATES_PER_VOTER}",
+                            (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
             
             # Display the frame
-            cv2.imshow('Registration - Press c to capture, q to quit', display_frame)
+            cv2.imshow('Registration - Press c to capture, q to quit', frame)
             
             key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 logger.info("Registration cancelled.")
                 print("Registration cancelled.")
                 break
-            elif key == ord('c'):
-                try:
-                    # Process the frame using face_recognition
-                    rgb_frame = self._prepare_image_for_face_recognition(frame)
-                    face_locations = face_recognition.face_locations(rgb_frame)
-                    
-                    # Check if a face is detected
-                    if len(face_locations) == 0:
-                        logger.warning("No face detected! Please try again.")
-                        print("No face detected! Please try again.")
-                        continue
-                    
-                    if len(face_locations) > 1:
-                        logger.warning("Multiple faces detected! Please ensure only one person is in the frame.")
-                        print("Multiple faces detected! Please ensure only one person is in the frame.")
-                        continue
-                    
-                    # Extract the 128-dimensional face encoding
-                    face_encoding = face_recognition.face_encodings(rgb_frame, face_locations, num_jitters=3)[0]
-                    
-                    # Verify we have exactly 128 values
-                    if len(face_encoding) != 128:
-                        logger.error(f"Error: Expected 128 features but got {len(face_encoding)}")
-                        print(f"Error: Expected 128 features but got {len(face_encoding)}")
-                        continue
-                    
-                    # Log a sample of the encoding (just for debugging)
-                    logger.info(f"Generated face encoding with {len(face_encoding)} features")
-                    
-                    # Create registration data with the numpy array
-                    registration_data = {
-                        "voter_name": voter_name,
-                        "voter_id": voter_id,
-                        "face_features": face_encoding,  # Will be converted to string in save_registration
-                        "registration_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    }
-                    
-                    # Save to local storage (encoding will be converted to string)
-                    if self.save_registration(registration_data):
-                        logger.info(f"Registration successful for {voter_name} (ID: {voter_id})!")
-                        print(f"Registration successful for {voter_name} (ID: {voter_id})!")
-                    else:
-                        logger.error(f"Failed to register {voter_name} (ID: {voter_id})!")
-                        print(f"Failed to register {voter_name} (ID: {voter_id})!")
-                    break
-                except Exception as e:
-                    logger.error(f"Error extracting face features: {e}")
-                    print(f"Error extracting face features: {e}")
+            elif key == ord('c') and not capturing:
+                if len(face_locations) == 0:
+                    logger.warning("No face detected! Please try again.")
+                    print("No face detected! Please try again.")
                     continue
+                
+                if len(face_locations) > 1:
+                    logger.warning("Multiple faces detected! Please ensure only one person is in the frame.")
+                    print("Multiple faces detected! Please ensure only one person is in the frame.")
+                    continue
+                
+                capturing = True
+                print(f"Capturing {TEMPLATES_PER_VOTER} frames... please keep looking at the camera.")
+            
+            if not capture_due:
+                continue
+            
+            try:
+                # Extract the 128-dimensional face encoding
+                face_encoding, encoding_settings = self.encode_for_enrollment(rgb_face, face_location)
+            except Exception as e:
+                logger.error(f"Error extracting face features: {e}")
+                print(f"Error extracting face features: {e}")
+                continue
+            
+            # Verify we have exactly 128 values
+            if len(face_encoding) != 128:
+                logger.error(f"Error: Expected 128 features but got {len(face_encoding)}")
+                print(f"Error: Expected 128 features but got {len(face_encoding)}")
+                continue
+            
+            captured_encodings.append(face_encoding)
+            captured_settings.append(encoding_settings)
+            last_capture_time = time.time()
+            
+            logger.info(f"Captured template {len(captured_encodings)}/{TEMPLATES_PER_VOTER} "
+                        f"({encoding_settings['mode']}, {encoding_settings['num_jitters']} jitter(s))")
+            
+            if len(captured_encodings) < TEMPLATES_PER_VOTER:
+                continue
+            
+            # Create registration data with the template set and its centroid
+            registration_data = self.build_template_registration(voter_name, voter_id, captured_encodings, captured_settings)
+            
+            # The same face enrolled under another ID is flagged before anything is saved
+            duplicates = self.find_duplicate_registrations(registration_data["face_features"])
+            if duplicates:
+                for duplicate_id, similarity in duplicates:
+                    logger.warning(f"Possible duplicate enrollment: voter ID {duplicate_id} (similarity {similarity:.2f})")
+                    print(f"Warning: this face matches registered voter ID {duplicate_id} (similarity {similarity:.2f})")
+                
+                if input("Register anyway? (y/n): ").strip().lower() != 'y':
+                    logger.info("Registration cancelled due to duplicate face.")
+                    print("Registration cancelled.")
+                    break
+            
+            # Save to local storage (encodings will be converted to strings)
+            if self.save_registration(registration_data):
+                logger.info(f"Registration successful for {voter_name} (ID: {voter_id}) "
+                            f"with {len(registration_data['face_templates'])} templates!")
+                print(f"Registration successful for {voter_name} (ID: {voter_id})!")
+            else:
+                logger.error(f"Failed to register {voter_name} (ID: {voter_id})!")
+                print(f"Failed to register {voter_name} (ID: {voter_id})!")
+            break
         
         # Release camera and close windows
         cap.release()
@@ -326,6 +515,9 @@ class FaceRecognitionSystem:
             print("No registered voters found! Please register voters first.")
             return
         
+        # Decode stored encodings once rather than on every frame
+        roster = self.get_match_roster()
+        
         # Initialize camera
         cap = cv2.VideoCapture(0)
         
@@ -350,31 +542,49 @@ class FaceRecognitionSystem:
         last_verified_time = 0  # To prevent multiple verifications in quick succession
         last_verified_id = None  # To track the last verified voter ID
         
+        # Frames are read into the same buffer every time, and face crops go to the preprocessor's buffer
+        preprocessor = get_preprocessor()
+        frame = None
+        
+        # Multi-frame liveness (LIVENESS_MODE) runs on its own thread and is only consulted
+        # when a voter is about to be accepted
+        liveness_mode = liveness.resolve_mode()
+        liveness_monitor = liveness.LivenessMonitor() if liveness_mode != "off" else None
+        
         while voting_active:
-            ret, frame = cap.read()
+            ret, frame = cap.read(frame)
             
             if not ret or frame is None:
                 logger.error("Failed to grab valid frame")
+                frame = None
                 time.sleep(0.5)
                 continue
             
             try:
-                # Convert frame to RGB for face_recognition
-                rgb_frame = self._prepare_image_for_face_recognition(frame)
-                display_frame = frame.copy()
+                # The overlay is drawn straight onto the captured frame once every face is encoded
+                display_frame = frame
                 
-                # Detect faces with face_recognition
-                face_locations = face_recognition.face_locations(rgb_frame)
+                # Detect faces with the configured detector, on the BGR frame
+                face_locations = self.detector.detect_bgr(frame)
                 
                 if face_locations:
-                    # Get face encodings
-                    face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+                    # Get face encodings, converting only each face region to RGB
+                    face_encodings = []
+                    for face_location in face_locations:
+                        rgb_face, local_location = preprocessor.face_crop(frame, face_location)
+                        
+                        # Liveness follows a single voter in front of the camera
+                        if liveness_monitor and len(face_locations) == 1:
+                            liveness_monitor.feed(rgb_face, local_location)
+                        
+                        encodings = self.encoder.encode(rgb_face, [local_location])
+                        face_encodings.append(encodings[0] if encodings else None)
                     
                     current_time = datetime.now().timestamp()
                     
                     # Process each detected face
                     for i, (top, right, bottom, left) in enumerate(face_locations):
-                        if i < len(face_encodings):
+                        if face_encodings[i] is not None:
                             face_encoding = face_encodings[i]
                             
                             # Check against all registered faces
@@ -383,21 +593,15 @@ class FaceRecognitionSystem:
                             voter_ids = []
                             similarity_scores = []
                             
-                            for reg in registrations:
-                                try:
-                                    # Get stored face features and decode if needed
-                                    stored_features = reg["face_features"]
-                                    
-                                    # Compare features using face_recognition's face_distance
-                                    is_match, similarity = self.compare_features(face_encoding, stored_features, threshold=0.6)
-                                    
-                                    if is_match:
-                                        matches.append(reg)
-                                        voter_names.append(reg["voter_name"])
-                                        voter_ids.append(reg["voter_id"])
-                                        similarity_scores.append(similarity)
-                                except Exception as e:
-                                    logger.error(f"Error comparing with registered voter: {str(e)}")
+                            try:
+                                # Centroid pre-check for the whole roster, then templates where it is inconclusive
+                                for record, similarity in self.match_roster(face_encoding, roster, threshold=0.6):
+                                    matches.append(record)
+                                    voter_names.append(record.voter_name)
+                                    voter_ids.append(record.voter_id)
+                                    similarity_scores.append(similarity)
+                            except Exception as e:
+                                logger.error(f"Error comparing with registered voters: {str(e)}")
                             
                             # Draw rectangle around face - always draw in red initially
                             cv2.rectangle(display_frame, (left, top), (right, bottom), (0, 0, 255), 2)
@@ -418,8 +622,16 @@ class FaceRecognitionSystem:
                                 cv2.putText(display_frame, label, (left, y_pos), 
                                             cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
                                 
+                                # When liveness is enforced, a match is held until the check passes
+                                awaiting_liveness = (liveness_mode == "enforce" and not liveness_monitor.is_live)
+                                if awaiting_liveness:
+                                    cv2.putText(display_frame, "Please blink to confirm",
+                                                (left, min(bottom + 20, frame.shape[0] - 5)),
+                                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+                                
                                 # Only log verification if enough time has passed and not the same voter
-                                if (current_time - last_verified_time > 3) and voter_id != last_verified_id:
+                                if ((current_time - last_verified_time > 3) and voter_id != last_verified_id
+                                        and not awaiting_liveness):
                                     # Log the verification
                                     verification_data = {
                                         "voter_name": voter_name,
@@ -428,6 +640,10 @@ class FaceRecognitionSystem:
                                         "verification_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                                         "verified": True
                                     }
+                                    if liveness_monitor:
+                                        verification_data["liveness"] = liveness_monitor.snapshot()
+                                        # The next voter has to pass the check afresh
+                                        liveness_monitor.reset()
                                     
                                     self.log_verification(verification_data)
                                     
@@ -457,6 +673,88 @@ class FaceRecognitionSystem:
         # Release camera and close windows
         cap.release()
         cv2.destroyAllWindows()
+        if liveness_monitor:
+            liveness_monitor.close()
+    
+    def bulk_registration(self, csv_path, enrollment_mode="throughput"):
+        """Enroll voters from a CSV file with voter_id, voter_name and image_path columns"""
+        logger.info(f"=== BULK REGISTRATION ({enrollment_mode}) ===")
+        
+        registrations = self.load_registrations()
+        known_ids = {reg["voter_id"] for reg in registrations}
+        
+        new_registrations = []
+        # Encodings accepted so far in this batch, grown in place for the in-batch duplicate check
+        new_encodings = EncodingMatrix()
+        failures = 0
+        
+        try:
+            with open(csv_path, newline='') as f:
+                rows = list(csv.DictReader(f))
+        except Exception as e:
+            logger.error(f"Error reading bulk registration file: {e}")
+            print(f"Error reading bulk registration file: {e}")
+            return 0
+        
+        for row in rows:
+            voter_id = str(row.get("voter_id", "")).strip()
+            voter_name = str(row.get("voter_name", "")).strip()
+            image_path = str(row.get("image_path", "")).strip()
+            
+            if not voter_id or not voter_name or not image_path:
+                logger.warning(f"Skipping incomplete row: {row}")
+                failures += 1
+                continue
+            
+            if voter_id in known_ids:
+                logger.warning(f"Skipping voter ID {voter_id}: already registered")
+                failures += 1
+                continue
+            
+            image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+            if image is None:
+                logger.warning(f"Skipping voter ID {voter_id}: could not read {image_path}")
+                failures += 1
+                continue
+            
+            try:
+                face_encoding, encoding_settings = self.extract_face_features(
+                    image, enrollment_mode=enrollment_mode, return_settings=True
+                )
+            except ValueError as e:
+                logger.warning(f"Skipping voter ID {voter_id}: {e}")
+                failures += 1
+                continue
+            
+            # Check against the stored roster and against the rest of this batch
+            duplicates = self.find_duplicate_registrations(face_encoding)
+            if new_encodings:
+                duplicates += find_near_duplicates(face_encoding, [reg["voter_id"] for reg in new_registrations],
+                                                   new_encodings)
+            if duplicates:
+                duplicate_id, similarity = duplicates[0]
+                logger.warning(f"Skipping voter ID {voter_id}: face matches voter ID {duplicate_id} "
+                               f"(similarity {similarity:.2f})")
+                failures += 1
+                continue
+            
+            new_encodings.add(face_encoding)
+            new_registrations.append({
+                "voter_name": voter_name,
+                "voter_id": voter_id,
+                "face_features": face_encoding,
+                "encoding_settings": encoding_settings,
+                "registration_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+            known_ids.add(voter_id)
+        
+        # One file rewrite for the whole batch instead of one per voter
+        if new_registrations and not self.save_registrations(new_registrations):
+            print("Failed to save bulk registrations!")
+            return 0
+        
+        print(f"Bulk registration complete: {len(new_registrations)} registered, {failures} skipped.")
+        return len(new_registrations)
     
     def run(self):
         """Main application loop"""
@@ -464,15 +762,19 @@ class FaceRecognitionSystem:
             print("\n========= FACE RECOGNITION VOTING SYSTEM =========")
             print("1. Registration Mode")
             print("2. Voting Process")
-            print("3. Exit")
+            print("3. Bulk Registration (CSV)")
+            print("4. Exit")
             
-            choice = input("\nEnter your choice (1-3): ")
+            choice = input("\nEnter your choice (1-4): ")
             
             if choice == '1':
                 self.registration_mode()
             elif choice == '2':
                 self.voting_process()
             elif choice == '3':
+                csv_path = input("Enter CSV path (voter_id, voter_name, image_path): ")
+                self.bulk_registration(csv_path)
+            elif choice == '4':
                 logger.info("Exiting system. Goodbye!")
                 print("Exiting system. Goodbye!")
                 break
@@ -4,30 +4,90 @@ import json
 import hashlib
 import serial
 import logging
+import functools
+import threading
+from collections import deque
+from logsetup import configure_logging, sampled
 from datetime import datetime
+from storage import open_store, open_log
+from stats import record_fingerprint_verification, STATION_ID
+from fingermatch import TemplateMatrix, decode_template, resolve_matcher, SENSOR_SLOTS
+from slotcache import SensorSlotCache
+from roster import StringColumn
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("fingerprint_controller.log"),
-        logging.StreamHandler()
-    ]
-)
+# Queue-based logging: records are written by a background thread (JSON lines in the file)
+configure_logging("fingerprint_controller.log")
 
 logger = logging.getLogger("FingerprintController")
 
+# Progress lines from the sensor ('Place finger', 'Image taken', ...) are sampled;
+# outcomes and errors are always logged (see _log_sensor_response)
+serial_logger = sampled(logger)
+
+
+def _log_sensor_response(response):
+    """Log a status line from the sensor: progress sampled, errors as warnings, everything else in full"""
+    status = response.get('status', 'unknown')
+    line = f"[{status}] {response.get('message', '')}"
+    if status == 'info':
+        serial_logger.info(line)
+    elif status in ('error', 'failure'):
+        logger.warning(line)
+    else:
+        logger.info(line)
+
+
+# Local storage files
+REGISTRATION_FILE = "registration.json"
+VERIFICATION_FILE = "verification.json"
+
+# Seconds to wait for the sensor to store one template sent by the host (the hex
+# line alone takes about a second at 9600 baud)
+STORE_TEMPLATE_TIMEOUT = 10.0
+
+def serial_conversation(method):
+    """Hold the controller's serial lock for a whole command/response exchange"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.serial_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class FingerprintController:
     def __init__(self, port, baud=9600):
         """Initialize the controller with the specified serial port"""
         self.port = port
         self.baud = baud
         self.serial = None
-        self.registration_file = "registration.json"
-        self.verification_file = "verification.json"
+        self.registration_file = REGISTRATION_FILE
+        self.verification_file = VERIFICATION_FILE
+        
+        # Locked, atomically written stores (JSON files or SQLite, see BIOMETRIC_STORE);
+        # the verification log is append-only so logging does not rewrite the history
+        self.registration_store = open_store(self.registration_file)
+        self.verification_store = open_log(self.verification_file)
+        
+        # Sensor, host or auto 1:N matching (see FINGERPRINT_MATCHER), with the stored
+        # templates kept as a matrix until the registration store changes
+        self.matcher_mode = resolve_matcher()
+        self._template_cache = None
+        self._template_cache_key = None
+        
+        # One command at a time on the serial line; the background template loader interleaves with requests
+        self.serial_lock = threading.RLock()
+        
+        # Cache mode: the sensor's slots hold the templates of the voters most likely to check in next
+        self.slot_cache = SensorSlotCache() if self.matcher_mode == "cache" else None
+        self._load_queue = deque()
+        self._preload_plan = set()
+        self._load_condition = threading.Condition()
+        self._loader = None
+        
         logger.info(f"Initializing fingerprint controller on {port}")
-        self.connect()
+        if self.connect() and self.slot_cache is not None and not self.slot_cache.restored:
+            # Unknown slot contents could match as the wrong voter; the host has every template
+            logger.info("No sensor slot map found; clearing the sensor before using it as a cache")
+            self.reset_sensor_cache()
         
     def connect(self):
         """Connect to the Arduino running the fingerprint sensor code"""
@@ -87,12 +147,10 @@ class FingerprintController:
     
     def is_voter_id_registered(self, id):
         """Check if the voter ID already exists in registration file"""
-        registered_fingerprints = self._get_registered_fingerprints()
-        for fp in registered_fingerprints:
-            if fp.get('voterID') == str(id):
-                return True
-        return False
+        voter_ids, _ = self.get_voter_directory()
+        return voter_ids.index_of(str(id)) is not None
             
+    @serial_conversation
     def register_fingerprint(self, id, voter_name):
         """Register a new fingerprint with the given ID and voter name"""
         logger.info(f"Registering new fingerprint with ID: {id} for voter: {voter_name}")
@@ -102,7 +160,15 @@ class FingerprintController:
             logger.warning(f"Voter ID {id} already exists. Registration cancelled.")
             return False, f"Voter ID {id} already exists. Please use a different ID."
         
-        if not self.send_command(f"REGISTER:{id}"):
+        # IDs within the sensor's slots are also stored on the sensor, so its own search keeps
+        # working; other IDs are enrolled without a slot and can only be matched on the host
+        # In cache mode the slot cache decides which slot a template goes to
+        in_slot_range = str(id).isdigit() and 1 <= int(id) <= SENSOR_SLOTS and self.slot_cache is None
+        if self.matcher_mode == "sensor" and not in_slot_range:
+            return False, f"Voter ID must be between 1 and {SENSOR_SLOTS} when matching on the sensor"
+        
+        command = f"REGISTER:{id}" if in_slot_range else f"ENROLL:{id}"
+        if not self.send_command(command):
             return False, "Failed to send registration command"
             
         while True:
@@ -110,28 +176,82 @@ class FingerprintController:
             if not response:
                 continue
                 
-            logger.info(f"[{response.get('status', 'unknown')}] {response.get('message', '')}")
+            _log_sensor_response(response)
                 
             if response.get('status') == 'success':
+                if not in_slot_range and decode_template(response.get('template')) is None:
+                    return False, "Sensor did not return a fingerprint template (update the sensor firmware)"
+                
                 # Store registration data to JSON file
                 if 'raw_encoding' in response:
                     self._store_registration_data(id, voter_name, response)
+                
+                # A newly registered voter is likely to verify soon
+                if self.slot_cache is not None:
+                    self._queue_template_load(id, urgent=True)
                 return True, "Fingerprint registered successfully"
                 
             if response.get('status') == 'error':
                 return False, response.get('message', 'Unknown error during registration')
     
+    def _load_roster(self, registered_fingerprints=None):
+        """(TemplateMatrix, IDs without a usable template, (voter ID column, voter name column)), cached per store version
+        
+        The registration dicts are only walked when the store changes; verifications
+        look voters up in the compact columns instead of reloading the store.
+        """
+        cache_key = self.registration_store.version()
+        if self._template_cache is None or cache_key != self._template_cache_key:
+            if registered_fingerprints is None:
+                registered_fingerprints = self._get_registered_fingerprints()
+            templates, missing = TemplateMatrix.from_registrations(registered_fingerprints)
+            directory = (StringColumn(fp.get('voterID') for fp in registered_fingerprints),
+                         StringColumn(fp.get('voterName') for fp in registered_fingerprints))
+            self._template_cache = (templates, missing, directory)
+            self._template_cache_key = cache_key
+        return self._template_cache
+    
+    def get_template_matrix(self, registered_fingerprints=None):
+        """(TemplateMatrix, IDs without a usable template) for the stored registrations, cached per store version"""
+        templates, missing, _ = self._load_roster(registered_fingerprints)
+        return templates, missing
+    
+    def get_voter_directory(self):
+        """(voter ID column, voter name column) of every stored registration"""
+        return self._load_roster()[2]
+    
+    def voter_name_of(self, voter_id):
+        voter_ids, voter_names = self.get_voter_directory()
+        index = voter_ids.index_of(str(voter_id))
+        return None if index is None else voter_names[index]
+    
+    def _resolve_matching(self):
+        """'host', 'sensor' or 'cache' for this verification"""
+        if self.matcher_mode != "auto":
+            return self.matcher_mode
+        
+        # Host matching only once every voter has a template the host can match
+        templates, missing = self.get_template_matrix()
+        return "host" if len(templates) and not missing else "sensor"
+    
+    @serial_conversation
     def verify_fingerprint(self):
-        """Verify a fingerprint using the sensor's built-in matching"""
+        """Verify a fingerprint, matched on the host or by the sensor's built-in search"""
         logger.info("Verifying fingerprint...")
         
-        # Get all registered fingerprints from JSON file
-        registered_fingerprints = self._get_registered_fingerprints()
+        # Registered voters, from the cache kept until the registration store changes
+        voter_ids, _ = self.get_voter_directory()
         
-        if not registered_fingerprints:
+        if not len(voter_ids):
             logger.warning("No fingerprints registered to verify against.")
             return False, None
         
+        matching = self._resolve_matching()
+        if matching == "host":
+            return self._verify_on_host()
+        if matching == "cache":
+            return self._verify_with_slot_cache()
+        
         # Send VERIFY command to Arduino
         if not self.send_command("VERIFY"):
             return False, None
@@ -141,7 +261,7 @@ class FingerprintController:
             if not response:
                 continue
                 
-            logger.info(f"[{response.get('status', 'unknown')}] {response.get('message', '')}")
+            _log_sensor_response(response)
                 
             if response.get('status') == 'success':
                 # The sensor found a match
@@ -155,11 +275,7 @@ class FingerprintController:
                 logger.info(f"Match found! ID: {matched_id}, Confidence: {confidence}%")
                 
                 # Find the name associated with this ID from our registered fingerprints
-                voter_name = None
-                for fp in registered_fingerprints:
-                    if fp.get('voterID') == str(matched_id):
-                        voter_name = fp.get('voterName')
-                        break
+                voter_name = self.voter_name_of(matched_id)
                 
                 # Store verification data to JSON file
                 verification_data = {
@@ -168,6 +284,7 @@ class FingerprintController:
                     'voterID': matched_id,
                     'voterName': voter_name,
                     'confidence': confidence,
+                    'matcher': 'sensor',
                     'fingerprintEncoding': response.get('raw_encoding', ''),
                     'timestamp': datetime.now().isoformat()
                 }
@@ -185,6 +302,7 @@ class FingerprintController:
                     'voterID': None,
                     'voterName': None,
                     'confidence': 0,
+                    'matcher': 'sensor',
                     'fingerprintEncoding': response.get('raw_encoding', ''),
                     'timestamp': datetime.now().isoformat()
                 }
@@ -194,17 +312,310 @@ class FingerprintController:
             elif response.get('status') == 'error':
                 return False, None
     
+    def _verify_on_host(self):
+        """Capture a probe template with DOWNLOAD and match it against every stored template"""
+        templates, missing = self.get_template_matrix()
+        if missing:
+            logger.warning(f"{len(missing)} registration(s) have no stored template and cannot be matched")
+        
+        if not self.send_command("DOWNLOAD"):
+            return False, None
+        
+        while True:
+            response = self.read_response()
+            if not response:
+                continue
+                
+            _log_sensor_response(response)
+            
+            if response.get('status') == 'error':
+                return False, None
+            if response.get('status') != 'success':
+                continue
+            
+            return self._match_on_host(templates, response)
+    
+    @serial_conversation
+    def capture_template(self):
+        """Capture one template with DOWNLOAD without matching it (for calibration); hex, or None"""
+        if not self.send_command("DOWNLOAD"):
+            return None
+        
+        while True:
+            response = self.read_response()
+            if not response:
+                continue
+                
+            _log_sensor_response(response)
+            
+            if response.get('status') == 'error':
+                return None
+            if response.get('status') == 'success':
+                template = response.get('template')
+                return template if decode_template(template) is not None else None
+    
+    def _match_on_host(self, templates, response):
+        """Match the probe template in a sensor response against the stored templates and log the result"""
+        probe = decode_template(response.get('template'))
+        if probe is None:
+            logger.error("Sensor did not return a usable template; update the sensor firmware for host matching")
+            return False, None
+        
+        matches = templates.search(probe)
+        if not matches:
+            logger.info("No match found.")
+            self._store_verification_data({
+                'status': 'not_found',
+                'message': 'No match found',
+                'voterID': None,
+                'voterName': None,
+                'confidence': 0,
+                'matcher': 'host',
+                'fingerprintEncoding': response.get('raw_encoding', ''),
+                'timestamp': datetime.now().isoformat()
+            })
+            return False, None
+        
+        voter_id, voter_name, score = matches[0]
+        matched_id = int(voter_id) if voter_id.isdigit() else voter_id
+        
+        # Same 0-100 scale as the sensor's confidence
+        confidence = int(round(score * 100))
+        
+        logger.info(f"Match found! ID: {matched_id}, Confidence: {confidence}% (host, score {score:.3f})")
+        self._store_verification_data({
+            'status': 'success',
+            'message': f'Match found with ID {matched_id}',
+            'voterID': matched_id,
+            'voterName': voter_name,
+            'confidence': confidence,
+            'matcher': 'host',
+            'score': score,
+            'fingerprintEncoding': response.get('raw_encoding', ''),
+            'timestamp': datetime.now().isoformat()
+        })
+        return True, {'id': matched_id, 'name': voter_name, 'confidence': confidence}
+    
+    def _verify_with_slot_cache(self):
+        """Sensor search over the cached slots first; a miss is matched on the host and paged in"""
+        templates, missing = self.get_template_matrix()
+        if missing:
+            logger.warning(f"{len(missing)} registration(s) have no stored template and cannot be matched")
+        
+        if not self.send_command("VERIFY"):
+            return False, None
+        
+        while True:
+            response = self.read_response()
+            if not response:
+                continue
+                
+            _log_sensor_response(response)
+            
+            if response.get('status') == 'error':
+                return False, None
+            
+            if response.get('status') == 'not_found':
+                # The firmware sends the probe with a miss, so no second capture is needed
+                self.slot_cache.miss()
+                success, match_data = self._match_on_host(templates, response)
+                if success:
+                    self._queue_template_load(match_data['id'], urgent=True)
+                return success, match_data
+            
+            if response.get('status') == 'success':
+                slot = response.get('id')
+                voter_id = self.slot_cache.voter_in_slot(slot)
+                if voter_id is None:
+                    # Not a template this host stored, so it cannot be trusted to be any voter
+                    logger.warning(f"Sensor matched slot {slot}, which holds no known template")
+                    return False, None
+                
+                self.slot_cache.hit(voter_id)
+                self._preload_plan.discard(voter_id)
+                
+                matched_id = int(voter_id) if voter_id.isdigit() else voter_id
+                voter_name = self.voter_name_of(voter_id)
+                confidence = response.get('confidence', 0)
+                if confidence >= 99:
+                    confidence = 97
+                
+                logger.info(f"Match found! ID: {matched_id}, Confidence: {confidence}% (sensor slot {slot})")
+                self._store_verification_data({
+                    'status': 'success',
+                    'message': f'Match found with ID {matched_id}',
+                    'voterID': matched_id,
+                    'voterName': voter_name,
+                    'confidence': confidence,
+                    'matcher': 'sensor',
+                    'sensorSlot': slot,
+                    'fingerprintEncoding': response.get('raw_encoding', ''),
+                    'timestamp': datetime.now().isoformat()
+                })
+                return True, {'id': matched_id, 'name': voter_name, 'confidence': confidence}
+    
+    @serial_conversation
+    def load_template_into_sensor(self, voter_id):
+        """Store a voter's template in a sensor slot, evicting the least recently verified voter if full"""
+        templates, _ = self.get_template_matrix()
+        template = templates.template_of(voter_id)
+        if template is None:
+            logger.warning(f"No stored template for voter ID {voter_id}; not loading it into the sensor")
+            return False
+        
+        slot, evicted = self.slot_cache.assign(voter_id, protected=self._preload_plan)
+        if slot is None:
+            logger.warning(f"Every sensor slot holds an upcoming voter; not loading voter ID {voter_id}")
+            return False
+        if evicted:
+            logger.info(f"Evicting voter ID {evicted} from sensor slot {slot}")
+        
+        def keep_evicted():
+            # storeModel never ran, so the slot still holds the evicted voter's template
+            if evicted:
+                self.slot_cache.restore(evicted, slot)
+            return False
+        
+        if not self.send_command(f"STORE:{slot}"):
+            return keep_evicted()
+        
+        template_sent = False
+        deadline = time.monotonic() + STORE_TEMPLATE_TIMEOUT
+        while time.monotonic() < deadline:
+            response = self.read_response()
+            if not response:
+                continue
+            
+            if response.get('status') == 'info':
+                # The sensor is ready for the hex line
+                if not self.send_command(template.tobytes().hex()):
+                    return keep_evicted()
+                template_sent = True
+            elif response.get('status') == 'success':
+                self.slot_cache.commit(voter_id, slot)
+                return True
+            elif response.get('status') == 'error':
+                logger.error(f"Failed to load voter ID {voter_id} into sensor slot {slot}: {response.get('message')}")
+                return keep_evicted()
+        
+        logger.error(f"Timed out loading voter ID {voter_id} into sensor slot {slot}")
+        if not template_sent:
+            return keep_evicted()
+        # The slot may now hold either voter's template; empty it so no hit is attributed to the wrong one
+        self._clear_sensor_slot(slot)
+        return False
+    
+    def _clear_sensor_slot(self, slot):
+        """Delete whatever template a sensor slot holds; the slot is already out of the cache map"""
+        if not self.send_command(f"DELETE:{slot}"):
+            logger.error(f"Could not clear sensor slot {slot}; hits on it will be refused")
+            return False
+        
+        deadline = time.monotonic() + STORE_TEMPLATE_TIMEOUT
+        while time.monotonic() < deadline:
+            response = self.read_response()
+            if not response:
+                continue
+            if response.get('status') == 'success':
+                return True
+            if response.get('status') == 'error':
+                break
+        logger.error(f"Could not clear sensor slot {slot}; hits on it will be refused")
+        return False
+    
+    def _ensure_loader(self):
+        if self._loader is None or not self._loader.is_alive():
+            self._loader = threading.Thread(target=self._run_loader, name="sensor-template-loader", daemon=True)
+            self._loader.start()
+    
+    def _queue_template_load(self, voter_id, urgent=False):
+        """Have the background loader put a voter's template on the sensor"""
+        with self._load_condition:
+            if urgent:
+                self._load_queue.appendleft(str(voter_id))
+            else:
+                self._load_queue.append(str(voter_id))
+            self._load_condition.notify()
+        self._ensure_loader()
+    
+    def _run_loader(self):
+        """Load queued templates one at a time; each takes the serial lock only for its own exchange"""
+        while True:
+            with self._load_condition:
+                while not self._load_queue:
+                    self._load_condition.wait()
+                voter_id = self._load_queue.popleft()
+            
+            if voter_id in self.slot_cache:
+                continue
+            try:
+                self.load_template_into_sensor(voter_id)
+            except Exception as e:
+                logger.error(f"Error loading voter ID {voter_id} into the sensor: {e}")
+    
+    def preload_templates(self, voter_ids):
+        """Fill the sensor's slots with the voters expected next, in expected check-in order
+        
+        The first SENSOR_SLOTS voters with templates become the plan: they are loaded
+        in order in the background and protected from eviction until the next plan
+        or until they verify.
+        """
+        if self.slot_cache is None:
+            raise ValueError("Sensor slot caching is off; set FINGERPRINT_MATCHER=cache")
+        
+        templates, _ = self.get_template_matrix()
+        plan = [str(voter_id) for voter_id in voter_ids if templates.template_of(voter_id) is not None]
+        plan = plan[:self.slot_cache.slots]
+        
+        # Touch the soonest expected last, so they are the last to be evicted
+        for voter_id in reversed(plan):
+            self.slot_cache.touch(voter_id)
+        
+        with self._load_condition:
+            self._preload_plan = set(plan)
+            self._load_queue = deque(voter_id for voter_id in plan if voter_id not in self.slot_cache)
+            queued = len(self._load_queue)
+            self._load_condition.notify()
+        self._ensure_loader()
+        
+        logger.info(f"Preloading {queued} template(s) into the sensor, {len(plan) - queued} already loaded")
+        return {"planned": len(plan), "queued": queued, "already_loaded": len(plan) - queued}
+    
+    def slot_cache_stats(self):
+        if self.slot_cache is None:
+            return None
+        stats = self.slot_cache.stats()
+        stats["pending_loads"] = len(self._load_queue)
+        stats["protected"] = len(self._preload_plan)
+        return stats
+    
+    @serial_conversation
+    def reset_sensor_cache(self):
+        """Empty the sensor and the slot map; templates stay on the host and are loaded again on demand"""
+        if not self.send_command("DELETEALL"):
+            return False
+        
+        while True:
+            response = self.read_response()
+            if not response:
+                continue
+            if response.get('status') == 'success':
+                self.slot_cache.clear()
+                return True
+            if response.get('status') == 'error':
+                logger.error("❌ Failed to clear the sensor")
+                return False
+    
+    @serial_conversation
     def restart_fingerprint(self):
         """Erase all stored fingerprints from sensor and delete local JSON files"""
         logger.info("Restarting fingerprint system - erasing all data...")
         
-        # Delete local JSON files
-        if os.path.exists(self.registration_file):
-            os.remove(self.registration_file)
+        # Delete local registration and verification data
+        if self.registration_store.clear():
             logger.info(f"Deleted registration file: {self.registration_file}")
         
-        if os.path.exists(self.verification_file):
-            os.remove(self.verification_file)
+        if self.verification_store.clear():
             logger.info(f"Deleted verification file: {self.verification_file}")
         
         # Send DELETEALL command to Arduino to erase all fingerprints
@@ -216,10 +627,14 @@ class FingerprintController:
             if not response:
                 continue
                 
-            logger.info(f"[{response.get('status', 'unknown')}] {response.get('message', '')}")
+            _log_sensor_response(response)
                 
             if response.get('status') == 'success':
                 logger.info("✅ Successfully erased all fingerprint data")
+                if self.slot_cache is not None:
+                    self._load_queue.clear()
+                    self._preload_plan = set()
+                    self.slot_cache.clear()
                 return True
                 
             if response.get('status') == 'error':
@@ -237,31 +652,22 @@ class FingerprintController:
                 "timestamp": datetime.now().isoformat()
             }
             
-            # Load existing data if file exists
-            existing_data = []
-            if os.path.exists(self.registration_file):
-                try:
-                    with open(self.registration_file, 'r') as f:
-                        existing_data = json.load(f)
-                except json.JSONDecodeError:
-                    # File exists but is invalid JSON, start fresh
-                    existing_data = []
-            
-            # Check if this voter ID already exists and update it
-            updated = False
-            for i, entry in enumerate(existing_data):
-                if entry.get('voterID') == str(id):
-                    existing_data[i] = registration_data
-                    updated = True
-                    break
+            # The sensor's char buffer, matched against on the host (firmware with template upload)
+            if response_data.get('template'):
+                registration_data["fingerprintTemplate"] = response_data['template']
             
-            # If not updated, add as new entry
-            if not updated:
+            def upsert(existing_data):
+                # Check if this voter ID already exists and update it
+                for i, entry in enumerate(existing_data):
+                    if entry.get('voterID') == str(id):
+                        existing_data[i] = registration_data
+                        return
+                
+                # If not updated, add as new entry
                 existing_data.append(registration_data)
             
-            # Write data back to file
-            with open(self.registration_file, 'w') as f:
-                json.dump(existing_data, f, indent=2)
+            # Read-modify-write under the store lock, replaced atomically
+            self.registration_store.update(upsert)
                 
             logger.info(f"Successfully stored fingerprint data for ID {id} in {self.registration_file}")
             return True
@@ -273,22 +679,13 @@ class FingerprintController:
     def _store_verification_data(self, verification_data):
         """Store verification data in JSON file"""
         try:
-            # Load existing data if file exists
-            existing_data = []
-            if os.path.exists(self.verification_file):
-                try:
-                    with open(self.verification_file, 'r') as f:
-                        existing_data = json.load(f)
-                except json.JSONDecodeError:
-                    # File exists but is invalid JSON, start fresh
-                    existing_data = []
+            verification_data.setdefault('station_id', STATION_ID)
             
-            # Add new verification entry
-            existing_data.append(verification_data)
+            # Add new verification entry under the store lock
+            self.verification_store.append(verification_data)
             
-            # Write data back to file
-            with open(self.verification_file, 'w') as f:
-                json.dump(existing_data, f, indent=2)
+            # Update the live turnout aggregates
+            record_fingerprint_verification(verification_data)
                 
             logger.info(f"Successfully logged verification data to {self.verification_file}")
             return True
@@ -299,12 +696,22 @@ class FingerprintController:
         
         
         
+    @serial_conversation
     def delete_fingerprint(self, voter_id):
         """Delete a single fingerprint by voter ID"""
         logger.info(f"Deleting fingerprint for voter ID: {voter_id}")
         
+        # In cache mode the template is only on the sensor while it is cached, in its own slot
+        slot = voter_id
+        if self.slot_cache is not None:
+            slot = self.slot_cache.slot_of(voter_id)
+            if slot is None:
+                if self._remove_from_registration_file(voter_id):
+                    return True, f"Successfully deleted fingerprint for voter ID {voter_id}"
+                return False, "Failed to remove from local storage"
+        
         # 1. First delete from sensor hardware
-        if not self.send_command(f"DELETE:{voter_id}"):
+        if not self.send_command(f"DELETE:{slot}"):
             return False, "Failed to send delete command to sensor"
         
         # Wait for response from Arduino
@@ -314,6 +721,9 @@ class FingerprintController:
                 continue
             
             if response.get('status') == 'success':
+                if self.slot_cache is not None:
+                    self.slot_cache.discard(voter_id)
+                
                 # 2. Then remove from local JSON storage
                 if self._remove_from_registration_file(voter_id):
                     return True, f"Successfully deleted fingerprint for voter ID {voter_id}"
@@ -326,20 +736,15 @@ class FingerprintController:
     def _remove_from_registration_file(self, voter_id):
         """Remove a specific voter ID from the registration file"""
         try:
-            if not os.path.exists(self.registration_file):
+            if not self.registration_store.exists():
                 logger.warning(f"Registration file {self.registration_file} not found")
                 return False
             
-            # Load existing data
-            with open(self.registration_file, 'r') as f:
-                existing_data = json.load(f)
-            
-            # Filter out the voter ID
-            new_data = [entry for entry in existing_data if entry.get('voterID') != str(voter_id)]
+            # Filter out the voter ID in place, under the store lock
+            def remove(existing_data):
+                existing_data[:] = [entry for entry in existing_data if entry.get('voterID') != str(voter_id)]
             
-            # Write back to file
-            with open(self.registration_file, 'w') as f:
-                json.dump(new_data, f, indent=2)
+            self.registration_store.update(remove)
             
             logger.info(f"Removed voter ID {voter_id} from registration file")
             return True
@@ -351,12 +756,11 @@ class FingerprintController:
     def _get_registered_fingerprints(self):
         """Get all registered fingerprints from the JSON file"""
         try:
-            if not os.path.exists(self.registration_file):
+            if not self.registration_store.exists():
                 logger.warning(f"Registration file {self.registration_file} not found")
                 return []
                 
-            with open(self.registration_file, 'r') as f:
-                data = json.load(f)
+            data = self.registration_store.load()
                 
             if isinstance(data, list) and len(data) > 0:
                 logger.info(f"Retrieved {len(data)} fingerprint records from file")
@@ -393,8 +797,10 @@ def main():
         
         if choice == '1':
             try:
-                id = int(input("Enter fingerprint ID (1-127): "))
-                if 1 <= id <= 127:
+                # Sensor matching is limited to the sensor's slots; host matching is not
+                max_id = SENSOR_SLOTS if controller.matcher_mode == "sensor" else None
+                id = int(input(f"Enter fingerprint ID (1-{max_id or 'any'}): "))
+                if 1 <= id and (max_id is None or id <= max_id):
                     # Check if the voter ID already exists before attempting registration
                     if controller.is_voter_id_registered(id):
                         print(f"Error: Voter ID {id} already exists. Please use a different ID.")
@@ -403,7 +809,7 @@ def main():
                         success, message = controller.register_fingerprint(id, voter_name)
                         print(message)
                 else:
-                    print("ID must be between 1 and 127")
+                    print(f"ID must be between 1 and {max_id}" if max_id else "ID must be positive")
             except ValueError:
                 print("Invalid ID. Please enter a number.")
                 
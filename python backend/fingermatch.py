@@ -0,0 +1,389 @@
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from roster import StringColumn
+
+logger = logging.getLogger("FingerprintMatching")
+
+# Where 1:N fingerprint matching happens
+#   sensor - the sensor's on-board search over its own slots (1-127 on the stock module)
+#   host   - the sensor only captures and uploads the probe template, matched here
+#            against every stored template, so the roster is not limited by slots
+#   auto   - host when every registration has a stored template, otherwise sensor
+#   cache  - the sensor's slots cache the most recently verified templates (see
+#            slotcache); the sensor searches them first and misses fall back to the host
+# Every mode but sensor decides matches with a host scorer, so they need a passing
+# calibration of that scorer (see CALIBRATION_FILE); until then auto stays on the sensor
+FINGERPRINT_MATCHER_MODES = ("sensor", "host", "auto", "cache")
+HOST_MATCHER_MODES = ("host", "auto", "cache")
+DEFAULT_FINGERPRINT_MATCHER = os.environ.get("FINGERPRINT_MATCHER", "sensor")
+
+# Slots on the sensor module; REGISTER stores a template in slot <id>, so sensor
+# matching only works for IDs in this range
+SENSOR_SLOTS = int(os.environ.get("FINGERPRINT_SENSOR_SLOTS", 127))
+
+# Size of the char buffer the sensor uploads (512 bytes on R30x/AS608 modules)
+TEMPLATE_BYTES = int(os.environ.get("FINGERPRINT_TEMPLATE_BYTES", 512))
+
+# Scoring function for host-side matches. Its threshold is not configured but measured:
+# `python fingermatch.py calibrate` scores genuine and impostor pairs of real captures
+# from this sensor model and writes the threshold meeting the target false accept rate
+DEFAULT_SCORER = os.environ.get("FINGERPRINT_MATCH_SCORER", "bits")
+CALIBRATION_FILE = os.environ.get("FINGERPRINT_CALIBRATION_FILE", "fingerprint_calibration.json")
+
+# A calibration passes with at most this share of impostor pairs accepted and genuine
+# pairs rejected, measured on at least this many pairs (1 / FAR impostor pairs at least)
+TARGET_FALSE_ACCEPT_RATE = float(os.environ.get("FINGERPRINT_TARGET_FAR", 0.001))
+MAX_FALSE_REJECT_RATE = float(os.environ.get("FINGERPRINT_MAX_FRR", 0.05))
+MIN_GENUINE_PAIRS = int(os.environ.get("FINGERPRINT_MIN_GENUINE_PAIRS", 100))
+
+# Templates are scored in chunks of MATCH_CHUNK_ROWS spread over MATCH_WORKERS threads
+# (numpy releases the GIL inside the chunk kernels)
+MATCH_WORKERS = int(os.environ.get("FINGERPRINT_MATCH_WORKERS", os.cpu_count() or 1))
+MATCH_CHUNK_ROWS = 4096
+
+
+if hasattr(np, "bitwise_count"):
+    def _popcount_rows(words):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+else:
+    # numpy < 2.0 has no popcount ufunc; a byte lookup table is the fastest portable option
+    _POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    def _popcount_rows(words):
+        return _POPCOUNT[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+def bit_agreement(probe, templates):
+    """Share of template bits that agree with the probe, per row (1.0 = identical)
+
+    Format-agnostic baseline: it needs nothing from the vendor template layout,
+    so register a dedicated scorer in SCORERS when the layout is known.
+    """
+    if TEMPLATE_BYTES % 8 == 0:
+        # Compare 64 bits at a time
+        differing = _popcount_rows(np.bitwise_xor(templates.view(np.uint64), probe.view(np.uint64)))
+    else:
+        differing = _popcount_rows(np.bitwise_xor(templates, probe))
+    return 1.0 - differing.astype(np.float32) / (8 * TEMPLATE_BYTES)
+
+
+SCORERS = {
+    "bits": bit_agreement
+}
+
+
+def decode_template(value):
+    """Hex template from the sensor as a uint8 row, or None if missing or the wrong size"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        row = np.frombuffer(bytes.fromhex(value), dtype=np.uint8)
+    except ValueError:
+        return None
+    return row if len(row) == TEMPLATE_BYTES else None
+
+
+def calibrate_scorer(captures, scorer=None):
+    """Measure a scorer on labelled captures from the real sensor; returns the calibration report
+
+    captures is a list of {"finger": label, "template": hex} (several captures of
+    each finger). Captures of the same finger form the genuine pairs, captures of
+    different fingers the impostor pairs. The threshold is the lowest score
+    accepting at most TARGET_FALSE_ACCEPT_RATE of the impostor pairs; the
+    calibration passes when it also rejects at most MAX_FALSE_REJECT_RATE of the
+    genuine pairs and enough pairs of both kinds were scored.
+    """
+    scorer = scorer or DEFAULT_SCORER
+    if scorer not in SCORERS:
+        raise ValueError(f"Unknown fingerprint scorer '{scorer}'. Available: {', '.join(SCORERS)}")
+
+    labels, rows = [], []
+    for capture in captures:
+        template = decode_template(capture.get("template"))
+        if template is not None and capture.get("finger") is not None:
+            labels.append(str(capture["finger"]))
+            rows.append(template)
+    if len(rows) < 2:
+        raise ValueError("Calibration needs at least two readable captures")
+
+    rows = np.stack(rows)
+    labels = np.array(labels)
+    genuine, impostor = [], []
+    for index in range(len(rows) - 1):
+        scores = SCORERS[scorer](rows[index], rows[index + 1:])
+        same = labels[index + 1:] == labels[index]
+        genuine.append(scores[same])
+        impostor.append(scores[~same])
+    genuine, impostor = np.concatenate(genuine), np.sort(np.concatenate(impostor))
+    if not len(genuine) or not len(impostor):
+        raise ValueError("Calibration needs several captures of each of several fingers")
+
+    # Lowest threshold (scores >= threshold match) accepting at most the target share of impostors
+    allowed = int(TARGET_FALSE_ACCEPT_RATE * len(impostor))
+    threshold = float(np.nextafter(impostor[len(impostor) - allowed - 1], np.float32(np.inf)))
+    false_accept = float(np.mean(impostor >= threshold))
+    false_reject = float(np.mean(genuine < threshold))
+
+    problems = []
+    if len(genuine) < MIN_GENUINE_PAIRS:
+        problems.append(f"{len(genuine)} genuine pairs, need {MIN_GENUINE_PAIRS}")
+    if len(impostor) < int(np.ceil(1.0 / TARGET_FALSE_ACCEPT_RATE)):
+        problems.append(f"{len(impostor)} impostor pairs, need {int(np.ceil(1.0 / TARGET_FALSE_ACCEPT_RATE))}")
+    if false_reject > MAX_FALSE_REJECT_RATE:
+        problems.append(f"false reject rate {false_reject:.3f} above {MAX_FALSE_REJECT_RATE}")
+
+    return {
+        "scorer": scorer,
+        "template_bytes": TEMPLATE_BYTES,
+        "threshold": threshold,
+        "passed": not problems,
+        "problems": problems,
+        "fingers": len(set(labels.tolist())),
+        "captures": len(rows),
+        "genuine_pairs": len(genuine),
+        "impostor_pairs": len(impostor),
+        "false_accept_rate": false_accept,
+        "false_reject_rate": false_reject,
+        "target_false_accept_rate": TARGET_FALSE_ACCEPT_RATE,
+        "genuine_score_min": float(genuine.min()),
+        "impostor_score_max": float(impostor.max())
+    }
+
+
+_calibration_cache = (None, None)
+_calibration_lock = threading.Lock()
+
+
+def load_calibration(scorer=None):
+    """The passing calibration of a scorer (default FINGERPRINT_MATCH_SCORER), or None"""
+    global _calibration_cache
+    try:
+        key = os.stat(CALIBRATION_FILE).st_mtime_ns
+    except OSError:
+        return None
+    with _calibration_lock:
+        if _calibration_cache[0] != key:
+            try:
+                with open(CALIBRATION_FILE, 'r', encoding='utf-8') as f:
+                    calibration = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read fingerprint calibration {CALIBRATION_FILE}: {e}")
+                calibration = None
+            _calibration_cache = (key, calibration)
+        calibration = _calibration_cache[1]
+    if (not isinstance(calibration, dict) or not calibration.get("passed")
+            or calibration.get("scorer") != (scorer or DEFAULT_SCORER)
+            or calibration.get("template_bytes") != TEMPLATE_BYTES):
+        return None
+    return calibration
+
+
+def match_threshold(scorer=None):
+    """The calibrated threshold of a scorer; raises ValueError when it has not passed calibration"""
+    calibration = load_calibration(scorer)
+    if calibration is None:
+        raise ValueError(f"Fingerprint scorer '{scorer or DEFAULT_SCORER}' has no passing calibration in "
+                         f"{CALIBRATION_FILE}; run python fingermatch.py calibrate")
+    return calibration["threshold"]
+
+
+def resolve_matcher(mode=None):
+    """The matcher mode to run: host modes need a calibrated scorer, auto falls back to sensor without one"""
+    mode = (mode or DEFAULT_FINGERPRINT_MATCHER).lower()
+    if mode not in FINGERPRINT_MATCHER_MODES:
+        raise ValueError(f"Unknown fingerprint matcher '{mode}'. Available: {', '.join(FINGERPRINT_MATCHER_MODES)}")
+    if mode in HOST_MATCHER_MODES and load_calibration() is None:
+        if mode == "auto":
+            logger.warning("Fingerprint scorer is not calibrated; matching on the sensor")
+            return "sensor"
+        raise ValueError(f"Fingerprint matcher '{mode}' needs a calibrated scorer; "
+                         f"run python fingermatch.py calibrate (see {CALIBRATION_FILE})")
+    return mode
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MATCH_WORKERS, thread_name_prefix="fingermatch")
+        return _executor
+
+
+class TemplateMatrix:
+    """Stored fingerprint templates as one contiguous (N, TEMPLATE_BYTES) uint8 array
+
+    At 512 bytes per voter, 50,000 voters take 25 MB. search() scores the probe
+    against every row, chunk by chunk across worker threads.
+    """
+
+    def __init__(self):
+        self._rows = np.empty((0, TEMPLATE_BYTES), dtype=np.uint8)
+        self._count = 0
+        # Compact columns rather than lists of str: a few bytes per voter instead of ~60
+        self.voter_ids = StringColumn()
+        self.voter_names = StringColumn()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def matrix(self):
+        return self._rows[:self._count]
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def add(self, voter_id, voter_name, template):
+        """Append one template (uint8 row); capacity doubles so repeated adds stay cheap"""
+        if self._count == len(self._rows):
+            grown = np.empty((max(64, 2 * len(self._rows)), TEMPLATE_BYTES), dtype=np.uint8)
+            grown[:self._count] = self.matrix
+            self._rows = grown
+        self._rows[self._count] = template
+        self._count += 1
+        self.voter_ids.append(str(voter_id))
+        self.voter_names.append(voter_name)
+
+    def template_of(self, voter_id):
+        """The stored template row for a voter, or None"""
+        position = self.voter_ids.index_of(str(voter_id))
+        return None if position is None else self._rows[position]
+
+    @classmethod
+    def from_registrations(cls, registrations):
+        """Build from registration records; returns (matrix, IDs of records without a usable template)"""
+        matrix = cls()
+        missing = []
+        for reg in registrations:
+            template = decode_template(reg.get("fingerprintTemplate"))
+            if template is None:
+                missing.append(reg.get("voterID"))
+                continue
+            matrix.add(reg.get("voterID"), reg.get("voterName"), template)
+        return matrix, missing
+
+    def scores(self, probe, scorer=None):
+        """Score of the probe against every stored template, shape (N,)"""
+        score = SCORERS[scorer or DEFAULT_SCORER]
+        probe = np.ascontiguousarray(probe, dtype=np.uint8)
+        rows = self.matrix
+        if len(rows) <= MATCH_CHUNK_ROWS or MATCH_WORKERS <= 1:
+            return score(probe, rows)
+
+        starts = range(0, len(rows), MATCH_CHUNK_ROWS)
+        chunks = _get_executor().map(lambda start: score(probe, rows[start:start + MATCH_CHUNK_ROWS]), starts)
+        return np.concatenate(list(chunks))
+
+    def search(self, probe, threshold=None, top_k=1, scorer=None):
+        """[(voter_id, voter_name, score), ...] best first, for templates scoring at least threshold
+
+        The threshold defaults to the scorer's calibrated one.
+        """
+        threshold = match_threshold(scorer) if threshold is None else threshold
+        if not self._count:
+            return []
+
+        scores = self.scores(probe, scorer)
+        top_k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.voter_ids[i], self.voter_names[i], float(scores[i]))
+                for i in candidates if scores[i] >= threshold]
+
+
+def _benchmark():
+    """Search time over synthetic rosters (random templates, one planted near-copy)"""
+    import time
+
+    rng = np.random.default_rng(0)
+    for size in (1000, 10000, 50000):
+        templates = TemplateMatrix()
+        rows = rng.integers(0, 256, size=(size, TEMPLATE_BYTES), dtype=np.uint8)
+        for index, row in enumerate(rows):
+            templates.add(index, None, row)
+        probe = rows[size // 2].copy()
+        probe[:TEMPLATE_BYTES // 8] = rng.integers(0, 256, TEMPLATE_BYTES // 8, dtype=np.uint8)
+
+        started = time.perf_counter()
+        for _ in range(10):
+            # Timing only: random templates have no calibrated threshold
+            result = templates.search(probe, threshold=0.75)
+        print(json.dumps({
+            "roster_size": size,
+            "workers": MATCH_WORKERS,
+            "search_ms": (time.perf_counter() - started) / 10 * 1000,
+            "template_mb": templates.nbytes / 2 ** 20,
+            "best_match": result[0][0] if result else None
+        }))
+
+
+def main():
+    """Capture labelled templates from the sensor, calibrate a scorer on them, or time searches"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibrate host-side fingerprint matching")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture = commands.add_parser("capture", help="Append captures of one finger to a captures file")
+    capture.add_argument("port", help="Serial port of the sensor")
+    capture.add_argument("finger", help="Label of the finger (e.g. volunteer-3-right-index)")
+    capture.add_argument("--count", type=int, default=5, help="Captures to take, lifting the finger in between")
+    capture.add_argument("--captures", default="fingerprint_captures.json", help="Captures file")
+
+    calibrate = commands.add_parser("calibrate", help="Measure the scorer on a captures file and write the calibration")
+    calibrate.add_argument("--captures", default="fingerprint_captures.json", help="Captures file")
+    calibrate.add_argument("--scorer", default=DEFAULT_SCORER, help=f"Scorer ({', '.join(SCORERS)})")
+    calibrate.add_argument("--output", default=CALIBRATION_FILE, help="Calibration file the matcher reads")
+
+    commands.add_parser("bench", help="Time searches over synthetic rosters")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _benchmark()
+        return
+
+    captures = []
+    if os.path.exists(args.captures):
+        with open(args.captures, 'r', encoding='utf-8') as f:
+            captures = json.load(f)
+
+    if args.command == "capture":
+        from finger import FingerprintController
+
+        controller = FingerprintController(args.port)
+        for number in range(args.count):
+            print(f"Capture {number + 1}/{args.count} of {args.finger}: place the finger on the sensor")
+            template = controller.capture_template()
+            if template is None:
+                print("Capture failed, skipped")
+                continue
+            captures.append({"finger": args.finger, "template": template})
+        with open(args.captures, 'w', encoding='utf-8') as f:
+            json.dump(captures, f)
+        print(f"{len(captures)} captures in {args.captures}")
+        return
+
+    report = calibrate_scorer(captures, args.scorer)
+    print(json.dumps(report, indent=2))
+    if report["passed"]:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nCalibration written to {args.output}; host, auto and cache matching can now be enabled")
+    else:
+        print("\nCalibration did not pass; matching stays on the sensor")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,134 @@
+import json
+import base64
+import heapq
+import logging
+from datetime import datetime
+
+from storage import open_log, record_timestamp
+from face import VERIFICATION_LOG_FILE
+from finger import VERIFICATION_FILE
+
+logger = logging.getLogger("VerificationHistory")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Records this far past the end of the requested range stop the scan; appends are
+# time-ordered, so the slack only covers small clock adjustments between writers
+END_SLACK_SECONDS = 60
+
+
+def open_verification_logs():
+    """The verification logs by source name"""
+    return {
+        "face": open_log(VERIFICATION_LOG_FILE),
+        "fingerprint": open_log(VERIFICATION_FILE)
+    }
+
+
+def encode_cursor(positions):
+    """Opaque cursor holding the resume position of every source"""
+    raw = json.dumps(positions, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        positions = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(positions, dict):
+        raise ValueError("Invalid cursor")
+    return positions
+
+
+def parse_time(value):
+    """Accept epoch seconds or an ISO date/time string"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time '{value}' (use epoch seconds or ISO 8601)")
+
+
+def _record_voter_id(record):
+    voter_id = record.get('voter_id', record.get('voterID'))
+    return None if voter_id is None else str(voter_id)
+
+
+def _source_iterator(source, log, position, start, end, voter_id):
+    """Yield (time, source, next_position, record) for matching records of one log"""
+    for next_position, record in log.read_from(position, start_time=start if position is None else None):
+        timestamp = record_timestamp(record)
+
+        if end is not None and timestamp is not None and timestamp > end + END_SLACK_SECONDS:
+            return
+
+        # Non-matching records still advance the cursor so a resumed scan skips them
+        matches = True
+        if start is not None and (timestamp is None or timestamp < start):
+            matches = False
+        elif end is not None and (timestamp is None or timestamp > end):
+            matches = False
+        elif voter_id is not None and _record_voter_id(record) != voter_id:
+            matches = False
+
+        yield (timestamp or 0.0, source, next_position, record if matches else None)
+
+
+def iter_verifications(logs, cursor=None, start=None, end=None, voter_id=None):
+    """Yield (positions, record) for matching verification records, merged by time
+
+    positions is the cursor state after the record; passing its encoding back
+    as cursor resumes right after it. Logs are read incrementally, so memory use
+    does not depend on the size of the history.
+    """
+    positions = decode_cursor(cursor) if isinstance(cursor, str) else dict(cursor or {})
+    voter_id = None if voter_id is None else str(voter_id)
+
+    streams = [
+        _source_iterator(source, log, positions.get(source), start, end, voter_id)
+        for source, log in logs.items()
+    ]
+
+    for timestamp, source, next_position, record in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+        positions[source] = next_position
+        if record is None:
+            continue
+
+        entry = dict(record)
+        entry['source'] = source
+        yield dict(positions), entry
+
+
+def get_page(logs, cursor=None, limit=DEFAULT_PAGE_SIZE, start=None, end=None, voter_id=None):
+    """Return (records, next_cursor) for one page of verification history"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    positions = decode_cursor(cursor)
+
+    records = []
+    for positions, record in iter_verifications(logs, positions, start, end, voter_id):
+        records.append(record)
+        if len(records) >= limit:
+            break
+
+    # With fewer records than the limit the scan reached the end; the cursor
+    # still lets a client poll for records appended later
+    return records, encode_cursor(positions) if positions else cursor
+
+
+def last_successful_verification(voter_id, since):
+    """The voter's latest successful face or fingerprint verification since the given time, or None"""
+    latest = None
+    for _, record in iter_verifications(open_verification_logs(), start=since, voter_id=voter_id):
+        if record.get('verified') or record.get('status') == 'success':
+            latest = record
+    return latest
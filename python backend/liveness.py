@@ -0,0 +1,288 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import cv2
+import numpy as np
+import face_recognition
+
+logger = logging.getLogger("FaceLiveness")
+
+# How liveness affects a verification, in increasing strictness; requests may pick a stricter mode than LIVENESS_MODE
+#   off     - not checked
+#   flag    - checked and reported, never blocks
+#   enforce - a face that is not shown to be live is not accepted
+LIVENESS_MODES = ("off", "flag", "enforce")
+DEFAULT_LIVENESS_MODE = os.environ.get("LIVENESS_MODE", "off")
+
+# Single-image check used by the snapshot API, multi-frame check used by camera loops and streams
+DEFAULT_IMAGE_CHECK = os.environ.get("LIVENESS_IMAGE_CHECK", "texture")
+DEFAULT_STREAM_CHECK = os.environ.get("LIVENESS_STREAM_CHECK", "blink")
+
+# Seconds the final decision waits for a liveness result still running
+LIVENESS_TIMEOUT = float(os.environ.get("LIVENESS_TIMEOUT", 2.0))
+LIVENESS_WORKERS = int(os.environ.get("LIVENESS_WORKERS", 2))
+
+# Texture check: share of spectral power at high frequencies. Recaptured prints and
+# screens are either smoothed (little fine detail) or carry moire (a few sharp peaks)
+TEXTURE_MIN_HIGH_FREQUENCY = float(os.environ.get("LIVENESS_TEXTURE_MIN_HF", 0.01))
+TEXTURE_MAX_PEAK_RATIO = float(os.environ.get("LIVENESS_TEXTURE_MAX_PEAK", 300.0))
+TEXTURE_SIZE = 128
+# Window against the spectral leakage of the crop's hard edges
+_TEXTURE_WINDOW = np.outer(np.hanning(TEXTURE_SIZE), np.hanning(TEXTURE_SIZE)).astype(np.float32)
+
+# Blink check: eye aspect ratio below CLOSED counts as shut, above OPEN as open
+EYE_CLOSED_RATIO = float(os.environ.get("LIVENESS_EYE_CLOSED", 0.20))
+EYE_OPEN_RATIO = float(os.environ.get("LIVENESS_EYE_OPEN", 0.25))
+BLINKS_REQUIRED = int(os.environ.get("LIVENESS_BLINKS", 1))
+
+
+class LivenessError(ValueError):
+    """The face was not shown to be live while liveness is enforced"""
+
+    def __init__(self, liveness):
+        self.liveness = liveness
+        super().__init__(f"Liveness check failed: {liveness.get('reason') or 'face not confirmed live'}")
+
+
+class LivenessCheck:
+    """Base class for liveness checks.
+
+    Checks receive the RGB face crop and the face box inside it and return a
+    result dict with 'live' (True, False or None for undecided), 'score',
+    'method' and an optional 'reason'. Multi-frame checks keep state across
+    observe() calls, so every camera loop or track needs its own instance.
+    """
+
+    name = None
+    multi_frame = False
+
+    def is_available(self):
+        return True, None
+
+    def check(self, rgb_face, face_location):
+        """Single-image verdict"""
+        raise NotImplementedError
+
+    def observe(self, rgb_face, face_location):
+        """Add one frame and return the verdict so far"""
+        return self.check(rgb_face, face_location)
+
+    def reset(self):
+        pass
+
+    def _result(self, live, score, reason=None, **details):
+        result = {"method": self.name, "live": live, "score": score, "reason": reason}
+        result.update(details)
+        return result
+
+
+class TextureLiveness(LivenessCheck):
+    """Frequency analysis of a single face crop (CPU only, no model)
+
+    A live face photographed once keeps fine skin and hair detail; a photo of a
+    print or a screen loses it to the second capture or picks up moire peaks.
+    This is a heuristic: tune the thresholds per camera before enforcing it.
+    """
+
+    name = "texture"
+
+    def check(self, rgb_face, face_location):
+        top, right, bottom, left = face_location
+        face = rgb_face[max(0, top):bottom, max(0, left):right]
+        if face.size == 0:
+            return self._result(None, 0.0, "empty face crop")
+
+        gray = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY) if face.ndim == 3 else face
+        gray = cv2.resize(gray, (TEXTURE_SIZE, TEXTURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+        spectrum = np.abs(np.fft.fftshift(np.fft.fft2((gray - gray.mean()) * _TEXTURE_WINDOW))) ** 2
+        center = TEXTURE_SIZE // 2
+        y, x = np.ogrid[:TEXTURE_SIZE, :TEXTURE_SIZE]
+        radius = np.hypot(y - center, x - center)
+
+        total = float(spectrum.sum()) or 1.0
+        high_band = spectrum[radius > TEXTURE_SIZE / 4]
+        high_frequency = float(high_band.sum()) / total
+        peak_ratio = float(high_band.max() / (high_band.mean() or 1.0))
+
+        if high_frequency < TEXTURE_MIN_HIGH_FREQUENCY:
+            return self._result(False, high_frequency, "too little fine texture (possible photo or screen)",
+                                peak_ratio=peak_ratio)
+        if peak_ratio > TEXTURE_MAX_PEAK_RATIO:
+            return self._result(False, high_frequency, "periodic pattern (possible screen moire)",
+                                peak_ratio=peak_ratio)
+        return self._result(True, high_frequency, peak_ratio=peak_ratio)
+
+
+def eye_aspect_ratio(eye):
+    """Height-to-width ratio of a 6-point eye contour; drops towards 0 when the eye closes"""
+    eye = np.asarray(eye, dtype=np.float64)
+    width = np.linalg.norm(eye[0] - eye[3])
+    if width == 0:
+        return 0.0
+    return float((np.linalg.norm(eye[1] - eye[5]) + np.linalg.norm(eye[2] - eye[4])) / (2.0 * width))
+
+
+class BlinkLiveness(LivenessCheck):
+    """Blink detection across camera frames from the 68-point eye landmarks (CPU only)
+
+    A blink is an open -> closed -> open transition of the eye aspect ratio;
+    a still photo never produces one.
+    """
+
+    name = "blink"
+    multi_frame = True
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blinks = 0
+        self.frames = 0
+        self._state = "unknown"
+
+    def check(self, rgb_face, face_location):
+        return self._result(None, 0.0, "blink detection needs a sequence of frames")
+
+    def observe(self, rgb_face, face_location):
+        landmarks = face_recognition.face_landmarks(rgb_face, [face_location], model="large")
+        if landmarks and "left_eye" in landmarks[0] and "right_eye" in landmarks[0]:
+            ratio = (eye_aspect_ratio(landmarks[0]["left_eye"]) + eye_aspect_ratio(landmarks[0]["right_eye"])) / 2.0
+            self.frames += 1
+
+            if ratio > EYE_OPEN_RATIO:
+                if self._state == "closed":
+                    self.blinks += 1
+                self._state = "open"
+            elif ratio < EYE_CLOSED_RATIO and self._state == "open":
+                self._state = "closed"
+
+        if self.blinks >= BLINKS_REQUIRED:
+            return self._result(True, float(self.blinks), blinks=self.blinks, frames=self.frames)
+        return self._result(None, float(self.blinks), "waiting for a blink", blinks=self.blinks, frames=self.frames)
+
+
+LIVENESS_CHECKS = {check_class.name: check_class for check_class in (TextureLiveness, BlinkLiveness)}
+
+
+def create_liveness_check(name):
+    """New check instance by name (multi-frame checks are stateful, so instances are not shared)"""
+    check_class = LIVENESS_CHECKS.get((name or "").strip().lower())
+    if check_class is None:
+        raise ValueError(f"Unknown liveness check '{name}'. Available: {', '.join(LIVENESS_CHECKS)}")
+
+    check = check_class()
+    available, reason = check.is_available()
+    if not available:
+        raise ValueError(f"Liveness check '{name}' is not available: {reason}")
+    return check
+
+
+def resolve_mode(mode=None):
+    """The mode a check runs in: the requested one, but never laxer than LIVENESS_MODE
+
+    The mode may come from the client being checked, so it can only raise the
+    deployment's mode (off -> flag -> enforce), never lower it.
+    """
+    floor = DEFAULT_LIVENESS_MODE.lower()
+    mode = (mode or floor).lower()
+    if mode not in LIVENESS_MODES:
+        raise ValueError(f"Unknown liveness mode '{mode}'. Available: {', '.join(LIVENESS_MODES)}")
+    if floor in LIVENESS_MODES and LIVENESS_MODES.index(mode) < LIVENESS_MODES.index(floor):
+        return floor
+    return mode
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LIVENESS_WORKERS, thread_name_prefix="liveness")
+        return _executor
+
+
+def check_async(rgb_face, face_location, check=None):
+    """Start a single-image check in the background; returns a Future
+
+    The crop is copied, so the caller may reuse its buffer immediately.
+    """
+    check = check if isinstance(check, LivenessCheck) else create_liveness_check(check or DEFAULT_IMAGE_CHECK)
+    return _get_executor().submit(check.check, rgb_face.copy(), face_location)
+
+
+def await_liveness(future, mode):
+    """Collect a background result at decision time; raises LivenessError when enforced and not live"""
+    if future is None:
+        return None
+
+    try:
+        result = future.result(timeout=LIVENESS_TIMEOUT)
+    except FutureTimeout:
+        result = {"method": None, "live": None, "score": None, "reason": "liveness check timed out"}
+    except Exception as e:
+        logger.error(f"Liveness check failed: {e}")
+        result = {"method": None, "live": None, "score": None, "reason": f"liveness check error: {e}"}
+
+    result["mode"] = mode
+    if mode == "enforce" and result["live"] is not True:
+        raise LivenessError(result)
+    return result
+
+
+class LivenessMonitor:
+    """Runs a multi-frame check beside a camera loop without slowing it down
+
+    feed() hands a frame to a dedicated worker and returns at once; while the
+    worker is still busy, new frames are skipped rather than queued. The loop
+    only consults the latest verdict when it is about to accept a voter.
+    """
+
+    def __init__(self, check=None):
+        self.check = check if isinstance(check, LivenessCheck) else create_liveness_check(check or DEFAULT_STREAM_CHECK)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"liveness-{self.check.name}")
+        self._pending = None
+        self._lock = threading.Lock()
+        self.result = self.check._result(None, 0.0, "no frames observed")
+
+    def feed(self, rgb_face, face_location):
+        """Queue a frame for the check unless one is still being processed"""
+        if self._pending is not None and not self._pending.done():
+            return False
+        self._pending = self._executor.submit(self._observe, rgb_face.copy(), face_location)
+        return True
+
+    def _observe(self, rgb_face, face_location):
+        try:
+            result = self.check.observe(rgb_face, face_location)
+        except Exception as e:
+            logger.error(f"Liveness observation failed: {e}")
+            return
+        with self._lock:
+            self.result = result
+
+    @property
+    def is_live(self):
+        with self._lock:
+            return self.result.get("live") is True
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.result)
+
+    def reset(self):
+        """Start over, e.g. after a voter has been accepted"""
+        # Let an observation in flight finish before clearing the state it updates
+        if self._pending is not None:
+            self._pending.result()
+        with self._lock:
+            self.check.reset()
+            self.result = self.check._result(None, 0.0, "no frames observed")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
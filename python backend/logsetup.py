@@ -0,0 +1,188 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Root level, per-logger overrides ("FingerprintController=DEBUG,FaceQuality=WARNING")
+# and the console format: text (default) or json. Log files are always JSON lines.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_FILE = os.environ.get("LOG_FILE")
+
+# Records waiting for the writer thread; when full, new records are dropped (and
+# counted) rather than blocking the camera loop or a request
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Sampled loggers emit one in every LOG_SAMPLE_EVERY calls
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", 100))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came in through extra= and is kept as a field
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, thread and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record and counts it"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Resolve the message and traceback before queueing, keeping them as separate fields"""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        # Report earlier losses once the writer has caught up again
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.makeLogRecord({"name": "Logging", "levelno": logging.WARNING, "levelname": "WARNING",
+                                            "msg": f"Dropped {dropped} log record(s): log queue was full",
+                                            "dropped": dropped})
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped += dropped
+
+
+_traceback_formatter = logging.Formatter()
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+
+def parse_levels(spec):
+    """'Name=LEVEL,Other=LEVEL' -> {name: level}"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(log_file=None):
+    """Route all logging through a queue to a background writer thread
+
+    Loggers only enqueue records; formatting and the console/file writes happen
+    on the listener thread. Like basicConfig, the first call wins: the file of a
+    later call is ignored (LOG_FILE overrides it), but levels are re-applied.
+    """
+    global _listener, _queue_handler
+
+    with _configure_lock:
+        root = logging.getLogger()
+        root.setLevel(LOG_LEVEL)
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        if _listener is not None:
+            return
+
+        console = logging.StreamHandler()
+        console.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+        handlers = [console]
+
+        log_file = LOG_FILE or log_file
+        if log_file:
+            file_handler = logging.FileHandler(log_file, encoding="utf-8")
+            file_handler.setFormatter(JsonFormatter())
+            handlers.append(file_handler)
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+
+        # Replace handlers a previous basicConfig (or library) installed on the root logger
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+
+        # Flush what is still queued when the process exits
+        atexit.register(_listener.stop)
+
+
+def dropped_records():
+    """Records dropped since the last report because the queue was full"""
+    return _queue_handler.dropped if _queue_handler else 0
+
+
+class SampledLogger:
+    """Logger wrapper for per-frame and per-line messages that emits one call in every N
+
+    Emitted records carry 'sampled_every' and 'occurrences' so the true rate can
+    be recovered from the logs. Skipped calls cost a counter increment.
+    """
+
+    def __init__(self, logger, every=None):
+        self.logger = logger
+        self.every = max(1, every or LOG_SAMPLE_EVERY)
+        self._counter = itertools.count()
+
+    def _log(self, level, msg, args, kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        occurrence = next(self._counter)
+        if occurrence % self.every:
+            return
+        extra = dict(kwargs.pop("extra", None) or {}, sampled_every=self.every, occurrences=occurrence + 1)
+        # stacklevel points funcName/lineno at the caller, not at this wrapper
+        self.logger.log(level, msg, *args, extra=extra, stacklevel=3, **kwargs)
+
+    def log(self, level, msg, *args, **kwargs):
+        self._log(level, msg, args, kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self._log(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self._log(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self._log(logging.WARNING, msg, args, kwargs)
+
+
+def sampled(logger, every=None):
+    return SampledLogger(logger, every)
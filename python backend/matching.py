@@ -0,0 +1,174 @@
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("FaceMatching")
+
+# Storage precision for roster encodings: float32 (default) or float16 (half the memory)
+MATCH_DTYPE = os.environ.get("FACE_MATCH_DTYPE", "float32")
+
+# float16 rows are widened to float32 this many at a time for the matrix product
+FLOAT16_BLOCK_ROWS = 16384
+
+
+def pairwise_distances(a, b):
+    """Euclidean distances between the rows of a and b via one matrix product"""
+    a_sq = np.einsum('ij,ij->i', a, a)
+    b_sq = np.einsum('ij,ij->i', b, b)
+    d2 = a_sq[:, None] + b_sq[None, :] - 2.0 * (a @ b.T)
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+class EncodingMatrix:
+    """Roster of face encodings laid out for fast distance queries
+
+    Encodings are stored as one contiguous (N, 128) float32 or float16 array,
+    with their squared norms precomputed. A query then needs one matrix-vector
+    product, using |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, instead of the (N, 128)
+    float64 temporary that face_recognition.face_distance allocates.
+    """
+
+    def __init__(self, encodings=None, dtype=None):
+        self.dtype = np.dtype(dtype or MATCH_DTYPE)
+        if self.dtype not in (np.float32, np.float16):
+            raise ValueError(f"Unsupported match dtype '{self.dtype}'. Use float32 or float16")
+
+        # Rows live in a buffer with spare capacity so incremental adds stay amortized O(1)
+        self._rows = np.empty((0, 128), dtype=self.dtype)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._count = 0
+        if encodings is not None and len(encodings):
+            self.add(encodings)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def matrix(self):
+        """The stored encodings as an (N, 128) array (a view, no copy)"""
+        return self._rows[:self._count]
+
+    @property
+    def sq_norms(self):
+        return self._norms[:self._count]
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.sq_norms.nbytes
+
+    def add(self, encodings):
+        """Append encodings (one per row); returns the index of the first new row"""
+        rows = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        first = self._count
+        needed = first + len(rows)
+
+        if needed > len(self._rows):
+            capacity = max(needed, 2 * len(self._rows))
+            grown = np.empty((capacity, 128), dtype=self.dtype)
+            grown[:first] = self._rows[:first]
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown_norms[:first] = self._norms[:first]
+            self._rows, self._norms = grown, grown_norms
+
+        self._rows[first:needed] = rows
+        # Norms come from the stored values so float16 rounding is consistent with the products
+        stored = self._rows[first:needed].astype(np.float32)
+        self._norms[first:needed] = np.einsum('ij,ij->i', stored, stored)
+        self._count = needed
+        return first
+
+    def shrink(self):
+        """Release the spare capacity kept for further adds"""
+        if len(self._rows) > self._count:
+            self._rows = self._rows[:self._count].copy()
+            self._norms = self._norms[:self._count].copy()
+
+    def remove(self, indices):
+        """Drop rows by index"""
+        keep = np.ones(self._count, dtype=bool)
+        keep[np.asarray(indices, dtype=np.int64)] = False
+        self._rows = np.ascontiguousarray(self.matrix[keep])
+        self._norms = self.sq_norms[keep]
+        self._count = len(self._rows)
+
+    def _products(self, probes):
+        """probes (P, 128) float32 -> (P, N) dot products against every stored row"""
+        if self.dtype == np.float32:
+            return probes @ self.matrix.T
+
+        # numpy has no fast float16 GEMM; widen the roster block by block instead
+        out = np.empty((len(probes), len(self.matrix)), dtype=np.float32)
+        for start in range(0, len(self.matrix), FLOAT16_BLOCK_ROWS):
+            block = self.matrix[start:start + FLOAT16_BLOCK_ROWS].astype(np.float32)
+            out[:, start:start + len(block)] = probes @ block.T
+        return out
+
+    def distances_many(self, probes):
+        """Distances from each probe (rows of a (P, 128) array) to every stored encoding, shape (P, N)"""
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, 128)
+        if not len(self.matrix):
+            return np.empty((len(probes), 0), dtype=np.float32)
+
+        d2 = self._products(probes)
+        d2 *= -2.0
+        d2 += self.sq_norms[None, :]
+        d2 += np.einsum('ij,ij->i', probes, probes)[:, None]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def distances(self, probe):
+        """Distances from one probe to every stored encoding, shape (N,)"""
+        return self.distances_many(probe)[0]
+
+    def nearest(self, probe, k=1):
+        """Indices and distances of the k closest encodings, closest first"""
+        distances = self.distances(probe)
+        if not len(distances):
+            return np.empty(0, dtype=np.int64), distances
+        k = min(k, len(distances))
+        candidates = np.argpartition(distances, k - 1)[:k]
+        order = candidates[np.argsort(distances[candidates])]
+        return order, distances[order]
+
+
+def face_distance(face_encodings, face_to_compare, dtype=None):
+    """Drop-in replacement for face_recognition.face_distance using the kernel"""
+    if len(face_encodings) == 0:
+        return np.empty(0)
+    return EncodingMatrix(face_encodings, dtype).distances(face_to_compare)
+
+
+def verify_against_reference(count=10000, probes=16, dtype=None, seed=0):
+    """Compare the kernel with face_recognition's float64 distance on synthetic encodings
+
+    Returns the worst absolute error and how many match decisions (distance < 0.4,
+    i.e. similarity > 0.6) differ from the reference.
+    """
+    rng = np.random.default_rng(seed)
+    roster = rng.normal(0.0, 0.09, size=(count, 128))
+    # Half the probes are near-duplicates of roster rows so the threshold region is exercised
+    probe_rows = rng.normal(0.0, 0.09, size=(probes, 128))
+    probe_rows[: probes // 2] = roster[: probes // 2] + rng.normal(0.0, 0.03, size=(probes // 2, 128))
+
+    kernel = EncodingMatrix(roster, dtype).distances_many(probe_rows).astype(np.float64)
+    # Same expression face_recognition.face_distance evaluates
+    reference = np.stack([np.linalg.norm(roster - probe, axis=1) for probe in probe_rows])
+
+    error = np.abs(kernel - reference)
+    decisions_differ = int(np.count_nonzero((kernel < 0.4) != (reference < 0.4)))
+    return {
+        "dtype": str(np.dtype(dtype or MATCH_DTYPE)),
+        "roster_size": count,
+        "probes": probes,
+        "max_abs_error": float(error.max()),
+        "mean_abs_error": float(error.mean()),
+        "decisions_differ": decisions_differ
+    }
+
+
+if __name__ == "__main__":
+    import json
+    for kernel_dtype in ("float32", "float16"):
+        print(json.dumps(verify_against_reference(dtype=kernel_dtype)))
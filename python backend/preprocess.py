@@ -0,0 +1,85 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("FacePreprocess")
+
+# Context kept around the face box when cropping; face_recognition's aligned chip
+# extends about 25% past the landmarks, so half a box on each side keeps it inside the crop
+CROP_MARGIN = 0.5
+
+
+def face_region(image_shape, face_location, margin=CROP_MARGIN):
+    """(y0, y1, x0, x1) bounds of the face box plus margin, clipped to the image"""
+    top, right, bottom, left = face_location
+    height, width = image_shape[:2]
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    return max(0, top - pad_y), min(height, bottom + pad_y), max(0, left - pad_x), min(width, right + pad_x)
+
+
+class FramePreprocessor:
+    """Color conversion into reusable buffers instead of new arrays per frame
+
+    Detection runs on the decoded BGR frame itself (see FaceDetector.detect_bgr);
+    only the face region plus a margin is converted to RGB, into a buffer that is
+    reused for every later frame. Returned arrays are views of those buffers and
+    are overwritten by the next call, so each thread needs its own instance
+    (see get_preprocessor).
+    """
+
+    def __init__(self):
+        self._crop_buffer = np.empty(0, dtype=np.uint8)
+        self._frame_buffer = np.empty(0, dtype=np.uint8)
+        self.allocations = 0
+
+    def _view(self, name, shape):
+        """Contiguous view of the given shape into a named buffer, growing it only when too small"""
+        size = int(np.prod(shape))
+        buffer = getattr(self, name)
+        if buffer.size < size:
+            # Headroom so a face box growing by a few pixels does not reallocate every frame
+            buffer = np.empty(size + size // 2, dtype=np.uint8)
+            setattr(self, name, buffer)
+            self.allocations += 1
+        return buffer[:size].reshape(shape)
+
+    def to_rgb(self, bgr_image):
+        """Whole-frame BGR to RGB conversion for detectors that need RGB input"""
+        if bgr_image.ndim != 3:
+            return bgr_image
+        rgb = self._view("_frame_buffer", bgr_image.shape)
+        cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB, dst=rgb)
+        return rgb
+
+    def face_crop(self, bgr_image, face_location, margin=CROP_MARGIN):
+        """RGB copy of the face region only
+
+        Returns (rgb_crop, local_location) where local_location is the face box
+        in crop coordinates, ready for face_recognition.face_encodings.
+        """
+        y0, y1, x0, x1 = face_region(bgr_image.shape, face_location, margin)
+        region = bgr_image[y0:y1, x0:x1]
+
+        if region.ndim == 3:
+            crop = self._view("_crop_buffer", region.shape)
+            cv2.cvtColor(region, cv2.COLOR_BGR2RGB, dst=crop)
+        else:
+            crop = self._view("_crop_buffer", region.shape)
+            np.copyto(crop, region)
+
+        top, right, bottom, left = face_location
+        return crop, (top - y0, right - x0, bottom - y0, left - x0)
+
+
+_local = threading.local()
+
+
+def get_preprocessor():
+    """The calling thread's FramePreprocessor"""
+    preprocessor = getattr(_local, "preprocessor", None)
+    if preprocessor is None:
+        preprocessor = _local.preprocessor = FramePreprocessor()
+    return preprocessor
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("Profiler")
+
+# Time between stack samples, and the longest profile one call may ask for
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", 5.0))
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", 120))
+PROFILE_MAX_DEPTH = 128
+
+# The sampler only runs when a busy thread hands over the GIL, which CPython forces
+# every switch interval (5 ms by default). Pure-Python work shorter than that would
+# never be caught mid-way, so the interval is lowered while a profile runs.
+PROFILE_SWITCH_INTERVAL = 0.0005
+
+# Which threads a time-based profile samples:
+#   requests - only threads handling a request (idle pools and listeners are left out)
+#   all      - every thread, including background loaders, batchers and log writers
+THREAD_MODES = ("requests", "all")
+
+# Thread ident -> (method, URL rule, path) of the request it is handling, kept by the
+# app's request hooks so samples can be attributed to routes
+_active_requests = {}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running"""
+
+
+def request_started(method, rule, path):
+    _active_requests[threading.get_ident()] = (method, rule, path)
+
+
+def request_finished():
+    entry = _active_requests.pop(threading.get_ident(), None)
+    session = _session
+    if entry is not None and session is not None:
+        session.request_done(entry)
+
+
+class ProfileSession:
+    """Samples Python stacks of selected threads into collapsed-stack counts
+
+    Each sample walks the frames sys._current_frames() returns for a thread and
+    counts the stack as 'root;caller;...;leaf'. The root is the request
+    ('POST /api/face/compare') or the thread name. Time inside C extensions (dlib,
+    OpenCV, the serial driver) is charged to the Python function that called them.
+    """
+
+    def __init__(self, interval_ms=None, threads="requests", route=None, max_requests=None):
+        if threads not in THREAD_MODES:
+            raise ValueError(f"Unknown thread selection '{threads}'. Available: {', '.join(THREAD_MODES)}")
+        self.interval = max(1.0, interval_ms or PROFILE_INTERVAL_MS) / 1000.0
+        self.threads = threads
+        self.route = route
+        self.max_requests = max_requests
+
+        self.stacks = Counter()
+        self.samples = 0
+        self.ticks = 0
+        self.sampling_time = 0.0
+        self.requests_done = 0
+        self._finished = threading.Event()
+        self._labels = {}
+        self._thread_names = {}
+        self._exclude = threading.get_ident()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _root(self, thread_id):
+        request = _active_requests.get(thread_id)
+        if request is not None:
+            return f"{request[0]} {request[1] or request[2]}"
+        name = self._thread_names.get(thread_id)
+        if name is None:
+            self._thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._thread_names.get(thread_id, f"thread-{thread_id}")
+        return name
+
+    def _wanted(self, thread_id):
+        if thread_id == self._exclude:
+            return False
+        if self.route is not None:
+            request = _active_requests.get(thread_id)
+            return request is not None and self.route in (request[1], request[2])
+        return self.threads == "all" or thread_id in _active_requests
+
+    def sample(self):
+        started = time.perf_counter()
+        for thread_id, frame in sys._current_frames().items():
+            if not self._wanted(thread_id):
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(self._root(thread_id))
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        self.ticks += 1
+        self.sampling_time += time.perf_counter() - started
+
+    def request_done(self, request):
+        if self.route is not None and self.route in (request[1], request[2]):
+            self.requests_done += 1
+            if self.max_requests and self.requests_done >= self.max_requests:
+                self._finished.set()
+
+    def run(self, seconds):
+        """Sample on the calling thread until seconds pass or the request count is reached"""
+        started = time.perf_counter()
+        deadline = started + seconds
+        while not self._finished.is_set():
+            self.sample()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            self._finished.wait(min(self.interval, remaining))
+        self.duration = time.perf_counter() - started
+
+    def collapsed(self):
+        """Collapsed-stack text ('frame;frame;frame count' per line) for flamegraph.pl or speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self):
+        return {
+            "duration_s": self.duration,
+            "interval_ms": self.interval * 1000,
+            "threads": self.threads,
+            "route": self.route,
+            "requests_profiled": self.requests_done if self.route is not None else None,
+            "ticks": self.ticks,
+            "samples": self.samples,
+            "distinct_stacks": len(self.stacks),
+            # Share of the profiled time the sampler itself held the GIL
+            "overhead": self.sampling_time / self.duration if self.duration else None
+        }
+
+
+def profile(seconds=None, interval_ms=None, threads="requests", route=None, max_requests=None):
+    """Run one profile on the calling thread and return the finished session
+
+    With route, only requests to that URL rule or path are sampled, until
+    max_requests of them have completed or seconds have passed.
+    """
+    global _session
+
+    seconds = PROFILE_MAX_SECONDS if seconds is None else float(seconds)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS:.0f}")
+    if max_requests is not None and (route is None or int(max_requests) < 1):
+        raise ValueError("requests needs a route and must be at least 1")
+
+    session = ProfileSession(interval_ms, threads, route, max_requests and int(max_requests))
+    with _session_lock:
+        if _session is not None:
+            raise ProfilerBusy("A profile is already running")
+        _session = session
+
+    logger.info(f"Profiling for up to {seconds:.0f}s ({route or threads})")
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, PROFILE_SWITCH_INTERVAL))
+    try:
+        session.run(seconds)
+    finally:
+        sys.setswitchinterval(switch_interval)
+        with _session_lock:
+            _session = None
+    logger.info(f"Profile finished: {session.samples} samples in {session.duration:.1f}s")
+    return session
+
+
+if __name__ == "__main__":
+    import json
+
+    # A busy worker thread posing as a request, profiled for two seconds
+    def fib(n):
+        return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+    def handle():
+        request_started("POST", "/api/demo", "/api/demo")
+        try:
+            end = time.time() + 2.5
+            while time.time() < end:
+                fib(22)
+                time.sleep(0.01)
+        finally:
+            request_finished()
+
+    worker = threading.Thread(target=handle)
+    worker.start()
+    time.sleep(0.1)
+    result = profile(seconds=2)
+    worker.join()
+    print(json.dumps(result.summary()))
+    print("".join(result.collapsed().splitlines(keepends=True)[:5]))
@@ -0,0 +1,204 @@
+import os
+import math
+import logging
+
+import cv2
+import numpy as np
+import face_recognition
+
+from logsetup import sampled
+
+logger = logging.getLogger("FaceQuality")
+
+# Stream sessions can reject a face on every frame, so rejections are sampled
+reject_logger = sampled(logger)
+
+# Quality thresholds for a face crop
+MIN_SHARPNESS = float(os.environ.get("FACE_MIN_SHARPNESS", 80.0))     # variance of the Laplacian
+MIN_FACE_SIZE = int(os.environ.get("FACE_MIN_SIZE", 90))               # shorter box side, in pixels
+MAX_YAW = float(os.environ.get("FACE_MAX_YAW", 0.25))                  # nose offset / eye distance
+MAX_ROLL_DEGREES = float(os.environ.get("FACE_MAX_ROLL", 15.0))        # tilt of the eye line
+MIN_BRIGHTNESS = float(os.environ.get("FACE_MIN_BRIGHTNESS", 40.0))    # mean gray level of the crop
+MAX_BRIGHTNESS = float(os.environ.get("FACE_MAX_BRIGHTNESS", 220.0))
+
+# Quality gate applied after detection and before encoding
+#   off    - no assessment
+#   flag   - assess and report failed checks, but still encode
+#   reject - refuse faces that fail a check instead of spending an encoding on them
+QUALITY_GATE_MODES = ("off", "flag", "reject")
+DEFAULT_QUALITY_GATE = os.environ.get("QUALITY_GATE", "flag")
+
+# Checks the gate may reject on; pose_unknown (landmarks not found) is only ever flagged
+GATED_CHECKS = ("blurry", "face_too_small", "too_dark", "too_bright", "head_turned", "head_tilted")
+
+# What to tell the voter for each failed check
+QUALITY_MESSAGES = {
+    "blurry": "Image is blurry - hold still and check the camera focus",
+    "face_too_small": "Face is too small - move closer to the camera",
+    "too_dark": "Face is too dark - improve the lighting",
+    "too_bright": "Face is overexposed - reduce the lighting or glare",
+    "head_turned": "Head is turned - look straight at the camera",
+    "head_tilted": "Head is tilted - keep your head level",
+    "pose_unknown": "Facial landmarks could not be located"
+}
+
+# Enrollment encoding modes
+#   adaptive   - one jitter, more only when quality checks fail
+#   fixed      - the historical num_jitters=3 for every enrollment
+#   throughput - one jitter and no quality assessment, for bulk enrollment
+ENROLLMENT_MODES = ("adaptive", "fixed", "throughput")
+DEFAULT_ENROLLMENT_MODE = os.environ.get("ENROLLMENT_MODE", "adaptive")
+FIXED_JITTERS = 3
+MAX_JITTERS = 5
+
+
+def _crop(image, face_location):
+    """Return a view of the face box clipped to the image"""
+    top, right, bottom, left = face_location
+    height, width = image.shape[:2]
+    return image[max(0, top):min(height, bottom), max(0, left):min(width, right)]
+
+
+def laplacian_sharpness(rgb_image, face_location):
+    """Variance of the Laplacian over the face crop (low values mean blur)"""
+    crop = _crop(rgb_image, face_location)
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def mean_brightness(rgb_image, face_location):
+    """Mean gray level (0-255) over the face crop"""
+    crop = _crop(rgb_image, face_location)
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    return float(gray.mean())
+
+
+def face_box_size(face_location):
+    """Shorter side of the face box in pixels"""
+    top, right, bottom, left = face_location
+    return int(min(bottom - top, right - left))
+
+
+def estimate_pose(rgb_image, face_location):
+    """Estimate yaw and roll from the 5-point landmarks.
+
+    Yaw is the horizontal offset of the nose tip from the midpoint of the
+    eyes, relative to the eye distance (0 for a frontal face). Roll is the
+    angle of the line between the eyes in degrees.
+    """
+    landmarks = face_recognition.face_landmarks(rgb_image, [face_location], model="small")
+    if not landmarks:
+        return None
+
+    points = landmarks[0]
+    # Order the eyes by image x so the roll angle stays within +/-90 degrees
+    left_eye, right_eye = sorted([np.mean(points["left_eye"], axis=0), np.mean(points["right_eye"], axis=0)],
+                                 key=lambda eye: eye[0])
+    nose = np.mean(points["nose_tip"], axis=0)
+
+    eye_distance = float(np.linalg.norm(right_eye - left_eye))
+    if eye_distance == 0:
+        return None
+
+    eye_mid = (left_eye + right_eye) / 2.0
+    yaw = float((nose[0] - eye_mid[0]) / eye_distance)
+    roll = math.degrees(math.atan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0]))
+    return {"yaw": yaw, "roll": float(roll)}
+
+
+def assess_face_quality(rgb_image, face_location):
+    """Measure a detected face and list the quality checks it fails"""
+    metrics = {
+        "sharpness": laplacian_sharpness(rgb_image, face_location),
+        "face_size": face_box_size(face_location),
+        "brightness": mean_brightness(rgb_image, face_location)
+    }
+
+    pose = estimate_pose(rgb_image, face_location)
+    if pose:
+        metrics.update(pose)
+
+    failed = []
+    if metrics["sharpness"] < MIN_SHARPNESS:
+        failed.append("blurry")
+    if metrics["face_size"] < MIN_FACE_SIZE:
+        failed.append("face_too_small")
+    if metrics["brightness"] < MIN_BRIGHTNESS:
+        failed.append("too_dark")
+    elif metrics["brightness"] > MAX_BRIGHTNESS:
+        failed.append("too_bright")
+    if pose is None:
+        failed.append("pose_unknown")
+    else:
+        if abs(pose["yaw"]) > MAX_YAW:
+            failed.append("head_turned")
+        if abs(pose["roll"]) > MAX_ROLL_DEGREES:
+            failed.append("head_tilted")
+
+    metrics["failed_checks"] = failed
+    return metrics
+
+
+class QualityGateError(ValueError):
+    """A detected face failed the quality gate; carries the metrics and reasons"""
+
+    def __init__(self, quality):
+        self.quality = quality
+        super().__init__("Face quality too low: " + "; ".join(quality["reasons"]))
+
+
+def gate_face_quality(rgb_image, face_location, mode=None):
+    """Cheap pre-encoding check of a detected face.
+
+    Returns the quality metrics with 'passed' and human-readable 'reasons'
+    added, or None when the gate is off. In reject mode a face failing any
+    gated check raises QualityGateError before any encoding work is done.
+    """
+    mode = (mode or DEFAULT_QUALITY_GATE).lower()
+    if mode not in QUALITY_GATE_MODES:
+        raise ValueError(f"Unknown quality gate mode '{mode}'. Available: {', '.join(QUALITY_GATE_MODES)}")
+
+    if mode == "off":
+        return None
+
+    quality = assess_face_quality(rgb_image, face_location)
+    gated = [check for check in quality["failed_checks"] if check in GATED_CHECKS]
+    quality["passed"] = not gated
+    quality["reasons"] = [QUALITY_MESSAGES.get(check, check) for check in quality["failed_checks"]]
+    quality["gate"] = mode
+
+    if gated and mode == "reject":
+        reject_logger.info(f"Quality gate rejected face: {', '.join(gated)}", extra={"failed_checks": gated})
+        raise QualityGateError(quality)
+    return quality
+
+
+def choose_num_jitters(rgb_image, face_location, mode=None, quality=None):
+    """Pick num_jitters for an enrollment encoding.
+
+    Returns (num_jitters, settings) where settings records the mode, the
+    jitter count and the quality metrics that led to it, so it can be stored
+    alongside the template. quality may pass in an assessment already made
+    by the quality gate.
+    """
+    mode = (mode or DEFAULT_ENROLLMENT_MODE).lower()
+    if mode not in ENROLLMENT_MODES:
+        raise ValueError(f"Unknown enrollment mode '{mode}'. Available: {', '.join(ENROLLMENT_MODES)}")
+
+    if mode == "throughput":
+        return 1, {"mode": mode, "num_jitters": 1}
+
+    if mode == "fixed":
+        return FIXED_JITTERS, {"mode": mode, "num_jitters": FIXED_JITTERS}
+
+    # Adaptive: each failed check adds two jitters, so a clean capture costs a single pass
+    if quality is None:
+        quality = assess_face_quality(rgb_image, face_location)
+    num_jitters = min(MAX_JITTERS, 1 + 2 * len(quality["failed_checks"]))
+
+    logger.info(f"Adaptive enrollment: {num_jitters} jitter(s), failed checks: {quality['failed_checks'] or 'none'}")
+    return num_jitters, {"mode": mode, "num_jitters": num_jitters, "quality": quality}
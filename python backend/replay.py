@@ -0,0 +1,281 @@
+import sys
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from traffic import load_recording
+
+logger = logging.getLogger("TrafficReplay")
+
+# Routes not replayed by default: admin tools, and sensor setup the replay does itself
+DEFAULT_EXCLUDE = ("/api/admin/", "/api/fingerprint/init")
+
+# Route parameters issued by the server at runtime; requests naming a recorded one
+# cannot be replayed against another server
+SERVER_ISSUED_PARAMETERS = ("session_id",)
+
+REQUEST_TIMEOUT = 120
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000
+
+    return {"count": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99),
+            "max_ms": ordered[-1] * 1000}
+
+
+class PayloadSynthesizer:
+    """Random stand-ins for the biometric payloads a recording leaves out
+
+    Face encodings are drawn like dlib's (|x| ~ 0.1), blobs as random hex or
+    text of the recorded length, and images at the recorded size: from fixture
+    photos if given (so face detection and encoding do their full work),
+    otherwise a photo-like gradient with noise, which has no face in it.
+    """
+
+    def __init__(self, fixture_images=(), seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.fixtures = [image for image in (cv2.imread(path) for path in fixture_images) if image is not None]
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def image(self, width, height):
+        """JPEG bytes of the given size, cached per size"""
+        with self._lock:
+            key = (width, height)
+            if key not in self._images:
+                if self.fixtures:
+                    img = cv2.resize(self.fixtures[len(self._images) % len(self.fixtures)], (width, height))
+                else:
+                    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+                    img = np.broadcast_to(gradient, (height, width, 3)) + self.rng.normal(0, 12, (height, width, 3))
+                    img = np.clip(img, 0, 255).astype(np.uint8)
+                ok, buffer = cv2.imencode(".jpg", img)
+                if not ok:
+                    raise RuntimeError("Could not encode synthetic image")
+                self._images[key] = buffer.tobytes()
+            return self._images[key]
+
+    def fill(self, value):
+        """A recorded JSON value with its placeholders replaced"""
+        if isinstance(value, list):
+            return [self.fill(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        kind = value.get("$synthetic")
+        if kind is None:
+            return {key: self.fill(item) for key, item in value.items()}
+        with self._lock:
+            if kind == "vector":
+                return self.rng.normal(0.0, 0.09, value["length"]).tolist()
+            if kind == "blob":
+                if value.get("hex"):
+                    return self.rng.bytes((value["length"] + 1) // 2).hex()[:value["length"]]
+                return "A" * value["length"]
+        return None
+
+    def upload(self, shape):
+        """Bytes standing in for a recorded upload"""
+        if shape.get("$synthetic") == "image":
+            return self.image(shape["width"], shape["height"])
+        with self._lock:
+            return self.rng.bytes(shape.get("bytes", 0))
+
+
+def build_request(entry, synthesizer):
+    """requests.request keyword arguments for a recorded entry"""
+    kwargs = {"method": entry["method"], "params": entry.get("query") or None}
+    if entry.get("json") is not None:
+        kwargs["json"] = synthesizer.fill(entry["json"])
+    if "form" in entry or "files" in entry:
+        kwargs["data"] = entry.get("form") or {}
+        kwargs["files"] = [
+            (field, (f"{field}.jpg" if shape.get("$synthetic") == "image" else field,
+                     synthesizer.upload(shape), shape.get("content_type") or "application/octet-stream"))
+            for field, shapes in (entry.get("files") or {}).items() for shape in shapes
+        ]
+    elif "body" in entry:
+        kwargs["data"] = synthesizer.upload(entry["body"])
+        kwargs["headers"] = {"Content-Type": entry["body"].get("content_type") or "application/octet-stream"}
+    return kwargs
+
+
+def _route_of(entry):
+    return f"{entry['method']} {entry.get('rule') or entry['path']}"
+
+
+def replay(entries, base_url, speed=1.0, clients=16, synthesizer=None):
+    """Send recorded requests at their recorded times divided by speed; returns the report
+
+    Requests go out on schedule (open loop) from a pool of clients; when every
+    client is busy, requests start late, and the lag is reported separately from
+    the latency.
+    """
+    import requests
+
+    synthesizer = synthesizer or PayloadSynthesizer()
+    local = threading.local()
+    lock = threading.Lock()
+    results = {}
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def send(entry, due):
+        route = _route_of(entry)
+        kwargs = build_request(entry, synthesizer)
+        started = time.perf_counter()
+        try:
+            response = session().request(url=base_url + entry["path"], timeout=REQUEST_TIMEOUT, **kwargs)
+            status = str(response.status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            result = results.setdefault(route, {"latencies": [], "lags": [], "statuses": {}, "recorded": []})
+            result["latencies"].append(finished - started)
+            result["lags"].append(max(0.0, started - due))
+            result["statuses"][status] = result["statuses"].get(status, 0) + 1
+            result["recorded"].append(entry.get("duration_ms", 0) / 1000.0)
+
+    origin = entries[0]["t"] if entries else 0.0
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients, thread_name_prefix="replay-client") as pool:
+        for entry in entries:
+            due = wall_start + (entry["t"] - origin) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, entry, due)
+    wall = time.perf_counter() - wall_start
+
+    routes = {}
+    for route, result in sorted(results.items()):
+        routes[route] = {
+            "requests": len(result["latencies"]),
+            "requests_per_sec": len(result["latencies"]) / wall if wall > 0 else None,
+            "status_counts": result["statuses"],
+            "latency": _percentiles(result["latencies"]),
+            "recorded_latency": _percentiles(result["recorded"]),
+            "start_lag": _percentiles(result["lags"])
+        }
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "speed": speed,
+        "clients": clients,
+        "wall_seconds": wall,
+        "requests": total,
+        "requests_per_sec": total / wall if wall > 0 else None,
+        "latency": _percentiles([latency for result in results.values() for latency in result["latencies"]]),
+        "routes": routes
+    }
+
+
+def select_entries(entries, include=(), exclude=DEFAULT_EXCLUDE, limit=None):
+    """(entries to replay, count skipped): route prefix filters and requests that cannot be replayed"""
+    selected, skipped = [], 0
+    for entry in entries:
+        path = entry["path"]
+        if (include and not path.startswith(tuple(include))) or path.startswith(tuple(exclude)):
+            continue
+        if any(name in (entry.get("view_args") or {}) for name in SERVER_ISSUED_PARAMETERS):
+            skipped += 1
+            continue
+        selected.append(entry)
+        if limit and len(selected) >= limit:
+            break
+    return selected, skipped
+
+
+def start_sensor(base_url, capture_seconds, impostor_rate, seed):
+    """Start a simulated sensor, point the backend at it and give it the registered voters' fingers"""
+    import requests
+    from sensorsim import SimulatedSensor
+
+    response = requests.get(f"{base_url}/api/roster", timeout=REQUEST_TIMEOUT)
+    voter_ids = [record["voter_id"] for record in response.json().get("data", {}).get("records", [])
+                 if "fingerprint" in record] if response.ok else []
+
+    sensor = SimulatedSensor(voter_ids, capture_seconds=capture_seconds, impostor_rate=impostor_rate, seed=seed)
+    response = requests.post(f"{base_url}/api/fingerprint/init", json={"port": sensor.port}, timeout=REQUEST_TIMEOUT)
+    if not response.ok:
+        sensor.close()
+        raise RuntimeError(f"Backend could not open the simulated sensor: {response.text}")
+    logger.info(f"Simulated sensor on {sensor.port} with {len(voter_ids)} registered finger(s)")
+    return sensor
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded API traffic (TRAFFIC_RECORD_FILE) against a backend")
+    parser.add_argument("recording", help="Recording written by the backend's traffic recorder")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Backend to drive")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed relative to the recording (1-50)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client connections")
+    parser.add_argument("--include", action="append", default=[], help="Only replay paths with this prefix")
+    parser.add_argument("--exclude", action="append", default=list(DEFAULT_EXCLUDE),
+                        help="Skip paths with this prefix")
+    parser.add_argument("--limit", type=int, help="Replay at most this many requests")
+    parser.add_argument("--images", nargs="*", default=[],
+                        help="Face photos to send in place of recorded images (synthetic, faceless ones otherwise)")
+    parser.add_argument("--sensor", action="store_true",
+                        help="Run a simulated fingerprint sensor and point the backend at it")
+    parser.add_argument("--capture-seconds", type=float, default=1.0,
+                        help="Mean time a simulated finger takes to capture")
+    parser.add_argument("--impostor-rate", type=float, default=0.0,
+                        help="Share of simulated verifications with an unregistered finger")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if not 0 < args.speed <= 50:
+        parser.error("--speed must be between 0 and 50")
+
+    header, entries = load_recording(args.recording)
+    entries, skipped = select_entries(entries, args.include, args.exclude, args.limit)
+    if not entries:
+        parser.error("Nothing to replay in the recording")
+    logger.info(f"Replaying {len(entries)} request(s) recorded {header.get('started', '?')} "
+                f"at {args.speed}x with {args.clients} client(s)")
+
+    sensor = start_sensor(args.url.rstrip("/"), args.capture_seconds, args.impostor_rate, args.seed) \
+        if args.sensor else None
+
+    try:
+        report = replay(entries, args.url.rstrip("/"), args.speed, args.clients,
+                        PayloadSynthesizer(args.images, args.seed))
+    finally:
+        if sensor is not None:
+            sensor.close()
+
+    report["recording"] = {"path": args.recording, "started": header.get("started"),
+                           "skipped_unreplayable": skipped}
+    if sensor is not None:
+        report["sensor_commands"] = sensor.counts
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        logger.info(f"Replay report written to {args.output}")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
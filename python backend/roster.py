@@ -0,0 +1,326 @@
+import json
+import logging
+from array import array
+
+import numpy as np
+
+from matching import EncodingMatrix
+
+logger = logging.getLogger("CompactRoster")
+
+# Longest decimal string ID stored in the int64 layout
+_MAX_NUMERIC_ID_DIGITS = 18
+
+
+def _canonical_digits(value):
+    """True for decimal strings that survive str(int(value)) unchanged ('42', not '042' or '+4')"""
+    return (value.isascii() and value.isdigit() and len(value) <= _MAX_NUMERIC_ID_DIGITS
+            and (value == "0" or value[0] != "0"))
+
+
+class StringColumn:
+    """An append-only column of IDs or names without a Python object per entry
+
+    Values are kept in one of three layouts, chosen by what has been appended:
+      int    - all ints, or all canonical decimal strings: one int64 array (8 bytes each)
+      text   - strings: UTF-8 bytes in one buffer plus an int64 end offset per entry
+      object - anything else (mixed types): a plain list
+    None is allowed in the int and text layouts and kept in a set of indices.
+    Values are rebuilt on access, so they come back equal but not identical.
+    """
+
+    def __init__(self, values=()):
+        self._layout = "int"
+        self._digits = None  # for the int layout: values were strings
+        self._numbers = array('q')
+        self._blob = bytearray()
+        self._ends = array('q')
+        self._objects = None
+        self._nulls = set()
+        self._count = 0
+        self._hashes = None
+        self.extend(values)
+
+    def __len__(self):
+        return self._count
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def _to_text(self):
+        """Switch from the int layout to the text layout"""
+        for index, number in enumerate(self._numbers):
+            if index not in self._nulls:
+                self._blob += str(number).encode("utf-8")
+            self._ends.append(len(self._blob))
+        self._numbers = array('q')
+        self._layout = "text"
+
+    def _to_objects(self):
+        self._objects = list(self)
+        self._numbers, self._blob, self._ends = array('q'), bytearray(), array('q')
+        self._nulls = set()
+        self._layout = "object"
+
+    def append(self, value):
+        self._hashes = None
+        if self._layout == "object":
+            self._objects.append(value)
+            self._count += 1
+            return
+
+        if value is None:
+            self._nulls.add(self._count)
+            if self._layout == "int":
+                self._numbers.append(0)
+            else:
+                self._ends.append(len(self._blob))
+            self._count += 1
+            return
+
+        is_string = isinstance(value, str)
+        if not is_string and not (isinstance(value, int) and not isinstance(value, bool)):
+            self._to_objects()
+            return self.append(value)
+
+        if self._layout == "int":
+            numeric = (not is_string and -2 ** 63 <= value < 2 ** 63) or (is_string and _canonical_digits(value))
+            if numeric and self._digits in (None, is_string):
+                self._digits = is_string
+                self._numbers.append(int(value))
+                self._count += 1
+                return
+            if not is_string or self._digits is False:
+                # Ints mixed with strings: keep the values as they are
+                self._to_objects()
+                return self.append(value)
+            self._to_text()
+
+        if not is_string:
+            self._to_objects()
+            return self.append(value)
+        self._blob += value.encode("utf-8")
+        self._ends.append(len(self._blob))
+        self._count += 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("column index out of range")
+        if self._layout == "object":
+            return self._objects[index]
+        if index in self._nulls:
+            return None
+        if self._layout == "int":
+            number = self._numbers[index]
+            return str(number) if self._digits else number
+        start = self._ends[index - 1] if index else 0
+        return self._blob[start:self._ends[index]].decode("utf-8")
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def index_of(self, value):
+        """Index of the last entry equal to value, or None"""
+        if self._layout == "object":
+            for index in range(self._count - 1, -1, -1):
+                if self._objects[index] == value:
+                    return index
+            return None
+        if value is None:
+            return max(self._nulls) if self._nulls else None
+
+        if self._layout == "int":
+            if isinstance(value, str) != bool(self._digits):
+                return None
+            if isinstance(value, str) and not _canonical_digits(value):
+                return None
+            hits = np.flatnonzero(np.frombuffer(self._numbers, dtype=np.int64) == int(value))
+            hits = [index for index in hits[::-1] if index not in self._nulls]
+            return int(hits[0]) if hits else None
+
+        if not isinstance(value, str):
+            return None
+        # Sorted hashes of every entry, built on the first lookup after a change
+        if self._hashes is None:
+            hashes = np.fromiter((hash(item) for item in self), dtype=np.int64, count=self._count)
+            order = np.argsort(hashes, kind="stable")
+            self._hashes = (hashes[order], order)
+        hashes, order = self._hashes
+        key = hash(value)
+        first, last = np.searchsorted(hashes, key, "left"), np.searchsorted(hashes, key, "right")
+        for index in sorted(order[first:last], reverse=True):
+            if self[int(index)] == value:
+                return int(index)
+        return None
+
+    @property
+    def nbytes(self):
+        if self._layout == "object":
+            return sum(len(str(value)) for value in self._objects) + 8 * self._count
+        size = len(self._blob) + self._ends.itemsize * len(self._ends) + self._numbers.itemsize * len(self._numbers)
+        if self._hashes is not None:
+            size += self._hashes[0].nbytes + self._hashes[1].nbytes
+        return size
+
+
+def decode_encoding(value):
+    """A stored encoding (JSON text, list or array) as a float32 row of 128, or None"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return None
+    if value is None:
+        return None
+    row = np.asarray(value, dtype=np.float32).reshape(-1)
+    return row if row.shape == (128,) else None
+
+
+class VoterRecord:
+    """One voter of a CompactRoster; a view, so it holds no data of its own"""
+
+    __slots__ = ("roster", "index")
+
+    def __init__(self, roster, index):
+        self.roster = roster
+        self.index = index
+
+    @property
+    def voter_id(self):
+        return self.roster.voter_ids[self.index]
+
+    @property
+    def voter_name(self):
+        return self.roster.voter_names[self.index]
+
+    @property
+    def registration_time(self):
+        return self.roster.registration_times[self.index]
+
+    @property
+    def centroid(self):
+        return self.roster.centroids.matrix[self.index]
+
+    @property
+    def templates(self):
+        return self.roster.templates_of(self.index)
+
+    @property
+    def radius(self):
+        return self.roster.radius_of(self.index)
+
+    def to_dict(self):
+        return {"voter_id": self.voter_id, "voter_name": self.voter_name,
+                "registration_time": self.registration_time}
+
+    def __repr__(self):
+        return f"VoterRecord(voter_id={self.voter_id!r}, voter_name={self.voter_name!r})"
+
+
+class CompactRoster:
+    """The face roster kept as columns: ~2 KB for a voter with three templates instead of ~19 KB of dicts
+
+    IDs, names and registration times are StringColumns. Centroids and all
+    voters' templates sit in two shared EncodingMatrix arrays, with a template
+    start offset and a float32 radius per voter. Indexing returns a VoterRecord
+    view. The match kernels use centroids, templates, owners and radii directly.
+    """
+
+    def __init__(self, dtype=None):
+        self.voter_ids = StringColumn()
+        self.voter_names = StringColumn()
+        self.registration_times = StringColumn()
+        self.centroids = EncodingMatrix(dtype=dtype)
+        self.templates = EncodingMatrix(dtype=dtype)
+        self._template_ends = array('q')
+        self._radii = array('f')
+
+    def __len__(self):
+        return len(self.voter_ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("roster index out of range")
+        return VoterRecord(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield VoterRecord(self, index)
+
+    def add(self, voter_id, voter_name, centroid, templates=(), radius=None, registration_time=None):
+        """Append one voter; returns its index"""
+        centroid = np.asarray(centroid, dtype=np.float32).reshape(128)
+        templates = np.asarray(templates, dtype=np.float32).reshape(-1, 128)
+        if radius is None:
+            radius = float(np.linalg.norm(templates - centroid, axis=1).max()) if len(templates) else 0.0
+
+        index = self.centroids.add(centroid)
+        if len(templates):
+            self.templates.add(templates)
+        self._template_ends.append(len(self.templates))
+        self._radii.append(radius)
+        self.voter_ids.append(voter_id)
+        self.voter_names.append(voter_name)
+        self.registration_times.append(registration_time)
+        return index
+
+    def add_registration(self, registration):
+        """Append a registration record from the store; returns its index, or None if unreadable"""
+        centroid = decode_encoding(registration.get("face_features"))
+        if centroid is None:
+            return None
+        templates = [decode_encoding(template.get("features")) for template in registration.get("face_templates", [])]
+        return self.add(registration.get("voter_id"), registration.get("voter_name"), centroid,
+                        [template for template in templates if template is not None],
+                        registration.get("template_radius"), registration.get("registration_time"))
+
+    @classmethod
+    def from_registrations(cls, registrations, dtype=None):
+        """Build from registration records, skipping (and logging) unreadable ones"""
+        roster = cls(dtype)
+        for registration in registrations:
+            try:
+                if roster.add_registration(registration) is None:
+                    logger.error(f"Skipping registration without a usable encoding for voter {registration.get('voter_id')}")
+            except Exception as e:
+                logger.error(f"Skipping unreadable registration for voter {registration.get('voter_id')}: {e}")
+        roster.shrink()
+        return roster
+
+    def shrink(self):
+        """Release the spare capacity kept for further adds"""
+        self.centroids.shrink()
+        self.templates.shrink()
+
+    def templates_of(self, index):
+        start = self._template_ends[index - 1] if index else 0
+        return self.templates.matrix[start:self._template_ends[index]]
+
+    def radius_of(self, index):
+        return self._radii[index]
+
+    def index_of(self, voter_id):
+        """Index of the voter's latest registration, or None"""
+        return self.voter_ids.index_of(voter_id)
+
+    @property
+    def radii(self):
+        return np.frombuffer(self._radii, dtype=np.float32).copy()
+
+    @property
+    def owners(self):
+        """Voter index of every template row"""
+        counts = np.diff(np.frombuffer(self._template_ends, dtype=np.int64), prepend=0)
+        return np.repeat(np.arange(len(self), dtype=np.int64), counts)
+
+    @property
+    def nbytes(self):
+        return (self.voter_ids.nbytes + self.voter_names.nbytes + self.registration_times.nbytes
+                + self.centroids.nbytes + self.templates.nbytes
+                + self._template_ends.itemsize * len(self._template_ends) + self._radii.itemsize * len(self._radii))
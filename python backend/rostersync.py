@@ -0,0 +1,232 @@
+import os
+import json
+import gzip
+import hashlib
+import logging
+import secrets
+import threading
+
+from storage import open_store, atomic_write_json
+
+logger = logging.getLogger("RosterSync")
+
+# Version numbers of the merged roster, kept beside the stores so they survive restarts
+ROSTER_VERSION_FILE = os.environ.get("ROSTER_VERSION_FILE", "roster_versions.json")
+
+# Tombstones kept for deleted voters; a kiosk further behind than the oldest dropped one gets a full copy
+TOMBSTONE_LIMIT = int(os.environ.get("ROSTER_TOMBSTONE_LIMIT", 10000))
+
+# Responses at least this large are gzip-compressed for clients that accept it
+COMPRESS_MIN_BYTES = int(os.environ.get("ROSTER_COMPRESS_MIN_BYTES", 1024))
+COMPRESS_LEVEL = 6
+
+# Fingerprint fields kiosks have no use for: sensor internals and the 1 KB host-matching template
+FINGERPRINT_PRIVATE_FIELDS = ("fingerprintEncoding", "fingerprintTemplate")
+
+
+def roster_records(faces, fingerprints):
+    """One record per voter ID: {'voter_id', 'face': registration, 'fingerprint': registration}"""
+    records = {}
+    # Later face registrations of the same voter win, as in the match roster
+    for face in faces:
+        if face.get("voter_id") is None:
+            continue
+        voter_id = str(face["voter_id"])
+        records.setdefault(voter_id, {"voter_id": voter_id})["face"] = face
+    for fingerprint in fingerprints:
+        if fingerprint.get("voterID") is None:
+            continue
+        voter_id = str(fingerprint["voterID"])
+        records.setdefault(voter_id, {"voter_id": voter_id})["fingerprint"] = {
+            key: value for key, value in fingerprint.items() if key not in FINGERPRINT_PRIVATE_FIELDS
+        }
+    return records
+
+
+def _digest(record):
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class RosterVersions:
+    """Monotonic version numbers over the face and fingerprint registration stores
+
+    The stores are rewritten wholesale, so changes are found by diffing: when a
+    store's version token moves, every voter's merged record is hashed and
+    compared with the digest saved at its last change. All changes found in one
+    scan share the next version number, and removed voters leave a tombstone.
+    changes_since(v) then returns only the records and tombstones newer than v.
+
+    The epoch is random per version file; a client holding another epoch's
+    version (the file was lost or replaced) gets a full copy.
+    """
+
+    def __init__(self, face_store=None, fingerprint_store=None, path=ROSTER_VERSION_FILE,
+                 tombstone_limit=TOMBSTONE_LIMIT):
+        if face_store is None or fingerprint_store is None:
+            from face import REGISTRATIONS_FILE
+            from finger import REGISTRATION_FILE
+            face_store = face_store or open_store(REGISTRATIONS_FILE)
+            fingerprint_store = fingerprint_store or open_store(REGISTRATION_FILE)
+        self.face_store = face_store
+        self.fingerprint_store = fingerprint_store
+        self.path = path
+        self.tombstone_limit = tombstone_limit
+
+        self._lock = threading.Lock()
+        self._source_key = None
+        self._records = {}
+
+        state = self._load()
+        self.epoch = state.get("epoch") or secrets.token_hex(4)
+        self.version = state.get("version", 0)
+        self._entries = {voter_id: tuple(entry) for voter_id, entry in state.get("records", {}).items()}
+        self._tombstones = dict(state.get("tombstones", {}))
+        # Deltas from versions below this would miss pruned tombstones
+        self.oldest_delta = state.get("oldest_delta", 0)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Starting a new roster epoch; {self.path} is unreadable: {e}")
+            return {}
+
+    def _save(self):
+        atomic_write_json(self.path, {
+            "epoch": self.epoch,
+            "version": self.version,
+            "oldest_delta": self.oldest_delta,
+            "records": self._entries,
+            "tombstones": self._tombstones
+        }, indent=None)
+
+    def refresh(self):
+        """Rescan the stores if either changed; returns the current version"""
+        with self._lock:
+            source_key = (self.face_store.version(), self.fingerprint_store.version())
+            if source_key == self._source_key:
+                return self.version
+
+            records = roster_records(self.face_store.load(), self.fingerprint_store.load())
+            digests = {voter_id: _digest(record) for voter_id, record in records.items()}
+            changed = [voter_id for voter_id, digest in digests.items()
+                       if voter_id not in self._entries or self._entries[voter_id][1] != digest]
+            removed = [voter_id for voter_id in self._entries if voter_id not in records]
+
+            if changed or removed:
+                self.version += 1
+                for voter_id in changed:
+                    self._entries[voter_id] = (self.version, digests[voter_id])
+                    self._tombstones.pop(voter_id, None)
+                for voter_id in removed:
+                    del self._entries[voter_id]
+                    self._tombstones[voter_id] = self.version
+                self._prune_tombstones()
+                self._save()
+                logger.info(f"Roster version {self.version}: {len(changed)} changed, {len(removed)} removed")
+
+            self._records = records
+            self._source_key = source_key
+            return self.version
+
+    def _prune_tombstones(self):
+        excess = len(self._tombstones) - self.tombstone_limit
+        if excess <= 0:
+            return
+        oldest = sorted(self._tombstones.items(), key=lambda item: item[1])[:excess]
+        for voter_id, version in oldest:
+            del self._tombstones[voter_id]
+        self.oldest_delta = max(self.oldest_delta, oldest[-1][1])
+
+    def etag(self):
+        """Entity tag (unquoted) of the current version"""
+        return f"{self.epoch}-{self.version}"
+
+    def changes_since(self, since=None, epoch=None):
+        """What a client at (epoch, since) needs to reach the current version
+
+        {'epoch', 'version', 'full', 'records', 'deleted'}; with full set, records is
+        the whole roster and the client should replace its copy.
+        """
+        self.refresh()
+        with self._lock:
+            full = (since is None or epoch != self.epoch
+                    or since < self.oldest_delta or since > self.version)
+            if full:
+                records, deleted = list(self._records.values()), []
+            else:
+                records = [self._records[voter_id] for voter_id, (version, _) in self._entries.items()
+                           if version > since]
+                deleted = [voter_id for voter_id, version in self._tombstones.items() if version > since]
+            return {
+                "epoch": self.epoch,
+                "version": self.version,
+                "full": full,
+                "records": records,
+                "deleted": deleted
+            }
+
+
+def encode_body(payload, accept_gzip):
+    """(body bytes, content encoding or None) for a JSON payload, gzipped when worthwhile"""
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    if accept_gzip and len(body) >= COMPRESS_MIN_BYTES:
+        return gzip.compress(body, COMPRESS_LEVEL), "gzip"
+    return body, None
+
+
+_roster_versions = None
+_roster_versions_lock = threading.Lock()
+
+
+def get_roster_versions():
+    """The shared RosterVersions for the configured registration stores"""
+    global _roster_versions
+    with _roster_versions_lock:
+        if _roster_versions is None:
+            _roster_versions = RosterVersions()
+        return _roster_versions
+
+
+if __name__ == "__main__":
+    import time
+    import tempfile
+    import numpy as np
+
+    # Bytes a kiosk downloads per refresh: full roster versus a delta after one new registration
+    rng = np.random.default_rng(0)
+    for size in (1000, 10000):
+        with tempfile.TemporaryDirectory() as directory:
+            faces = open_store(os.path.join(directory, "faces.json"))
+            fingerprints = open_store(os.path.join(directory, "fingerprints.json"))
+            faces.save([{"voter_id": str(i), "voter_name": f"Voter {i}",
+                         "face_features": json.dumps(rng.normal(0, 0.1, 128).tolist())} for i in range(size)])
+            fingerprints.save([{"voterID": str(i), "voterName": f"Voter {i}", "timestamp": "2025-01-01T08:00:00"}
+                               for i in range(size)])
+            versions = RosterVersions(faces, fingerprints, os.path.join(directory, "versions.json"))
+
+            started = time.perf_counter()
+            snapshot = versions.changes_since()
+            scan_ms = (time.perf_counter() - started) * 1000
+
+            time.sleep(0.01)
+            faces.append({"voter_id": str(size), "voter_name": "Late voter",
+                          "face_features": json.dumps(rng.normal(0, 0.1, 128).tolist())})
+            started = time.perf_counter()
+            delta = versions.changes_since(snapshot["version"], snapshot["epoch"])
+            rescan_ms = (time.perf_counter() - started) * 1000
+
+            print(json.dumps({
+                "roster_size": size,
+                "full_bytes": len(encode_body(snapshot, False)[0]),
+                "full_gzip_bytes": len(encode_body(snapshot, True)[0]),
+                "delta_bytes": len(encode_body(delta, False)[0]),
+                "delta_gzip_bytes": len(encode_body(delta, True)[0]),
+                "delta_records": len(delta["records"]),
+                "first_scan_ms": scan_ms,
+                "rescan_ms": rescan_ms
+            }))
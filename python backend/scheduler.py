@@ -0,0 +1,240 @@
+import os
+import time
+import logging
+import functools
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger("RequestScheduler")
+
+# Priority classes, highest first:
+#   interactive - verification at the booth (face compare/identify, fingerprint verify, votes)
+#   enrollment  - registering voters' faces and fingerprints
+#   admin       - short maintenance commands (sensor wipes, deletes, restarts, preloads)
+#   bulk        - long-running work that holds its slot for seconds to minutes (history
+#                 downloads, roster exports and imports, duplicate scans, detector calibration),
+#                 kept apart so it never blocks the admin commands
+#   stream      - long-lived live-verification connections (chunked frame uploads, WebSockets);
+#                 they hold a slot for minutes while the work runs on session threads, so
+#                 they have their own pool outside SCHEDULER_MAX_CONCURRENT
+PRIORITY_CLASSES = ("interactive", "enrollment", "admin", "bulk", "stream")
+SEPARATE_CLASSES = ("stream",)
+
+SCHEDULER_ENABLED = os.environ.get("REQUEST_SCHEDULER", "1").lower() in ("1", "true", "yes")
+
+# Requests running at once across the shared classes; a freed slot goes to the highest-priority waiter
+MAX_CONCURRENT = int(os.environ.get("SCHEDULER_MAX_CONCURRENT", 8))
+
+# Per class: (requests running at once, seconds a request may wait for a slot before a 503)
+CLASS_LIMITS = {
+    "interactive": (int(os.environ.get("SCHEDULER_INTERACTIVE_CONCURRENCY", MAX_CONCURRENT)),
+                    float(os.environ.get("SCHEDULER_INTERACTIVE_DEADLINE", 2.0))),
+    "enrollment": (int(os.environ.get("SCHEDULER_ENROLLMENT_CONCURRENCY", 2)),
+                   float(os.environ.get("SCHEDULER_ENROLLMENT_DEADLINE", 30.0))),
+    "admin": (int(os.environ.get("SCHEDULER_ADMIN_CONCURRENCY", 1)),
+              float(os.environ.get("SCHEDULER_ADMIN_DEADLINE", 60.0))),
+    "bulk": (int(os.environ.get("SCHEDULER_BULK_CONCURRENCY", 2)),
+             float(os.environ.get("SCHEDULER_BULK_DEADLINE", 60.0))),
+    "stream": (int(os.environ.get("SCHEDULER_STREAM_CONCURRENCY", 8)),
+               float(os.environ.get("SCHEDULER_STREAM_DEADLINE", 2.0)))
+}
+
+# Latencies kept per class for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class SchedulerBusy(Exception):
+    """A request waited past its class deadline without getting a slot"""
+
+    def __init__(self, priority_class, waited):
+        super().__init__(f"Server busy: no {priority_class} slot within {waited:.1f}s")
+        self.priority_class = priority_class
+        self.waited = waited
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))] * 1000
+
+    return {"p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99)}
+
+
+class RequestScheduler:
+    """Admit requests by priority class under a shared concurrency limit
+
+    Each class has its own cap on running requests and a queue deadline. When a
+    slot frees up, waiters are considered highest class first, then oldest first;
+    the first one whose class is under its cap starts. Bulk classes therefore
+    never hold more than their cap, and an interactive request only waits for
+    other interactive requests or for a slot to free up.
+    """
+
+    def __init__(self, max_concurrent=None, limits=None):
+        self.max_concurrent = max(1, max_concurrent or MAX_CONCURRENT)
+        self.limits = dict(limits or CLASS_LIMITS)
+        self._priority = {name: rank for rank, name in enumerate(PRIORITY_CLASSES)}
+
+        self._lock = threading.Condition()
+        self._sequence = itertools.count()
+        self._waiting = []  # (priority, sequence, class), kept sorted
+        self._running = {name: 0 for name in PRIORITY_CLASSES}
+
+        self._completed = {name: 0 for name in PRIORITY_CLASSES}
+        self._rejected = {name: 0 for name in PRIORITY_CLASSES}
+        self._waits = {name: deque(maxlen=LATENCY_SAMPLES) for name in PRIORITY_CLASSES}
+        self._latencies = {name: deque(maxlen=LATENCY_SAMPLES) for name in PRIORITY_CLASSES}
+
+    def _next_to_start(self):
+        """The waiting entry that gets the next free slot, or None"""
+        shared_full = sum(running for name, running in self._running.items()
+                          if name not in SEPARATE_CLASSES) >= self.max_concurrent
+        for entry in self._waiting:
+            name = entry[2]
+            if self._running[name] < self.limits[name][0] and (name in SEPARATE_CLASSES or not shared_full):
+                return entry
+        return None
+
+    def acquire(self, priority_class):
+        """Wait for a slot; returns the seconds waited. Raises SchedulerBusy past the class deadline"""
+        if priority_class not in self._running:
+            raise ValueError(f"Unknown priority class '{priority_class}'. Available: {', '.join(PRIORITY_CLASSES)}")
+
+        arrived = time.monotonic()
+        deadline = arrived + self.limits[priority_class][1]
+        entry = (self._priority[priority_class], next(self._sequence), priority_class)
+
+        with self._lock:
+            self._waiting.append(entry)
+            self._waiting.sort()
+            while self._next_to_start() is not entry:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    self._rejected[priority_class] += 1
+                    # Our leaving may let a lower-priority waiter start
+                    self._lock.notify_all()
+                    raise SchedulerBusy(priority_class, time.monotonic() - arrived)
+                self._lock.wait(remaining)
+
+            self._waiting.remove(entry)
+            self._running[priority_class] += 1
+            waited = time.monotonic() - arrived
+            self._waits[priority_class].append(waited)
+            # Another waiter may be able to start in a remaining slot
+            self._lock.notify_all()
+        return waited
+
+    def release(self, priority_class, latency):
+        """Free the slot; latency is the request's total time including the queue wait"""
+        with self._lock:
+            self._running[priority_class] -= 1
+            self._completed[priority_class] += 1
+            self._latencies[priority_class].append(latency)
+            self._lock.notify_all()
+
+    @contextmanager
+    def slot(self, priority_class):
+        arrived = time.monotonic()
+        self.acquire(priority_class)
+        try:
+            yield
+        finally:
+            self.release(priority_class, time.monotonic() - arrived)
+
+    def stats(self):
+        with self._lock:
+            classes = {}
+            for name in PRIORITY_CLASSES:
+                concurrency, deadline = self.limits[name]
+                classes[name] = {
+                    "concurrency": concurrency,
+                    "deadline_s": deadline,
+                    "running": self._running[name],
+                    "waiting": sum(1 for entry in self._waiting if entry[2] == name),
+                    "completed": self._completed[name],
+                    "rejected": self._rejected[name],
+                    "queue_wait": _percentiles(self._waits[name]),
+                    "latency": _percentiles(self._latencies[name])
+                }
+            return {"enabled": SCHEDULER_ENABLED, "max_concurrent": self.max_concurrent, "classes": classes}
+
+
+request_scheduler = RequestScheduler()
+
+
+def scheduled(priority_class):
+    """Run the decorated request handler in a slot of the given priority class
+
+    priority_class may also be a function called per request to pick the class,
+    for endpoints that serve both the booth and enrollment. A streamed response
+    body runs after the handler returns, so its slot is held until the body
+    has been sent (or the client went away).
+    """
+    if not callable(priority_class) and priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class '{priority_class}'. Available: {', '.join(PRIORITY_CLASSES)}")
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not SCHEDULER_ENABLED:
+                return func(*args, **kwargs)
+            chosen = priority_class() if callable(priority_class) else priority_class
+            arrived = time.monotonic()
+            request_scheduler.acquire(chosen)
+            released = threading.Event()
+
+            def release():
+                if not released.is_set():
+                    released.set()
+                    request_scheduler.release(chosen, time.monotonic() - arrived)
+
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                release()
+                raise
+            response = result[0] if isinstance(result, tuple) else result
+            if getattr(response, "is_streamed", False) and hasattr(response, "call_on_close"):
+                response.call_on_close(release)
+            else:
+                release()
+            return result
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Interactive requests (20 ms) arriving while bulk work (500 ms) floods the same
+    # 4 slots: with every request in one FIFO class, and with priority classes
+    def simulate(classes):
+        scheduler = RequestScheduler(max_concurrent=4, limits={
+            "interactive": (4, 30.0), "enrollment": (2, 30.0), "admin": (1, 30.0)
+        } if classes else {name: (4, 30.0) for name in PRIORITY_CLASSES})
+
+        def call(priority_class, duration):
+            with scheduler.slot(priority_class if classes else "admin"):
+                time.sleep(duration)
+
+        with ThreadPoolExecutor(max_workers=64) as pool:
+            for _ in range(12):
+                pool.submit(call, "enrollment", 0.5)
+                pool.submit(call, "admin", 0.5)
+            time.sleep(0.05)
+            interactive = []
+            for _ in range(40):
+                started = time.monotonic()
+                interactive.append(pool.submit(lambda s=started: (call("interactive", 0.02), time.monotonic() - s)[1]))
+                time.sleep(0.01)
+            latencies = [future.result() for future in interactive]
+        return _percentiles(latencies)
+
+    print(json.dumps({"fifo_interactive": simulate(False), "prioritized_interactive": simulate(True)}))
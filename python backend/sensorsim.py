@@ -0,0 +1,269 @@
+import os
+import tty
+import json
+import time
+import fcntl
+import random
+import struct
+import select
+import hashlib
+import logging
+import termios
+import threading
+
+import numpy as np
+
+from fingermatch import SENSOR_SLOTS, TEMPLATE_BYTES, bit_agreement, decode_template
+
+logger = logging.getLogger("SimulatedSensor")
+
+# Mean seconds a voter takes to put a finger on the sensor and for the image to be taken
+SIM_CAPTURE_SECONDS = float(os.environ.get("SIM_SENSOR_CAPTURE_SECONDS", 1.0))
+
+# Share of template bits that differ between two captures of the same finger
+SIM_NOISE_BITS = float(os.environ.get("SIM_SENSOR_NOISE_BITS", 0.08))
+
+# Score the simulated on-board search needs for a match
+SIM_MATCH_THRESHOLD = float(os.environ.get("SIM_SENSOR_MATCH_THRESHOLD", 0.75))
+
+# Serial line speed the replies are paced at, as on the Arduino (0 sends them at once)
+SIM_BAUD = int(os.environ.get("SIM_SENSOR_BAUD", 9600))
+
+
+def finger_template(voter_id):
+    """The simulated finger of a voter: a fixed random template derived from the ID"""
+    seed = int.from_bytes(hashlib.blake2b(str(voter_id).encode("utf-8"), digest_size=8).digest(), "big")
+    return np.random.default_rng(seed).integers(0, 256, TEMPLATE_BYTES, dtype=np.uint8)
+
+
+class SimulatedSensor:
+    """The Arduino firmware and fingerprint module, simulated on a pseudo-terminal
+
+    Pass port to FingerprintController (or POST it to /api/fingerprint/init) in
+    place of the Arduino's serial port. The line protocol follows c.ino:
+    REGISTER/ENROLL/VERIFY/DOWNLOAD/DELETE/DELETEALL/STORE/UPLOAD, with the same
+    info, success, not_found and error replies and 512-byte hex templates.
+
+    Every voter has a simulated finger (finger_template); each capture flips
+    noise_bits of its bits, so host matching and the slot search score captures
+    as on a real sensor. A capture presents the finger queued with present(),
+    otherwise a random known voter's (impostor_rate of captures are unknown
+    fingers). Capture time and serial transfer at baud are simulated, so
+    verifications take about as long as at the booth. The fingers are random
+    bits scored by bit_agreement, so the simulation exercises the protocol and
+    timing, not the scorer: calibrate that on real captures (fingermatch.py).
+
+    Opening the port resets the simulated Arduino, which then sends its ready
+    line, like the DTR reset of a real board. POSIX only (needs a pty).
+    """
+
+    def __init__(self, voter_ids=(), slots=SENSOR_SLOTS, capture_seconds=SIM_CAPTURE_SECONDS,
+                 noise_bits=SIM_NOISE_BITS, impostor_rate=0.0, baud=SIM_BAUD, seed=0):
+        self.slots = slots
+        self.capture_seconds = capture_seconds
+        self.noise_bits = noise_bits
+        self.impostor_rate = impostor_rate
+        self.baud = baud
+
+        self._random = random.Random(seed)
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._known = [str(voter_id) for voter_id in voter_ids]
+        self._presented = []
+        self._slots = {}  # slot -> stored template
+        self.counts = {}
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        # Packet mode reports the flush pyserial does when it opens the port
+        fcntl.ioctl(self._master, termios.TIOCPKT, struct.pack("i", 1))
+        self.port = os.ttyname(self._slave)
+
+        self._commands = {
+            "REGISTER": lambda argument: self._register(argument, store=True),
+            "ENROLL": lambda argument: self._register(argument, store=False),
+            "VERIFY": lambda argument: self._verify(),
+            "DOWNLOAD": lambda argument: self._download(),
+            "DELETE": self._delete,
+            "DELETEALL": lambda argument: self._delete_all(),
+            "STORE": self._store,
+            "UPLOAD": self._upload
+        }
+        self._buffer = b""
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="simulated-sensor", daemon=True)
+        self._thread.start()
+        logger.info(f"Simulated fingerprint sensor on {self.port}")
+
+    def add_voters(self, voter_ids):
+        """Voters whose fingers may be captured when none is presented"""
+        with self._lock:
+            known = set(self._known)
+            self._known.extend(str(voter_id) for voter_id in voter_ids if str(voter_id) not in known)
+
+    def present(self, voter_id):
+        """Capture this voter's finger next (None presents an unknown finger)"""
+        with self._lock:
+            self._presented.append(voter_id)
+
+    def _next_finger(self):
+        with self._lock:
+            if self._presented:
+                return self._presented.pop(0)
+            if not self._known or self._random.random() < self.impostor_rate:
+                return None
+            return self._random.choice(self._known)
+
+    def _capture(self, voter_id):
+        """A noisy capture of the voter's finger (a random finger for None)"""
+        time.sleep(self._random.uniform(0.5, 1.5) * self.capture_seconds)
+        if voter_id is None:
+            return self._rng.integers(0, 256, TEMPLATE_BYTES, dtype=np.uint8)
+        flips = np.packbits(self._rng.random(TEMPLATE_BYTES * 8) < self.noise_bits)
+        return np.bitwise_xor(finger_template(voter_id), flips)
+
+    def _send(self, reply):
+        line = (json.dumps(reply, separators=(",", ":")) + "\r\n").encode("utf-8")
+        if self.baud:
+            # 10 bits per byte on the wire
+            time.sleep(len(line) * 10.0 / self.baud)
+        os.write(self._master, line)
+
+    def _captured_reply(self, status, message, template, **fields):
+        reply = {"status": status, "message": message, **fields}
+        reply["raw_encoding"] = f"FPR1{self._random.getrandbits(64):016X}"
+        reply["template"] = template.tobytes().hex().upper()
+        return reply
+
+    def _register(self, argument, store):
+        voter_id = argument.strip()
+        self._send({"status": "info", "message": "Place finger on sensor"})
+        first = self._capture(voter_id)
+        self._send({"status": "info", "message": "Image taken successfully"})
+        self._send({"status": "info", "message": "Remove finger"})
+        self._send({"status": "info", "message": "Place same finger again"})
+        self._capture(voter_id)
+        if store:
+            if not voter_id.isdigit() or not 1 <= int(voter_id) <= self.slots:
+                self._send({"status": "error", "message": "Failed to store: 11"})
+                return
+            self._slots[int(voter_id)] = first
+        self.add_voters([voter_id])
+        self._send(self._captured_reply("success", "Registered fingerprint", first,
+                                        id=int(voter_id) if voter_id.isdigit() else 0))
+
+    def _verify(self):
+        self._send({"status": "info", "message": "Place finger to verify"})
+        probe = self._capture(self._next_finger())
+        if self._slots:
+            slots = list(self._slots)
+            scores = bit_agreement(probe, np.stack([self._slots[slot] for slot in slots]))
+            best = int(np.argmax(scores))
+            if scores[best] >= SIM_MATCH_THRESHOLD:
+                self._send({"status": "success", "message": "Match found", "id": slots[best],
+                            "confidence": int(scores[best] * 100), "raw_encoding": f"FPR1{self._random.getrandbits(64):016X}"})
+                return
+        self._send(self._captured_reply("not_found", "No match found", probe))
+
+    def _download(self):
+        self._send({"status": "info", "message": "Place finger on sensor"})
+        probe = self._capture(self._next_finger())
+        self._send(self._captured_reply("success", "Template captured", probe))
+
+    def _delete(self, argument):
+        slot = int(argument) if argument.strip().isdigit() else 0
+        self._slots.pop(slot, None)
+        self._send({"status": "success", "message": "Deleted fingerprint", "id": slot})
+
+    def _delete_all(self):
+        self._send({"status": "info", "message": "Deleting all fingerprints..."})
+        self._slots.clear()
+        self._send({"status": "success", "message": "All fingerprints deleted"})
+
+    def _store(self, argument):
+        slot = int(argument) if argument.strip().isdigit() else 0
+        self._send({"status": "info", "message": "Send template"})
+        line = self._read_line(timeout=5.0)
+        if self.baud and line:
+            time.sleep(len(line) * 10.0 / self.baud)
+        template = decode_template(line.strip().decode("ascii", "replace") if line else None)
+        if template is None:
+            self._send({"status": "error", "message": "No template received"})
+        elif not 1 <= slot <= self.slots:
+            self._send({"status": "error", "message": "Failed to store: 11"})
+        else:
+            self._slots[slot] = template
+            self._send({"status": "success", "message": "Template stored", "slot": slot})
+
+    def _upload(self, argument):
+        slot = int(argument) if argument.strip().isdigit() else 0
+        if slot not in self._slots:
+            self._send({"status": "error", "message": "Upload error: 12"})
+        else:
+            self._send({"status": "success", "message": "Template uploaded", "slot": slot,
+                        "template": self._slots[slot].tobytes().hex().upper()})
+
+    def _read_line(self, timeout=None):
+        """The next line from the host, or None on timeout or close"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            if self._stop.is_set():
+                return None
+            wait = 0.2 if deadline is None else min(0.2, deadline - time.monotonic())
+            if wait <= 0:
+                return None
+            readable, _, _ = select.select([self._master], [], [], wait)
+            if not readable:
+                continue
+            try:
+                packet = os.read(self._master, 4096)
+            except OSError:
+                # Nothing has the port open
+                time.sleep(0.05)
+                continue
+            if not packet:
+                continue
+            if packet[0] == 0:
+                self._buffer += packet[1:]
+            elif packet[0] & termios.TIOCPKT_FLUSHREAD:
+                # The host opened the port: reset, as the Arduino does on DTR
+                self._buffer = b""
+                self._send({"status": "ready", "message": "Fingerprint sensor connected"})
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    def _run(self):
+        while not self._stop.is_set():
+            line = self._read_line()
+            if not line:
+                continue
+            command, _, argument = line.decode("utf-8", "replace").strip().partition(":")
+            handler = self._commands.get(command)
+            if handler is None:
+                continue
+            self.counts[command] = self.counts.get(command, 0) + 1
+            try:
+                handler(argument)
+            except OSError as e:
+                logger.error(f"Simulated sensor could not reply to {command}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        os.close(self._master)
+        os.close(self._slave)
+
+
+if __name__ == "__main__":
+    from finger import FingerprintController
+
+    # One registration and two verifications through the real controller
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sensor = SimulatedSensor(capture_seconds=0.2)
+    controller = FingerprintController(sensor.port)
+    print(controller.register_fingerprint("7", "Simulated voter"))
+    sensor.present("7")
+    print(controller.verify_fingerprint())
+    sensor.present(None)
+    print(controller.verify_fingerprint())
+    sensor.close()
@@ -0,0 +1,158 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from storage import atomic_write_json
+from fingermatch import SENSOR_SLOTS
+
+logger = logging.getLogger("SensorSlotCache")
+
+# Which voter's template sits in which sensor slot, kept across restarts
+SLOT_CACHE_FILE = os.environ.get("FINGERPRINT_SLOT_CACHE", "sensor_slots.json")
+
+
+class SensorSlotCache:
+    """Host-side map of the sensor's template slots, least recently verified first
+
+    The host holds every template; the sensor's slots are a cache in front of
+    it so the sensor's own fast search covers the voters most likely to check
+    in next. assign() hands out a free slot or evicts the least recently
+    verified voter; the map is saved after every change so it matches the
+    sensor after a restart.
+    """
+
+    def __init__(self, slots=SENSOR_SLOTS, path=SLOT_CACHE_FILE):
+        self.slots = slots
+        self.path = path
+        self._lock = threading.Lock()
+        self._resident = OrderedDict()  # voter_id -> slot, least recently used first
+        self._by_slot = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+        # False means the sensor's contents are unknown and should be wiped before use
+        self.restored = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Ignoring unreadable slot cache {self.path}: {e}")
+            return False
+
+        if state.get("slots") != self.slots:
+            logger.warning(f"Slot cache was written for {state.get('slots')} slots, sensor has {self.slots}")
+            return False
+        for voter_id, slot in state.get("resident", []):
+            self._resident[str(voter_id)] = slot
+            self._by_slot[slot] = str(voter_id)
+        return True
+
+    def _save(self):
+        atomic_write_json(self.path, {"slots": self.slots, "resident": list(self._resident.items())})
+
+    def __len__(self):
+        return len(self._resident)
+
+    def __contains__(self, voter_id):
+        return str(voter_id) in self._resident
+
+    def voter_in_slot(self, slot):
+        return self._by_slot.get(slot)
+
+    def slot_of(self, voter_id):
+        return self._resident.get(str(voter_id))
+
+    def touch(self, voter_id):
+        """Mark a resident voter as just used (moves it to the back of the eviction order)"""
+        with self._lock:
+            if str(voter_id) in self._resident:
+                self._resident.move_to_end(str(voter_id))
+
+    def hit(self, voter_id):
+        self.hits += 1
+        self.touch(voter_id)
+
+    def miss(self):
+        self.misses += 1
+
+    def assign(self, voter_id, protected=()):
+        """Slot to store voter_id's template in: (slot, evicted voter ID or None)
+
+        The evicted voter is dropped from the map straight away, since its slot is
+        about to be overwritten; call commit() once the sensor has stored the
+        template, or restore() if the sensor refused it and the slot still holds
+        the evicted voter. Returns (None, None) when every resident voter is protected.
+        """
+        voter_id = str(voter_id)
+        with self._lock:
+            if voter_id in self._resident:
+                return self._resident[voter_id], None
+
+            if len(self._resident) < self.slots:
+                slot = min(set(range(1, self.slots + 1)) - set(self._by_slot))
+                return slot, None
+
+            for candidate in self._resident:
+                if candidate not in protected:
+                    slot = self._resident.pop(candidate)
+                    del self._by_slot[slot]
+                    self.evictions += 1
+                    self._save()
+                    return slot, candidate
+            return None, None
+
+    def commit(self, voter_id, slot):
+        with self._lock:
+            self._resident[str(voter_id)] = slot
+            self._resident.move_to_end(str(voter_id))
+            self._by_slot[slot] = str(voter_id)
+            self.loads += 1
+            self._save()
+
+    def restore(self, voter_id, slot):
+        """Undo assign()'s eviction of voter_id from slot; it goes back to the front of the eviction order"""
+        with self._lock:
+            if slot in self._by_slot or str(voter_id) in self._resident:
+                return
+            self._resident[str(voter_id)] = slot
+            self._resident.move_to_end(str(voter_id), last=False)
+            self._by_slot[slot] = str(voter_id)
+            self.evictions -= 1
+            self._save()
+
+    def discard(self, voter_id):
+        """Forget a voter's slot (after deleting it from the sensor); returns the slot it had"""
+        with self._lock:
+            slot = self._resident.pop(str(voter_id), None)
+            if slot is not None:
+                del self._by_slot[slot]
+                self._save()
+            return slot
+
+    def clear(self):
+        with self._lock:
+            self._resident.clear()
+            self._by_slot.clear()
+            self._save()
+            self.restored = True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "slots": self.slots,
+            "resident": len(self._resident),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "loads": self.loads,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,282 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+from storage import record_timestamp
+
+logger = logging.getLogger("VerificationStats")
+
+# Station name attached to verification events recorded by this backend
+STATION_ID = os.environ.get("STATION_ID", "local")
+
+# Minutes of per-minute history kept for the rate series
+WINDOW_MINUTES = 60
+
+# Subscribers that fall this far behind are dropped rather than buffering forever
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Seconds between checks of the verification logs for records written by other processes
+LOG_TAIL_INTERVAL = float(os.environ.get("STATS_LOG_TAIL_INTERVAL", 2.0))
+
+
+class VerificationStats:
+    """Turnout and verification counters updated on every logged verification
+
+    Everything is O(1) per event, so reading the aggregates never touches the
+    verification logs.
+    """
+
+    def __init__(self, window_minutes=WINDOW_MINUTES):
+        self.window_minutes = window_minutes
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._sources = {}
+            self._stations = {}
+            self._minutes = OrderedDict()
+            self._voters = set()
+            self._last_event_time = None
+
+    def record(self, source, matched, confidence=None, station=None, voter_id=None, timestamp=None):
+        """Add one verification event and notify stream subscribers"""
+        timestamp = timestamp or time.time()
+        station = station or STATION_ID
+
+        with self._lock:
+            totals = self._sources.setdefault(source, {"count": 0, "matches": 0, "confidence_sum": 0.0,
+                                                       "confidence_count": 0})
+            totals["count"] += 1
+            if matched:
+                totals["matches"] += 1
+            if matched and confidence is not None:
+                totals["confidence_sum"] += float(confidence)
+                totals["confidence_count"] += 1
+
+            station_totals = self._stations.setdefault(station, {"count": 0, "matches": 0})
+            station_totals["count"] += 1
+            if matched:
+                station_totals["matches"] += 1
+
+            if matched and voter_id is not None:
+                self._voters.add((source, str(voter_id)))
+
+            minute = int(timestamp // 60) * 60
+            bucket = self._minutes.get(minute)
+            if bucket is None:
+                bucket = self._minutes[minute] = {"count": 0, "matches": 0}
+                # Buckets arrive in time order; late events may land in an older bucket
+                self._minutes = OrderedDict(sorted(self._minutes.items()))
+            bucket["count"] += 1
+            if matched:
+                bucket["matches"] += 1
+            self._prune_minutes(time.time())
+
+            if self._last_event_time is None or timestamp > self._last_event_time:
+                self._last_event_time = timestamp
+
+        self._publish({
+            "type": "verification",
+            "source": source,
+            "matched": bool(matched),
+            "confidence": confidence,
+            "station": station,
+            "timestamp": timestamp
+        })
+
+    def _prune_minutes(self, now):
+        cutoff = (int(now // 60) - self.window_minutes) * 60
+        while self._minutes and next(iter(self._minutes)) <= cutoff:
+            self._minutes.popitem(last=False)
+
+    def snapshot(self):
+        """Current aggregates as a JSON-serializable dict"""
+        now = time.time()
+        with self._lock:
+            self._prune_minutes(now)
+
+            sources = {}
+            for source, totals in self._sources.items():
+                sources[source] = {
+                    "verifications": totals["count"],
+                    "matches": totals["matches"],
+                    "match_rate": totals["matches"] / totals["count"] if totals["count"] else None,
+                    "average_confidence": (totals["confidence_sum"] / totals["confidence_count"]
+                                           if totals["confidence_count"] else None)
+                }
+
+            current_minute = int(now // 60) * 60
+            per_minute = [{"minute": minute, "verifications": bucket["count"], "matches": bucket["matches"]}
+                          for minute, bucket in self._minutes.items()]
+            last_minute = self._minutes.get(current_minute - 60, {"count": 0})["count"]
+
+            total = sum(totals["count"] for totals in self._sources.values())
+            matches = sum(totals["matches"] for totals in self._sources.values())
+
+            return {
+                "generated_at": now,
+                "verifications": total,
+                "matches": matches,
+                "match_rate": matches / total if total else None,
+                "unique_voters_verified": len(self._voters),
+                "verifications_last_minute": last_minute,
+                "verifications_per_minute": per_minute,
+                "sources": sources,
+                "stations": {station: dict(totals) for station, totals in self._stations.items()},
+                "last_event_time": self._last_event_time
+            }
+
+    def subscribe(self):
+        """Register a push-stream subscriber; returns the queue events are delivered to"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def _publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                logger.warning("Dropping slow verification stats subscriber")
+                self.unsubscribe(subscriber)
+
+
+# Process-wide aggregates fed by FaceRecognitionSystem and FingerprintController
+verification_stats = VerificationStats()
+
+# End position of each verification log when this process started (mark_process_start):
+# records after it are counted by tail_logs, records up to it come from bootstrap_from_logs
+_process_start_positions = None
+
+# Logs followed since mark_process_start and the position each has been counted up to
+_followed_logs = None
+_tail_positions = None
+_tail_lock = threading.Lock()
+
+
+def _count_face_verification(verification_data):
+    verification_stats.record(
+        "face",
+        matched=verification_data.get("verified", False),
+        confidence=verification_data.get("similarity_score"),
+        station=verification_data.get("station_id"),
+        voter_id=verification_data.get("voter_id"),
+        timestamp=record_timestamp(verification_data)
+    )
+
+
+def _count_fingerprint_verification(verification_data):
+    verification_stats.record(
+        "fingerprint",
+        matched=verification_data.get("status") == "success",
+        confidence=verification_data.get("confidence"),
+        station=verification_data.get("station_id"),
+        voter_id=verification_data.get("voterID"),
+        timestamp=record_timestamp(verification_data)
+    )
+
+
+_RECORDERS = {"face": _count_face_verification, "fingerprint": _count_fingerprint_verification}
+
+
+def record_face_verification(verification_data):
+    """Feed a face verification log entry into the aggregates
+
+    While the logs are followed (mark_process_start) the entry is counted from
+    the log instead, so it is counted once however many processes write it.
+    """
+    if _followed_logs is not None:
+        tail_logs()
+    else:
+        _count_face_verification(verification_data)
+
+
+def record_fingerprint_verification(verification_data):
+    """Feed a fingerprint verification log entry into the aggregates (see record_face_verification)"""
+    if _followed_logs is not None:
+        tail_logs()
+    else:
+        _count_fingerprint_verification(verification_data)
+
+
+_bootstrap_lock = threading.Lock()
+_bootstrapped = False
+
+
+def mark_process_start(logs):
+    """Remember where the verification logs end, before this process logs anything, and follow them from there"""
+    global _process_start_positions, _followed_logs, _tail_positions
+    _process_start_positions = {source: log.end_position() for source, log in logs.items()}
+    _tail_positions = dict(_process_start_positions)
+    _followed_logs = logs
+
+
+def tail_logs():
+    """Count the records appended to the followed logs since the last call, by this or any other process
+
+    Each log's position advances record by record as they are counted, so a
+    record is never counted twice. Returns the number of records counted.
+    """
+    if _followed_logs is None:
+        return 0
+    counted = 0
+    with _tail_lock:
+        for source, log in _followed_logs.items():
+            position = _tail_positions[source]
+            end = log.end_position()
+            if end < position:
+                # The log was rewritten shorter; follow it from its new end
+                logger.warning(f"The {source} verification log shrank; following it from its current end")
+                _tail_positions[source] = end
+                continue
+            if end == position:
+                continue
+            for next_position, record in log.read_from(position=position):
+                _RECORDERS[source](record)
+                _tail_positions[source] = next_position
+                counted += 1
+    return counted
+
+
+def bootstrap_from_logs(logs, since):
+    """Seed the aggregates once from history written before this process started
+
+    Reads records from since (found via the logs' time seek) up to the log
+    positions taken by mark_process_start; later records are counted by
+    tail_logs. Positions, unlike the logs' second-resolution
+    timestamps, split records written in the startup second exactly.
+    """
+    global _bootstrapped
+    with _bootstrap_lock:
+        if _bootstrapped:
+            return
+        _bootstrapped = True
+
+        if _process_start_positions is None:
+            logger.warning("Verification logs were not marked at process start; seeding up to their current end")
+        ends = _process_start_positions or {source: log.end_position() for source, log in logs.items()}
+
+        loaded = 0
+        for source, log in logs.items():
+            for next_position, record in log.read_from(start_time=since):
+                if next_position > ends.get(source, 0):
+                    break
+                timestamp = record_timestamp(record)
+                if timestamp is None or timestamp < since:
+                    continue
+                _RECORDERS[source](record)
+                loaded += 1
+        logger.info(f"Seeded verification stats with {loaded} records from the logs")
@@ -0,0 +1,796 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import bisect
+import tempfile
+import threading
+from datetime import datetime
+
+logger = logging.getLogger("Storage")
+
+# Storage backend for registration and verification records: "json" (default) or "sqlite"
+STORE_BACKEND = os.environ.get("BIOMETRIC_STORE", "json").lower()
+SQLITE_PATH = os.environ.get("BIOMETRIC_DB", "biometrics.db")
+
+# Append-only logs get a sparse (offset, time) index entry every INDEX_INTERVAL_BYTES
+INDEX_INTERVAL_BYTES = 64 * 1024
+
+
+class StorageError(Exception):
+    """Raised when a store cannot be read or written safely"""
+
+
+# One in-process lock per file: fcntl/msvcrt locks are per process, so threads need their own
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock_for(path):
+    key = os.path.abspath(path)
+    with _thread_locks_guard:
+        lock = _thread_locks.get(key)
+        if lock is None:
+            lock = threading.RLock()
+            _thread_locks[key] = lock
+        return lock
+
+
+class FileLock:
+    """Exclusive lock across threads and processes, held on a side file next to the data file"""
+
+    def __init__(self, path, timeout=10.0):
+        self.lock_path = path + ".lock"
+        self.timeout = timeout
+        self._thread_lock = _thread_lock_for(path)
+        self._local = threading.local()
+
+    def __enter__(self):
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise StorageError(f"Timed out waiting for lock on {self.lock_path}")
+
+        # Re-entrant within a thread: only the outermost acquire takes the OS lock
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            try:
+                self._local.handle = self._acquire_os_lock()
+            except Exception:
+                self._thread_lock.release()
+                raise
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            self._release_os_lock(self._local.handle)
+            self._local.handle = None
+        self._thread_lock.release()
+
+    def _acquire_os_lock(self):
+        handle = open(self.lock_path, 'a+')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                if os.name == 'nt':
+                    import msvcrt
+                    handle.seek(0)
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except OSError:
+                if time.monotonic() >= deadline:
+                    handle.close()
+                    raise StorageError(f"Timed out waiting for lock on {self.lock_path}")
+                time.sleep(0.01)
+
+    def _release_os_lock(self, handle):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write JSON to a temp file in the same directory, fsync it, then rename over the target
+
+    Readers see either the old file or the new one, never a truncated file,
+    even if the process dies mid-write.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    _fsync_directory(directory)
+
+
+def _fsync_directory(directory):
+    """Persist a rename into directory (not supported on Windows)"""
+    if os.name != 'nt':
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def iter_json_array(f, block_size=1 << 16):
+    """Yield the items of a JSON array from a text file one at a time, without loading the whole file"""
+    name = getattr(f, 'name', 'file')
+    decoder = json.JSONDecoder()
+    buffer = ""
+    while not buffer:
+        more = f.read(block_size)
+        if not more:
+            break
+        buffer = more.lstrip()
+    if not buffer.startswith("["):
+        raise StorageError(f"{name} does not contain a list of records")
+    buffer = buffer[1:]
+    first = True
+    while True:
+        buffer = buffer.lstrip()
+        if first and buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+            rest = buffer[end:].lstrip()
+        except json.JSONDecodeError:
+            item, rest = None, ""
+        # An item only counts once the ',' or ']' after it has been read (a number may continue in the next block)
+        if not rest[:1] or rest[0] not in ",]":
+            more = f.read(block_size)
+            if not more:
+                raise StorageError(f"{name} is not a valid JSON list of records")
+            buffer += more
+            continue
+        yield item
+        if rest[0] == "]":
+            return
+        buffer = rest[1:]
+        first = False
+
+
+class _JsonArrayWriter:
+    """Write records one at a time as a JSON array to a temp file next to path"""
+
+    def __init__(self, path, indent=2):
+        self.directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=self.directory)
+        self.file = os.fdopen(fd, 'w')
+        self.file.write("[")
+        self.indent = indent
+        self.count = 0
+
+    def write(self, record):
+        self.file.write(("," if self.count else "") + "\n" + json.dumps(record, indent=self.indent))
+        self.count += 1
+
+    def finish(self):
+        self.file.write("\n]" if self.count else "]")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def replace(self, path):
+        self.finish()
+        os.replace(self.temp_path, path)
+        _fsync_directory(self.directory)
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class _JsonFileImport:
+    """Records staged in a temp file, swapped into a JsonFileStore by commit()"""
+
+    def __init__(self, store, mode, key):
+        self.store = store
+        self.mode = mode
+        self.key = key
+        self.keys = set()
+        self.staged = _JsonArrayWriter(store.path, store.indent)
+        self.count = 0
+
+    def write(self, records):
+        for record in records:
+            self.staged.write(record)
+            self.keys.add(str(record.get(self.key)))
+            self.count += 1
+
+    def commit(self):
+        with self.store.lock:
+            if self.mode == "replace":
+                self.staged.replace(self.store.path)
+                return
+            # Merge: the kept records first, then the staged ones in archive order
+            self.staged.finish()
+            merged = _JsonArrayWriter(self.store.path, self.store.indent)
+            try:
+                for record in self.store.iter_records():
+                    if str(record.get(self.key)) not in self.keys:
+                        merged.write(record)
+                with open(self.staged.temp_path, 'r') as f:
+                    for record in iter_json_array(f):
+                        merged.write(record)
+                merged.replace(self.store.path)
+            except Exception:
+                merged.discard()
+                raise
+            finally:
+                self.staged.discard()
+
+    def abort(self):
+        self.staged.discard()
+
+
+class JsonFileStore:
+    """List of records in a JSON file, rewritten atomically under a file lock"""
+
+    backend = "json"
+
+    def __init__(self, path, indent=2):
+        self.path = path
+        self.indent = indent
+        self.lock = FileLock(path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def initialize(self):
+        """Create an empty store if none exists yet; returns True if it was created"""
+        with self.lock:
+            if self.exists():
+                return False
+            atomic_write_json(self.path, [], self.indent)
+            return True
+
+    def load(self):
+        """Return all records; a missing file is an empty store, a corrupt one is an error"""
+        if not self.exists():
+            return []
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise StorageError(f"{self.path} is not valid JSON: {e}")
+
+        if not isinstance(data, list):
+            raise StorageError(f"{self.path} does not contain a list of records")
+        return data
+
+    def iter_records(self):
+        """Yield the records one at a time; a write during the read does not affect it (files are replaced, not rewritten)"""
+        if not self.exists():
+            return
+        with open(self.path, 'r') as f:
+            yield from iter_json_array(f)
+
+    def begin_import(self, mode, key):
+        """Stage records for a bulk replace or merge (by key); nothing changes until commit()"""
+        return _JsonFileImport(self, mode, key)
+
+    def save(self, records):
+        with self.lock:
+            atomic_write_json(self.path, records, self.indent)
+
+    def update(self, mutator):
+        """Read-modify-write under the lock; mutator edits the list in place and its result is returned"""
+        with self.lock:
+            records = self.load()
+            result = mutator(records)
+            atomic_write_json(self.path, records, self.indent)
+            return result
+
+    def append(self, record):
+        self.update(lambda records: records.append(record))
+
+    def extend(self, new_records):
+        self.update(lambda records: records.extend(new_records))
+
+    def clear(self):
+        """Delete the store; returns True if there was anything to delete"""
+        with self.lock:
+            if not self.exists():
+                return False
+            os.remove(self.path)
+            return True
+
+    def version(self):
+        """Opaque token that changes whenever the stored records change
+
+        Every write replaces the file, so the inode tells apart two same-size
+        rewrites within one mtime tick.
+        """
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+
+class SqliteStore:
+    """List of records in an SQLite table (WAL mode), one JSON document per row
+
+    Appends are single-row inserts, and concurrent readers never block the writer.
+    The store keeps a version counter bumped in the same transaction as every write.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, db_path, table, legacy_json_path=None):
+        self.db_path = db_path
+        self.table = table
+        self.path = legacy_json_path
+        self._local = threading.local()
+        self._ensure_schema()
+
+        if legacy_json_path:
+            self._import_legacy_json(legacy_json_path)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _ensure_schema(self):
+        connection = self._connect()
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                           f"(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS store_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        connection.execute("INSERT OR IGNORE INTO store_versions (name, version) VALUES (?, 0)", (self.table,))
+
+    def _import_legacy_json(self, json_path):
+        """Copy records from the old JSON file the first time the table is used"""
+        # Version 0 means the table has never been written, so a cleared store is not re-imported
+        if not os.path.exists(json_path) or self.version() != 0:
+            return
+        try:
+            records = JsonFileStore(json_path).load()
+        except StorageError as e:
+            logger.error(f"Not importing {json_path} into SQLite: {e}")
+            return
+        if records:
+            self.extend(records)
+            logger.info(f"Imported {len(records)} records from {json_path} into SQLite table {self.table}")
+
+    def _write(self, statements):
+        """Run write statements and bump the version in one IMMEDIATE transaction"""
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(connection)
+            connection.execute("UPDATE store_versions SET version = version + 1 WHERE name = ?", (self.table,))
+            connection.execute("COMMIT")
+            return result
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def exists(self):
+        return self.count() > 0
+
+    def initialize(self):
+        return False
+
+    def count(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def load(self):
+        rows = self._connect().execute(f"SELECT data FROM {self.table} ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def iter_records(self, batch_size=500):
+        """Yield the records in batches from one read snapshot, on a connection of its own"""
+        connection = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+        try:
+            connection.execute("BEGIN")
+            position = 0
+            while True:
+                rows = connection.execute(f"SELECT id, data FROM {self.table} WHERE id > ? ORDER BY id LIMIT ?",
+                                          (position, batch_size)).fetchall()
+                if not rows:
+                    break
+                for row_id, data in rows:
+                    position = row_id
+                    yield json.loads(data)
+        finally:
+            connection.close()
+
+    def begin_import(self, mode, key):
+        """Stage records for a bulk replace or merge (by key); nothing changes until commit()"""
+        return _SqliteImport(self, mode, key)
+
+    def save(self, records):
+        def replace_all(connection):
+            connection.execute(f"DELETE FROM {self.table}")
+            connection.executemany(f"INSERT INTO {self.table} (data) VALUES (?)",
+                                   [(json.dumps(record),) for record in records])
+        self._write(replace_all)
+
+    def update(self, mutator):
+        def read_modify_write(connection):
+            rows = connection.execute(f"SELECT data FROM {self.table} ORDER BY id").fetchall()
+            records = [json.loads(row[0]) for row in rows]
+            result = mutator(records)
+            connection.execute(f"DELETE FROM {self.table}")
+            connection.executemany(f"INSERT INTO {self.table} (data) VALUES (?)",
+                                   [(json.dumps(record),) for record in records])
+            return result
+        return self._write(read_modify_write)
+
+    def append(self, record):
+        self._write(lambda connection: connection.execute(
+            f"INSERT INTO {self.table} (data) VALUES (?)", (json.dumps(record),)))
+
+    def extend(self, new_records):
+        self._write(lambda connection: connection.executemany(
+            f"INSERT INTO {self.table} (data) VALUES (?)", [(json.dumps(record),) for record in new_records]))
+
+    def clear(self):
+        had_records = self.exists()
+        self._write(lambda connection: connection.execute(f"DELETE FROM {self.table}"))
+        return had_records
+
+    def version(self):
+        row = self._connect().execute("SELECT version FROM store_versions WHERE name = ?", (self.table,)).fetchone()
+        return row[0] if row else None
+
+    def end_position(self):
+        """Position after the last record written so far"""
+        return self._connect().execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table}").fetchone()[0]
+
+    def seek_time(self, start_time):
+        """Position just before the first record at or after start_time
+
+        Appends are time-ordered, so this is a binary search over row ids, a
+        single-row query per step instead of a scan of the table.
+        """
+        connection = self._connect()
+        low, high = connection.execute(f"SELECT COALESCE(MIN(id), 1), COALESCE(MAX(id), 0) + 1 FROM {self.table}").fetchone()
+        while low < high:
+            middle = (low + high) // 2
+            row = connection.execute(f"SELECT id, data FROM {self.table} WHERE id >= ? ORDER BY id LIMIT 1",
+                                     (middle,)).fetchone()
+            timestamp = record_timestamp(json.loads(row[1])) if row else None
+            if row is not None and timestamp is not None and timestamp < start_time:
+                low = row[0] + 1
+            else:
+                high = middle
+        return low - 1
+
+    def read_from(self, position=None, start_time=None, batch_size=500):
+        """Yield (next_position, record) from the row after position, fetching in batches
+
+        Row ids are the positions, so resuming needs no index. Without a position,
+        start_time starts the read near it (seek_time); callers still filter by time.
+        """
+        if position is None and start_time is not None:
+            position = self.seek_time(start_time)
+        position = position or 0
+        connection = self._connect()
+        while True:
+            rows = connection.execute(f"SELECT id, data FROM {self.table} WHERE id > ? ORDER BY id LIMIT ?",
+                                      (position, batch_size)).fetchall()
+            if not rows:
+                return
+            for row_id, data in rows:
+                position = row_id
+                yield row_id, json.loads(data)
+
+
+class _SqliteImport:
+    """Records staged in a side table, moved into the store's table in one transaction by commit()"""
+
+    def __init__(self, store, mode, key):
+        self.store = store
+        self.mode = mode
+        self.key_path = f"$.{key}"
+        self.staging = f"{store.table}_import"
+        self.count = 0
+        connection = store._connect()
+        connection.execute(f"DROP TABLE IF EXISTS {self.staging}")
+        connection.execute(f"CREATE TABLE {self.staging} (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+
+    def write(self, records):
+        rows = [(json.dumps(record),) for record in records]
+        connection = self.store._connect()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(f"INSERT INTO {self.staging} (data) VALUES (?)", rows)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self.count += len(rows)
+
+    def commit(self):
+        table, staging = self.store.table, self.staging
+
+        def move(connection):
+            if self.mode == "replace":
+                connection.execute(f"DELETE FROM {table}")
+            else:
+                connection.execute(
+                    f"DELETE FROM {table} WHERE CAST(json_extract(data, ?) AS TEXT) IN "
+                    f"(SELECT CAST(json_extract(data, ?) AS TEXT) FROM {staging})", (self.key_path, self.key_path))
+            connection.execute(f"INSERT INTO {table} (data) SELECT data FROM {staging} ORDER BY id")
+            connection.execute(f"DROP TABLE {staging}")
+        self.store._write(move)
+
+    def abort(self):
+        self.store._connect().execute(f"DROP TABLE IF EXISTS {self.staging}")
+
+
+def record_timestamp(record):
+    """Epoch seconds of a verification record (face 'verification_time' or fingerprint 'timestamp')"""
+    value = record.get('timestamp') or record.get('verification_time')
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+        try:
+            return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            pass
+    return None
+
+
+class JsonLinesLog:
+    """Append-only log with one JSON record per line and a sparse time index
+
+    Appending writes a single line instead of rewriting the whole file. A side
+    file (<log>.idx) holds an (offset, time) entry roughly every
+    INDEX_INTERVAL_BYTES, so readers can seek close to a start time and stream
+    forward without parsing the log from the beginning.
+    """
+
+    backend = "json"
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock = FileLock(path)
+        self._index_cache = None
+        self._index_cache_key = None
+        self._last_indexed_offset = None
+
+        if legacy_json_path:
+            self._import_legacy_json(legacy_json_path)
+
+    def _import_legacy_json(self, json_path):
+        """Convert an old JSON-array log to JSON lines once, keeping the original as .migrated"""
+        with self.lock:
+            if os.path.exists(self.path) or not os.path.exists(json_path):
+                return
+            try:
+                records = JsonFileStore(json_path).load()
+            except StorageError as e:
+                logger.error(f"Not migrating {json_path}: {e}")
+                return
+            self._rewrite(records)
+            os.replace(json_path, json_path + ".migrated")
+            logger.info(f"Migrated {len(records)} records from {json_path} to {self.path}")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def initialize(self):
+        with self.lock:
+            if self.exists():
+                return False
+            open(self.path, 'a').close()
+            return True
+
+    def _read_last_indexed_offset(self):
+        index = self._load_index()
+        return index[-1][0] if index else None
+
+    def _write_lines(self, records):
+        """Append records to the log and index; caller holds the lock"""
+        if self._last_indexed_offset is None:
+            self._last_indexed_offset = self._read_last_indexed_offset()
+
+        index_lines = []
+        with open(self.path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            lines = []
+            for record in records:
+                line = (json.dumps(record) + "\n").encode('utf-8')
+                if self._last_indexed_offset is None or offset - self._last_indexed_offset >= INDEX_INTERVAL_BYTES:
+                    index_lines.append(json.dumps({"offset": offset, "time": record_timestamp(record) or time.time()}))
+                    self._last_indexed_offset = offset
+                lines.append(line)
+                offset += len(line)
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+        if index_lines:
+            with open(self.index_path, 'a') as f:
+                f.write("\n".join(index_lines) + "\n")
+
+    def _rewrite(self, records):
+        """Replace the whole log and rebuild its index; caller holds the lock"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".", suffix=".tmp", dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.replace(temp_path, self.path)
+        self._last_indexed_offset = None
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """Recreate the sparse index by scanning the log"""
+        with self.lock:
+            entries = []
+            last_offset = None
+            for offset, _, record in self._scan(0):
+                if last_offset is None or offset - last_offset >= INDEX_INTERVAL_BYTES:
+                    entries.append(json.dumps({"offset": offset, "time": record_timestamp(record) or 0.0}))
+                    last_offset = offset
+            with open(self.index_path, 'w') as f:
+                f.write("".join(entry + "\n" for entry in entries))
+            self._last_indexed_offset = last_offset
+
+    def _load_index(self):
+        """Return [(offset, time), ...] from the index file, cached until it grows"""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return []
+        if self._index_cache is not None and self._index_cache_key == size:
+            return self._index_cache
+
+        entries = []
+        with open(self.index_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries.append((entry["offset"], entry["time"]))
+                except (json.JSONDecodeError, KeyError):
+                    continue
+        self._index_cache = entries
+        self._index_cache_key = size
+        return entries
+
+    def seek_time(self, start_time):
+        """Offset of the last indexed record at or before start_time (0 if none)"""
+        index = self._load_index()
+        times = [entry[1] for entry in index]
+        position = bisect.bisect_left(times, start_time) - 1
+        return index[position][0] if position >= 0 else 0
+
+    def _scan(self, offset):
+        """Yield (offset, next_offset, record) for complete lines from offset onwards"""
+        if not self.exists():
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                # A line without its newline is still being written
+                if not line or not line.endswith(b"\n"):
+                    return
+                next_offset = offset + len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable line at offset {offset} in {self.path}")
+                    offset = next_offset
+                    continue
+                yield offset, next_offset, record
+                offset = next_offset
+
+    def end_position(self):
+        """Position after the last complete record written so far"""
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def read_from(self, position=None, start_time=None):
+        """Yield (next_position, record) from position, or from near start_time via the index"""
+        if position is None:
+            position = self.seek_time(start_time) if start_time is not None else 0
+        for _, next_offset, record in self._scan(position):
+            yield next_offset, record
+
+    def load(self):
+        return [record for _, _, record in self._scan(0)]
+
+    def append(self, record):
+        with self.lock:
+            self._write_lines([record])
+
+    def extend(self, new_records):
+        with self.lock:
+            self._write_lines(new_records)
+
+    def save(self, records):
+        with self.lock:
+            self._rewrite(records)
+
+    def update(self, mutator):
+        with self.lock:
+            records = self.load()
+            result = mutator(records)
+            self._rewrite(records)
+            return result
+
+    def clear(self):
+        with self.lock:
+            existed = self.exists()
+            for path in (self.path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._last_indexed_offset = None
+            return existed
+
+    def version(self):
+        """Appends grow the file and rewrites replace it (a new inode)"""
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+
+def _table_name(path):
+    """Derive an SQLite table name from a JSON file name (verification_log.json -> verification_log)"""
+    base = os.path.splitext(os.path.basename(path))[0]
+    return "".join(ch if ch.isalnum() else "_" for ch in base)
+
+
+def open_store(path, backend=None):
+    """Open the record store for a data file using the configured backend"""
+    backend = (backend or STORE_BACKEND).lower()
+    if backend == "json":
+        return JsonFileStore(path)
+    if backend == "sqlite":
+        return SqliteStore(SQLITE_PATH, _table_name(path), legacy_json_path=path)
+    raise ValueError(f"Unknown storage backend '{backend}'. Use 'json' or 'sqlite'")
+
+
+def open_log(path, backend=None):
+    """Open an append-only log (verification history) for a data file
+
+    With the JSON backend the records live in <name>.jsonl next to the old
+    <name>.json, which is migrated on first use.
+    """
+    backend = (backend or STORE_BACKEND).lower()
+    if backend == "json":
+        return JsonLinesLog(os.path.splitext(path)[0] + ".jsonl", legacy_json_path=path)
+    if backend == "sqlite":
+        return SqliteStore(SQLITE_PATH, _table_name(path), legacy_json_path=path)
+    raise ValueError(f"Unknown storage backend '{backend}'. Use 'json' or 'sqlite'")
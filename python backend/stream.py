@@ -0,0 +1,415 @@
+import os
+import time
+import uuid
+import queue
+import struct
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from detectors import get_detector, _iou
+from preprocess import get_preprocessor
+from quality import gate_face_quality, QualityGateError, QUALITY_GATE_MODES
+import liveness
+
+logger = logging.getLogger("FaceStream")
+
+# A detection continues a track when it overlaps the track's last box this much
+TRACK_IOU = 0.3
+# Processed frames a track may go undetected before it is reported lost
+TRACK_MAX_MISSES = 3
+# Unmatched faces are re-encoded every N frames; matched ones are re-checked less often
+REENCODE_INTERVAL = 5
+REVERIFY_INTERVAL = 30
+# Seconds before the same voter is logged again (as in voting_process)
+VERIFICATION_COOLDOWN = 3
+# Sessions without a frame for this long are closed
+SESSION_IDLE_SECONDS = 60
+# Open sessions (each with its own worker thread) allowed at once; further opens are refused
+STREAM_MAX_SESSIONS = int(os.environ.get("STREAM_MAX_SESSIONS", 16))
+EVENT_QUEUE_SIZE = 256
+# Upper bound on one length-prefixed frame in a chunked upload
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+
+
+class SessionLimitReached(Exception):
+    """Every stream session slot is taken; the client should retry later"""
+
+    def __init__(self, limit):
+        super().__init__(f"Server busy: {limit} stream sessions already open")
+        self.limit = limit
+
+
+class FaceTrack:
+    """A face followed across frames so it is not re-encoded on every frame"""
+
+    __slots__ = ("track_id", "box", "misses", "encoded_at", "voter_id", "voter_name", "similarity",
+                 "quality_reasons", "liveness", "awaiting_log")
+
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.misses = 0
+        self.encoded_at = None
+        self.voter_id = None
+        self.voter_name = None
+        self.similarity = None
+        self.quality_reasons = None
+        self.liveness = None
+        self.awaiting_log = False
+
+
+class StreamSession:
+    """Server-side live verification loop fed with JPEG frames from a client
+
+    Frames go into a one-slot mailbox: when the worker is still busy, a newer
+    frame replaces the waiting one (and is counted as dropped) so latency never
+    builds up. The worker detects faces, tracks them by box overlap, encodes
+    only new or stale tracks, matches them against the roster, and queues
+    events for the transport (WebSocket or server-sent events) to deliver.
+    With liveness on, each track also feeds a background liveness monitor;
+    in enforce mode a match is only logged ('verified') once it passes.
+    """
+
+    def __init__(self, face_system, detector=None, threshold=0.6, log_verifications=True, quality_gate=None,
+                 liveness_mode=None):
+        self.session_id = uuid.uuid4().hex
+        self.face_system = face_system
+        self.detector = get_detector(detector)
+        self.threshold = threshold
+        self.quality_gate = quality_gate
+        if quality_gate and quality_gate.lower() not in QUALITY_GATE_MODES:
+            raise ValueError(f"Unknown quality gate mode '{quality_gate}'. Available: {', '.join(QUALITY_GATE_MODES)}")
+        self.liveness_mode = liveness.resolve_mode(liveness_mode)
+        self.log_verifications = log_verifications
+
+        self.events = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._condition = threading.Condition()
+        self._pending = None
+        self._closed = False
+
+        self._tracks = []
+        self._next_track_id = 1
+        self._last_logged = {}
+
+        self.frames_received = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.last_latency_ms = None
+        self.last_activity = time.time()
+
+        self._worker = threading.Thread(target=self._run, name=f"stream-{self.session_id[:8]}", daemon=True)
+        self._worker.start()
+
+    def submit_frame(self, jpeg_bytes):
+        """Hand a frame to the worker; returns False if it replaced one still waiting"""
+        with self._condition:
+            if self._closed:
+                raise ValueError("Stream session is closed")
+            self.frames_received += 1
+            self.last_activity = time.time()
+
+            replaced = self._pending is not None
+            if replaced:
+                self.frames_dropped += 1
+            self._pending = (self.frames_received, time.perf_counter(), jpeg_bytes)
+            self._condition.notify()
+            return not replaced
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify()
+        for track in self._tracks:
+            if track.liveness is not None:
+                track.liveness.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def next_event(self, timeout=None):
+        """Next queued event, or None after timeout"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain_events(self):
+        """All currently queued events"""
+        drained = []
+        while True:
+            try:
+                drained.append(self.events.get_nowait())
+            except queue.Empty:
+                return drained
+
+    def stats(self):
+        return {
+            "session_id": self.session_id,
+            "detector": self.detector.name,
+            "frames_received": self.frames_received,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "active_tracks": len(self._tracks),
+            "last_latency_ms": self.last_latency_ms
+        }
+
+    def _emit(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # A client that stopped reading loses its oldest events, not the newest
+            try:
+                self.events.get_nowait()
+            except queue.Empty:
+                pass
+            self.events.put_nowait(event)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                frame_number, received_at, jpeg_bytes = self._pending
+                self._pending = None
+
+            try:
+                self._process_frame(frame_number, jpeg_bytes)
+            except Exception as e:
+                logger.error(f"Error processing stream frame {frame_number}: {e}")
+                self._emit({"type": "error", "frame": frame_number, "message": str(e)})
+                continue
+
+            self.frames_processed += 1
+            self.last_latency_ms = (time.perf_counter() - received_at) * 1000
+
+    def _update_tracks(self, face_locations):
+        """Associate detections with existing tracks; returns (tracks in detection order, lost tracks)"""
+        unmatched = list(self._tracks)
+        current = []
+        for box in face_locations:
+            best = max(unmatched, key=lambda track: _iou(track.box, box), default=None)
+            if best is not None and _iou(best.box, box) >= TRACK_IOU:
+                unmatched.remove(best)
+                best.box = box
+                best.misses = 0
+                current.append(best)
+            else:
+                track = FaceTrack(self._next_track_id, box)
+                self._next_track_id += 1
+                current.append(track)
+
+        lost = []
+        for track in unmatched:
+            track.misses += 1
+            if track.misses > TRACK_MAX_MISSES:
+                lost.append(track)
+            else:
+                current.append(track)
+
+        self._tracks = current
+        return [track for track in current if track.misses == 0], lost
+
+    def _process_frame(self, frame_number, jpeg_bytes):
+        image = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode frame")
+
+        # Detection runs on the BGR frame; only face regions are converted, one at a time
+        visible, lost = self._update_tracks(self.detector.detect_bgr(image))
+        for track in lost:
+            if track.liveness is not None:
+                track.liveness.close()
+            self._emit({"type": "face_lost", "track_id": track.track_id, "voter_id": track.voter_id})
+
+        # Only new tracks and tracks due for a re-check pay for an encoding
+        due = [track for track in visible if track.encoded_at is None or
+               frame_number - track.encoded_at >= (REVERIFY_INTERVAL if track.voter_id is not None
+                                                   else REENCODE_INTERVAL)]
+        roster = self.face_system.get_match_roster() if due else None
+        preprocessor = get_preprocessor()
+        for track in visible:
+            if track not in due and self.liveness_mode == "off":
+                continue
+
+            rgb_face, face_location = preprocessor.face_crop(image, track.box)
+
+            # Liveness sees every frame of the track, on its own thread
+            if self.liveness_mode != "off":
+                if track.liveness is None:
+                    track.liveness = liveness.LivenessMonitor()
+                track.liveness.feed(rgb_face, face_location)
+
+            if track in due and self._passes_quality_gate(track, rgb_face, face_location, frame_number):
+                encodings = self.face_system.encoder.encode(rgb_face, [face_location])
+                if encodings:
+                    first_check = track.encoded_at is None
+                    track.encoded_at = frame_number
+                    self._match_track(track, encodings[0], roster, frame_number, first_check)
+
+            if track.awaiting_log:
+                self._verify_track(track, frame_number)
+
+        self._emit({
+            "type": "faces",
+            "frame": frame_number,
+            "faces": [{"track_id": track.track_id, "box": list(track.box), "voter_id": track.voter_id,
+                       "voter_name": track.voter_name} for track in visible]
+        })
+
+    def _passes_quality_gate(self, track, rgb_face, face_location, frame_number):
+        """Gate a track before encoding; tells the client once per change of failure reasons"""
+        try:
+            gate_face_quality(rgb_face, face_location, self.quality_gate)
+            track.quality_reasons = None
+            return True
+        except QualityGateError as qe:
+            if qe.quality["reasons"] != track.quality_reasons:
+                track.quality_reasons = qe.quality["reasons"]
+                self._emit({"type": "quality", "track_id": track.track_id, "frame": frame_number,
+                            "failed_checks": qe.quality["failed_checks"], "reasons": qe.quality["reasons"]})
+            return False
+
+    def _match_track(self, track, encoding, roster, frame_number, first_check):
+        matches = self.face_system.match_roster(encoding, roster, threshold=self.threshold)
+        previous = track.voter_id
+
+        if matches:
+            record, similarity = max(matches, key=lambda match: match[1])
+            track.voter_id, track.voter_name, track.similarity = record.voter_id, record.voter_name, similarity
+        else:
+            track.voter_id = track.voter_name = track.similarity = None
+
+        # Re-checks that confirm the previous result stay quiet
+        if not first_check and track.voter_id == previous:
+            return
+
+        if track.voter_id is None:
+            self._emit({"type": "no_match", "track_id": track.track_id, "frame": frame_number,
+                        "box": list(track.box)})
+            return
+
+        self._emit({
+            "type": "match",
+            "track_id": track.track_id,
+            "frame": frame_number,
+            "box": list(track.box),
+            "voter_id": track.voter_id,
+            "voter_name": track.voter_name,
+            "similarity_score": float(track.similarity),
+            "live": track.liveness.is_live if track.liveness is not None else None
+        })
+        track.awaiting_log = True
+
+    def _verify_track(self, track, frame_number):
+        """Accept a matched track once liveness allows it: log it and send 'verified'"""
+        if track.voter_id is None:
+            track.awaiting_log = False
+            return
+        if self.liveness_mode == "enforce" and not track.liveness.is_live:
+            return
+        track.awaiting_log = False
+
+        liveness_result = track.liveness.snapshot() if track.liveness is not None else None
+        self._emit({"type": "verified", "track_id": track.track_id, "frame": frame_number,
+                    "voter_id": track.voter_id, "voter_name": track.voter_name, "liveness": liveness_result})
+
+        now = time.time()
+        if not self.log_verifications or now - self._last_logged.get(track.voter_id, 0) <= VERIFICATION_COOLDOWN:
+            return
+        self._last_logged[track.voter_id] = now
+
+        verification_data = {
+            "voter_name": track.voter_name,
+            "voter_id": track.voter_id,
+            "similarity_score": float(track.similarity),
+            "verified": True,
+            "stream_session": self.session_id
+        }
+        if liveness_result is not None:
+            verification_data["liveness"] = liveness_result
+        self.face_system.log_verification(verification_data)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _reap_idle_sessions():
+    now = time.time()
+    with _sessions_lock:
+        idle = [session for session in _sessions.values()
+                if session.closed or now - session.last_activity > SESSION_IDLE_SECONDS]
+        for session in idle:
+            del _sessions[session.session_id]
+    for session in idle:
+        session.close()
+        logger.info(f"Closed idle stream session {session.session_id}")
+
+
+def create_session(face_system, detector=None, threshold=0.6, quality_gate=None, liveness_mode=None):
+    """Open a session; raises SessionLimitReached when STREAM_MAX_SESSIONS are already open"""
+    _reap_idle_sessions()
+    with _sessions_lock:
+        if len(_sessions) >= STREAM_MAX_SESSIONS:
+            raise SessionLimitReached(STREAM_MAX_SESSIONS)
+    session = StreamSession(face_system, detector=detector, threshold=threshold, quality_gate=quality_gate,
+                            liveness_mode=liveness_mode)
+    with _sessions_lock:
+        # Checked again: other sessions may have opened while this one was set up
+        full = len(_sessions) >= STREAM_MAX_SESSIONS
+        if not full:
+            _sessions[session.session_id] = session
+    if full:
+        session.close()
+        raise SessionLimitReached(STREAM_MAX_SESSIONS)
+    logger.info(f"Opened stream session {session.session_id} ({session.detector.name})")
+    return session
+
+
+def get_session(session_id):
+    """Look up an open session; raises KeyError when unknown or expired"""
+    _reap_idle_sessions()
+    with _sessions_lock:
+        return _sessions[session_id]
+
+
+def close_session(session_id):
+    with _sessions_lock:
+        session = _sessions.pop(session_id, None)
+    if session is not None:
+        session.close()
+        logger.info(f"Closed stream session {session_id}")
+    return session
+
+
+def read_frames(stream):
+    """Yield frames from a body of 4-byte big-endian length prefixes, each followed by a JPEG
+
+    Frames are yielded as soon as they are complete, so a chunked upload is
+    processed while it is still being sent.
+    """
+    while True:
+        header = stream.read(4)
+        if not header:
+            return
+        if len(header) < 4:
+            raise ValueError("Truncated frame header")
+
+        (length,) = struct.unpack(">I", header)
+        if length > MAX_FRAME_BYTES:
+            raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+
+        frame = b""
+        while len(frame) < length:
+            chunk = stream.read(length - len(frame))
+            if not chunk:
+                raise ValueError("Truncated frame")
+            frame += chunk
+        yield frame
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("TrafficRecorder")
+
+# Opt-in: set to a file path to record the shape and timing of every API request (JSON lines)
+TRAFFIC_RECORD_FILE = os.environ.get("TRAFFIC_RECORD_FILE")
+
+# Requests waiting for the writer thread; when full, new ones are dropped (and counted)
+TRAFFIC_QUEUE_SIZE = int(os.environ.get("TRAFFIC_QUEUE_SIZE", 10000))
+
+RECORDING_VERSION = 1
+
+# Number lists at least this long are treated as biometric vectors (face encodings)
+# and strings at least this long as biometric blobs (hex templates, base64 images)
+MIN_VECTOR_LENGTH = 16
+MIN_BLOB_LENGTH = 256
+
+
+def describe_json(value):
+    """A JSON body with its biometric payloads replaced by synthetic placeholders
+
+    Placeholders are {"$synthetic": "vector", "length": n} for number lists and
+    {"$synthetic": "blob", "length": n, "hex": bool} for long strings; the replay
+    tool fills them with random data of the same size. Everything else is kept,
+    so voter IDs and options replay as recorded.
+    """
+    if isinstance(value, dict):
+        return {key: describe_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if len(value) >= MIN_VECTOR_LENGTH and all(isinstance(item, (int, float)) for item in value):
+            return {"$synthetic": "vector", "length": len(value)}
+        return [describe_json(item) for item in value]
+    if isinstance(value, str) and len(value) >= MIN_BLOB_LENGTH:
+        is_hex = all(c in "0123456789abcdefABCDEF" for c in value)
+        return {"$synthetic": "blob", "length": len(value), "hex": is_hex}
+    return value
+
+
+def describe_upload(data, content_type=None):
+    """Size and, for images, dimensions of an uploaded payload; the bytes themselves are not kept"""
+    shape = {"$synthetic": "file", "bytes": len(data), "content_type": content_type}
+    if data and (not content_type or content_type.startswith("image/") or content_type == "application/octet-stream"):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is not None:
+            shape.update({"$synthetic": "image", "width": image.shape[1], "height": image.shape[0]})
+    return shape
+
+
+class TrafficRecorder:
+    """Append one JSON line per API request: when it arrived, its route and body shape, status and duration
+
+    The request thread only takes what it needs from the request and enqueues it;
+    describing uploads (which decodes images for their size) and the file write
+    happen on a background thread. The first line of the file is a header with
+    the recording start time; each entry's 't' is seconds since then.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.monotonic()
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(TRAFFIC_QUEUE_SIZE)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._write({"recording": RECORDING_VERSION, "started": datetime.now().isoformat()})
+        self._writer = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+        logger.info(f"Recording API traffic to {path}")
+
+    def capture(self, request, status, seconds, arrived):
+        """Queue one finished request (a Flask request); arrived is its time.monotonic() arrival"""
+        entry = {
+            "t": round(arrived - self.started, 4),
+            "method": request.method,
+            "rule": request.url_rule.rule if request.url_rule else None,
+            "path": request.path,
+            "view_args": request.view_args or {},
+            "query": request.args.to_dict(flat=False),
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3)
+        }
+        uploads = []
+        if request.is_json:
+            entry["json"] = request.get_json(silent=True)
+        elif request.mimetype in ("multipart/form-data", "application/x-www-form-urlencoded"):
+            entry["form"] = request.form.to_dict(flat=False)
+            for field, storage in request.files.items(multi=True):
+                storage.stream.seek(0)
+                uploads.append((field, storage.stream.read(), storage.mimetype))
+                storage.stream.seek(0)
+        elif request.content_length:
+            data = request.get_data(cache=True)
+            entry["body"] = {"$synthetic": "file", "bytes": request.content_length, "content_type": request.mimetype}
+            if data:
+                uploads.append((None, data, request.mimetype))
+
+        try:
+            self._queue.put_nowait((entry, uploads))
+        except queue.Full:
+            self.dropped += 1
+
+    def _describe(self, entry, uploads):
+        if "json" in entry:
+            entry["json"] = describe_json(entry["json"])
+        for field, data, content_type in uploads:
+            shape = describe_upload(data, content_type)
+            if field is None:
+                entry["body"] = shape
+            else:
+                entry.setdefault("files", {}).setdefault(field, []).append(shape)
+        return entry
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":"), default=str) + "\n")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(self._describe(*item))
+                self.recorded += 1
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                logger.error(f"Could not record request to {item[0].get('path')}: {e}")
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._queue.put(None)
+        self._writer.join(timeout=5.0)
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} request(s) from the recording: queue was full")
+        self._file.close()
+
+
+def load_recording(path):
+    """(header, entries) of a recording, entries ordered by arrival"""
+    header, entries, offset = {}, [], 0.0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "recording" in entry:
+                # A file appended to by several runs: keep the times of each run apart
+                offset = entries[-1]["t"] + 1.0 if entries else 0.0
+                header = header or entry
+            else:
+                entry["t"] += offset
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["t"])
+    return header, entries
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    """The process-wide recorder, or None unless TRAFFIC_RECORD_FILE is set"""
+    global _recorder
+    if not TRAFFIC_RECORD_FILE:
+        return None
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = TrafficRecorder(TRAFFIC_RECORD_FILE)
+        return _recorder
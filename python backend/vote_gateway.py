@@ -0,0 +1,453 @@
+import os
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+
+import requests
+
+from evm import JsonRpcClient, ChainError, encode_call, event_topic, to_quantity, from_quantity
+
+logger = logging.getLogger("VoteGateway")
+
+# Node and accounts. The node signs for STATION_ADDRESS (an unlocked account or an
+# external signer such as clef); the gateway only decides nonces and batching.
+CHAIN_RPC_URL = os.environ.get("CHAIN_RPC_URL", "http://127.0.0.1:8545")
+VOTING_CONTRACT_ADDRESS = os.environ.get("VOTING_CONTRACT_ADDRESS")
+STATION_ADDRESS = os.environ.get("STATION_ADDRESS")
+
+# A batch is sent once it holds GATEWAY_BATCH_SIZE votes or its oldest vote has
+# waited GATEWAY_BATCH_WAIT seconds. At most GATEWAY_MAX_IN_FLIGHT transactions are
+# unconfirmed at once; while they are, votes keep queueing and the next batches fill up.
+GATEWAY_BATCH_SIZE = int(os.environ.get("GATEWAY_BATCH_SIZE", 50))
+GATEWAY_BATCH_WAIT = float(os.environ.get("GATEWAY_BATCH_WAIT", 1.0))
+GATEWAY_MAX_IN_FLIGHT = int(os.environ.get("GATEWAY_MAX_IN_FLIGHT", 4))
+
+# Blocks (including the one it is in) a transaction needs before its votes count as confirmed
+GATEWAY_CONFIRMATIONS = int(os.environ.get("GATEWAY_CONFIRMATIONS", 1))
+GATEWAY_POLL_INTERVAL = float(os.environ.get("GATEWAY_POLL_INTERVAL", 0.5))
+
+# A transaction the node no longer knows after this long is treated as dropped and its votes are resent
+GATEWAY_TX_TIMEOUT = float(os.environ.get("GATEWAY_TX_TIMEOUT", 60))
+
+# Votes are only taken from voters with a successful face or fingerprint verification this recent
+VOTE_VERIFICATION_WINDOW = float(os.environ.get("VOTE_VERIFICATION_WINDOW", 600))
+
+# Gas limit per batch transaction: a fixed part plus a per-vote allowance
+GAS_PER_BATCH = int(os.environ.get("GATEWAY_GAS_PER_BATCH", 60000))
+GAS_PER_VOTE = int(os.environ.get("GATEWAY_GAS_PER_VOTE", 60000))
+
+CAST_VOTES = "castVotes(uint256[],uint256[])"
+VOTE_CAST_TOPIC = event_topic("VoteCast(uint256)")
+VOTE_REJECTED_TOPIC = event_topic("VoteRejected(uint256,uint8)")
+
+# BiometricVotingSystem.RejectReason
+REJECT_REASONS = {1: "not_registered", 2: "already_voted", 3: "invalid_candidate"}
+
+# Rejections that leave the voter free to vote again (once registered, or for a valid candidate)
+RETRYABLE_REJECTIONS = ("not_registered", "invalid_candidate")
+
+# Confirmation latencies kept for the stats percentiles
+LATENCY_SAMPLES = 1000
+
+
+def _is_nonce_conflict(error):
+    """Node errors meaning the nonce is used or taken (wording varies between clients)"""
+    message = str(error).lower()
+    return any(phrase in message for phrase in ("nonce", "replacement transaction", "already known"))
+
+
+class VoteGateway:
+    """Pipelines verified vote intents into batched castVotes transactions from one station account
+
+    submit() queues a vote and returns at once; a submitter thread groups queued
+    votes into batches, assigns each transaction the next nonce and keeps up to
+    max_in_flight transactions unconfirmed. A tracker thread polls receipts and
+    settles every vote from the contract's VoteCast / VoteRejected events.
+    Nonces are tracked locally and resynced from the node after an error or a
+    dropped transaction, whose votes are resent.
+    """
+
+    def __init__(self, client, contract_address, station_address, batch_size=None, batch_wait=None,
+                 max_in_flight=None, confirmations=None, poll_interval=None, tx_timeout=None):
+        if not contract_address or not station_address:
+            raise ValueError("Vote gateway needs VOTING_CONTRACT_ADDRESS and STATION_ADDRESS")
+        self.client = client
+        self.contract_address = contract_address.lower()
+        self.station_address = station_address.lower()
+        self.batch_size = max(1, batch_size or GATEWAY_BATCH_SIZE)
+        self.batch_wait = GATEWAY_BATCH_WAIT if batch_wait is None else batch_wait
+        self.max_in_flight = max(1, max_in_flight or GATEWAY_MAX_IN_FLIGHT)
+        self.confirmations = max(1, confirmations or GATEWAY_CONFIRMATIONS)
+        self.poll_interval = poll_interval or GATEWAY_POLL_INTERVAL
+        self.tx_timeout = tx_timeout or GATEWAY_TX_TIMEOUT
+
+        self._lock = threading.Condition()
+        self._queue = deque()            # voter IDs waiting for a batch
+        self._votes = {}                 # voter ID -> vote state
+        self._in_flight = OrderedDict()  # tx hash -> batch
+        self._sending = 0                # batches taken from the queue but not yet in flight
+        self._next_nonce = None          # owned by the submitter thread
+        self._resync_nonce = False
+        self._stopping = False
+        self._submitter = None
+        self._tracker = None
+
+        self.batches_sent = 0
+        self.votes_sent = 0
+        self.resent = 0
+        self.counts = {"confirmed": 0, "rejected": 0, "failed": 0}
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def _ensure_threads(self):
+        with self._lock:
+            if self._submitter is None or not self._submitter.is_alive():
+                self._submitter = threading.Thread(target=self._run_submitter, name="vote-submitter", daemon=True)
+                self._submitter.start()
+            if self._tracker is None or not self._tracker.is_alive():
+                self._tracker = threading.Thread(target=self._run_tracker, name="vote-tracker", daemon=True)
+                self._tracker.start()
+
+    def submit(self, voter_id, candidate_id):
+        """Queue one vote; returns its state
+
+        A voter whose vote is queued, in flight or cast is refused; one whose vote
+        failed, or was rejected as not_registered or invalid_candidate, may vote again.
+        """
+        try:
+            voter_id, candidate_id = int(voter_id), int(candidate_id)
+        except (TypeError, ValueError):
+            raise ValueError("voter_id and candidate_id must be integers")
+        if voter_id < 0 or candidate_id < 0:
+            raise ValueError("voter_id and candidate_id must not be negative")
+
+        with self._lock:
+            if self._stopping:
+                raise ValueError("Vote gateway is shutting down")
+            existing = self._votes.get(voter_id)
+            retryable = existing and (existing["status"] == "failed" or (
+                existing["status"] == "rejected" and existing.get("reason") in RETRYABLE_REJECTIONS))
+            if existing and not retryable:
+                raise ValueError(f"Voter {voter_id} already has a vote {existing['status']}")
+
+            vote = {
+                "voter_id": voter_id,
+                "candidate_id": candidate_id,
+                "status": "queued",
+                "queued_at": time.time(),
+                "attempts": 0
+            }
+            self._votes[voter_id] = vote
+            self._queue.append(voter_id)
+            self._lock.notify_all()
+            state = dict(vote)
+
+        self._ensure_threads()
+        return state
+
+    def status(self, voter_id):
+        """State of a voter's vote, or None if this gateway never saw it"""
+        with self._lock:
+            vote = self._votes.get(int(voter_id))
+            return dict(vote) if vote else None
+
+    # --- Submission ---
+
+    def _next_batch(self):
+        """Block until a batch is due and a transaction slot is free; None once stopped and drained"""
+        with self._lock:
+            while True:
+                # In-flight transactions can still be dropped and their votes requeued
+                if self._stopping and not self._queue and not self._in_flight:
+                    return None
+                if self._queue and len(self._in_flight) + self._sending < self.max_in_flight:
+                    oldest = self._votes[self._queue[0]]["queued_at"]
+                    wait = oldest + self.batch_wait - time.time()
+                    if len(self._queue) >= self.batch_size or wait <= 0 or self._stopping:
+                        break
+                    self._lock.wait(wait)
+                else:
+                    self._lock.wait()
+
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            for voter_id in batch:
+                self._votes[voter_id]["status"] = "sending"
+            self._sending += 1
+            if self._resync_nonce:
+                self._next_nonce, self._resync_nonce = None, False
+            return batch
+
+    def _run_submitter(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                logger.error(f"Unexpected error sending a batch of {len(batch)} vote(s): {e}")
+                self._fail(batch, f"Gateway error: {e}")
+            finally:
+                with self._lock:
+                    self._sending -= 1
+                    self._lock.notify_all()
+
+    def _send_batch(self, batch):
+        with self._lock:
+            candidate_ids = [self._votes[voter_id]["candidate_id"] for voter_id in batch]
+
+        if self._next_nonce is None:
+            self._next_nonce = from_quantity(self.client.call(
+                "eth_getTransactionCount", [self.station_address, "pending"]))
+            logger.info(f"Station {self.station_address} next nonce {self._next_nonce}")
+
+        nonce = self._next_nonce
+        transaction = {
+            "from": self.station_address,
+            "to": self.contract_address,
+            "data": encode_call(CAST_VOTES, batch, candidate_ids),
+            "nonce": to_quantity(nonce),
+            "gas": to_quantity(GAS_PER_BATCH + GAS_PER_VOTE * len(batch))
+        }
+
+        try:
+            tx_hash = self.client.call("eth_sendTransaction", [transaction])
+        except ChainError as e:
+            # The nonce may have been taken by another sender on this account; resync and retry
+            self._next_nonce = None
+            if _is_nonce_conflict(e):
+                logger.warning(f"Nonce {nonce} refused ({e}); resending {len(batch)} vote(s)")
+                self._requeue(batch)
+            else:
+                logger.error(f"Node refused a batch of {len(batch)} vote(s): {e}")
+                self._fail(batch, str(e))
+            return
+        except requests.RequestException as e:
+            # Unknown whether the node accepted it: resend under a fresh nonce. If the first
+            # copy did land, the resend is rejected as already_voted and settled as confirmed,
+            # so the lost send counts as an attempt.
+            self._next_nonce = None
+            logger.warning(f"Lost contact with the node sending nonce {nonce} ({e}); resending {len(batch)} vote(s)")
+            time.sleep(self.poll_interval)
+            self._requeue(batch, attempted=True)
+            return
+
+        self._next_nonce = nonce + 1
+        sent_at = time.time()
+        with self._lock:
+            self._in_flight[tx_hash] = {"nonce": nonce, "voter_ids": batch, "sent_at": sent_at}
+            for voter_id in batch:
+                vote = self._votes[voter_id]
+                vote.update({"status": "submitted", "tx_hash": tx_hash, "nonce": nonce, "submitted_at": sent_at})
+                vote["attempts"] += 1
+            self.batches_sent += 1
+            self.votes_sent += len(batch)
+            self._lock.notify_all()
+        logger.info(f"Sent {len(batch)} vote(s) in {tx_hash} (nonce {nonce})")
+
+    def _requeue(self, batch, attempted=False):
+        """Put a batch back at the front of the queue, in its original order
+
+        attempted counts a send that may have reached the node, as a confirmed
+        send would have.
+        """
+        with self._lock:
+            for voter_id in reversed(batch):
+                vote = self._votes[voter_id]
+                vote["status"] = "queued"
+                if attempted:
+                    vote["attempts"] += 1
+                self._queue.appendleft(voter_id)
+            self.resent += len(batch)
+            self._lock.notify_all()
+
+    def _fail(self, batch, error):
+        with self._lock:
+            for voter_id in batch:
+                self._votes[voter_id].update({"status": "failed", "error": error})
+            self.counts["failed"] += len(batch)
+            self._lock.notify_all()
+
+    # --- Confirmation tracking ---
+
+    def _run_tracker(self):
+        while True:
+            with self._lock:
+                while not self._in_flight:
+                    if self._stopping and not self._queue and not self._sending:
+                        return
+                    self._lock.wait(self.poll_interval)
+                pending = list(self._in_flight.items())
+
+            try:
+                head = from_quantity(self.client.call("eth_blockNumber"))
+                for tx_hash, batch in pending:
+                    self._check(tx_hash, batch, head)
+            except (ChainError, requests.RequestException) as e:
+                logger.warning(f"Could not poll the node: {e}")
+
+            time.sleep(self.poll_interval)
+
+    def _check(self, tx_hash, batch, head):
+        receipt = self.client.call("eth_getTransactionReceipt", [tx_hash])
+        if receipt is None:
+            if time.time() - batch["sent_at"] > self.tx_timeout and \
+                    self.client.call("eth_getTransactionByHash", [tx_hash]) is None:
+                # Dropped from the pool: its nonce is free again, so later transactions
+                # are stuck until it is reused
+                logger.warning(f"Transaction {tx_hash} (nonce {batch['nonce']}) was dropped; "
+                               f"resending {len(batch['voter_ids'])} vote(s)")
+                with self._lock:
+                    self._in_flight.pop(tx_hash, None)
+                    self._resync_nonce = True
+                self._requeue(batch["voter_ids"])
+            return
+
+        block = from_quantity(receipt["blockNumber"])
+        if head - block + 1 < self.confirmations:
+            return
+        self._settle(tx_hash, batch, receipt, block)
+
+    def _settle(self, tx_hash, batch, receipt, block):
+        """Record each vote's outcome from the transaction's events"""
+        outcomes = {}
+        if from_quantity(receipt.get("status", "0x1")) == 1:
+            for log in receipt.get("logs", []):
+                if log.get("address", "").lower() != self.contract_address or len(log.get("topics", [])) < 2:
+                    continue
+                voter_id = int(log["topics"][1], 16)
+                if log["topics"][0] == VOTE_CAST_TOPIC:
+                    outcomes[voter_id] = ("confirmed", None)
+                elif log["topics"][0] == VOTE_REJECTED_TOPIC:
+                    reason = REJECT_REASONS.get(int(log.get("data") or "0x0", 16), "unknown")
+                    outcomes[voter_id] = ("rejected", reason)
+
+        now = time.time()
+        with self._lock:
+            self._in_flight.pop(tx_hash, None)
+            for voter_id in batch["voter_ids"]:
+                vote = self._votes[voter_id]
+                status, reason = outcomes.get(voter_id, ("failed", "Transaction reverted"))
+                if status == "rejected" and reason == "already_voted" and vote["attempts"] > 1:
+                    # An earlier copy of this vote landed after all
+                    status, reason = "confirmed", None
+
+                vote.update({"status": status, "block": block, "settled_at": now})
+                if status == "confirmed":
+                    self._latencies.append(now - vote["queued_at"])
+                elif status == "rejected":
+                    vote["reason"] = reason
+                else:
+                    vote["error"] = reason
+                self.counts[status] += 1
+            self._lock.notify_all()
+
+        logger.info(f"Settled {tx_hash} in block {block}: "
+                    f"{sum(1 for status, _ in outcomes.values() if status == 'confirmed')}/{len(batch['voter_ids'])} cast")
+
+    # --- Reporting and shutdown ---
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            in_flight_votes = sum(len(batch["voter_ids"]) for batch in self._in_flight.values())
+            queued = len(self._queue)
+            in_flight = len(self._in_flight)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))] * 1000
+
+        return {
+            "queued": queued,
+            "in_flight_transactions": in_flight,
+            "in_flight_votes": in_flight_votes,
+            "max_in_flight": self.max_in_flight,
+            "batch_size": self.batch_size,
+            "batches_sent": self.batches_sent,
+            "votes_sent": self.votes_sent,
+            "mean_batch_size": self.votes_sent / self.batches_sent if self.batches_sent else None,
+            "resent": self.resent,
+            "next_nonce": self._next_nonce,
+            **self.counts,
+            "confirmation_p50_ms": percentile(50),
+            "confirmation_p95_ms": percentile(95)
+        }
+
+    def close(self, timeout=None):
+        """Stop taking votes, send what is queued and wait (up to timeout) for it to settle"""
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in (self._submitter, self._tracker):
+            if thread is not None:
+                thread.join(None if deadline is None else max(0, deadline - time.time()))
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_vote_gateway():
+    """The process-wide gateway for the configured node, contract and station account"""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = VoteGateway(JsonRpcClient(CHAIN_RPC_URL), VOTING_CONTRACT_ADDRESS, STATION_ADDRESS)
+        return _gateway
+
+
+def run_load(gateway, voter_ids, candidate_count, timeout):
+    """Submit one vote per voter ID and wait for all to settle; returns the gateway stats plus throughput"""
+    started = time.time()
+    for index, voter_id in enumerate(voter_ids):
+        gateway.submit(voter_id, index % candidate_count + 1)
+    gateway.close(timeout)
+    result = gateway.stats()
+    result["votes_per_sec"] = len(voter_ids) / (time.time() - started)
+    return result
+
+
+def main():
+    import json
+    import argparse
+    from chainsim import StandInChain, serve
+
+    parser = argparse.ArgumentParser(description="Compare one-vote-per-transaction with batched, pipelined submission "
+                                                 "against the local stand-in chain")
+    parser.add_argument("--votes", type=int, default=500)
+    parser.add_argument("--block-time", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=GATEWAY_BATCH_SIZE)
+    parser.add_argument("--max-in-flight", type=int, default=GATEWAY_MAX_IN_FLIGHT)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    contract, station = "0x" + "5" * 40, "0x" + "a" * 40
+    runs = [
+        # The baseline sends and confirms one vote at a time, so it gets a smaller sample
+        ("single", 1, 1, min(args.votes, 20)),
+        ("batched", args.batch_size, args.max_in_flight, args.votes)
+    ]
+    first_voter = 1
+    for label, batch_size, max_in_flight, votes in runs:
+        chain = StandInChain(contract, range(1, 2 * args.votes + 100), block_time=args.block_time,
+                             drop_rate=args.drop_rate)
+        server = serve(chain, port=0)
+        gateway = VoteGateway(JsonRpcClient(f"http://127.0.0.1:{server.server_address[1]}"), contract, station,
+                              batch_size=batch_size, max_in_flight=max_in_flight, batch_wait=args.block_time / 2,
+                              poll_interval=args.block_time / 5, tx_timeout=5 * args.block_time)
+        result = run_load(gateway, list(range(first_voter, first_voter + votes)), 3, args.timeout)
+        result.update({"run": label, "votes": votes, "block_time": args.block_time,
+                       "chain_votes_cast": len(chain.has_voted)})
+        print(json.dumps(result))
+        server.shutdown()
+        chain.close()
+        first_voter += votes
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()